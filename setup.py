@@ -49,6 +49,11 @@ setup(
 
     install_requires=requirements,
 
+    # The concurrent.futures backport for Python 2.
+    extras_require={
+        ":python_version < '3'": ['futures'],
+    },
+
     setup_requires=['pytest-runner'],
 
     tests_require=['tox',
@@ -531,6 +531,8 @@ def initialize_simulator(config):
         sim_module_str = 'inisim.' + spike_code
         if spike_code == 'temporal_mean_rate':
             sim_module_str += '_' + config.get('simulation', 'keras_backend')
+    elif simulator == 'INI_numpy':
+        sim_module_str = 'inisim.temporal_mean_rate_numpy'
     elif simulator == 'MegaSim':
         sim_module_str = 'megasim.megasim'
     if sim_module_str is None:
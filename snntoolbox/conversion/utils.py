@@ -8,6 +8,8 @@ from analog to spiking.
     :nosignatures:
 
     normalize_parameters
+    LogHistogram
+    ActivationCache
 
 @author: rbodo
 """
@@ -33,11 +35,18 @@ def normalize_parameters(model, config, **kwargs):
     Generates plots of the activity- and weight-distribution before and after
     normalization. Note that plotting the activity-distribution can be very
     time- and memory-consuming for larger networks.
+
+    With the option ``streaming``, the percentiles are estimated batch by
+    batch from a `LogHistogram` per layer (see `get_scale_facs_streaming`),
+    instead of from the activations of the whole normalization data set.
+
+    With the option ``cache_scale_facs``, scale factors are reused across runs
+    if the model, the normalization data and settings are unchanged (see
+    `get_scale_facs_store_path`).
     """
 
     import json
     from collections import OrderedDict
-    from snntoolbox.parsing.utils import get_inbound_layers_with_params
 
     print("Normalizing parameters...")
 
@@ -60,8 +69,23 @@ def normalize_parameters(model, config, **kwargs):
     # Either load scale factors from disk, or get normalization data set to
     # calculate them.
     x_norm = None
+    streaming = config.getboolean('normalization', 'streaming')
+    is_computed = False
+    store_path = None
+    if config.getboolean('normalization', 'cache_scale_facs') and \
+            ('x_norm' in kwargs or 'dataflow' in kwargs):
+        store_path = get_scale_facs_store_path(model, config, **kwargs)
     if 'scale_facs' in kwargs:
         scale_facs = kwargs[str('scale_facs')]
+    elif store_path is not None and os.path.isfile(store_path):
+        print("Loading scale factors of unchanged model and normalization "
+              "data from {}.".format(store_path))
+        with open(store_path) as f:
+            scale_facs = json.load(f, object_pairs_hook=OrderedDict)
+    elif streaming and ('x_norm' in kwargs or 'dataflow' in kwargs):
+        scale_facs = get_scale_facs_streaming(model, config, norm_dir,
+                                              **kwargs)
+        is_computed = True
     elif 'x_norm' in kwargs or 'dataflow' in kwargs:
         if 'x_norm' in kwargs:
             x_norm = kwargs[str('x_norm')]
@@ -75,6 +99,7 @@ def normalize_parameters(model, config, **kwargs):
         print("INFO: Need {} GB for layer activations.\n".format(size_str) +
               "May have to reduce size of data set used for normalization.")
         scale_facs = OrderedDict({model.layers[0].name: 1})
+        is_computed = True
     else:
         import warnings
         warnings.warn("Scale factors or normalization data set could not be "
@@ -86,6 +111,9 @@ def normalize_parameters(model, config, **kwargs):
 
     # If scale factors have not been computed in a previous run, do so now.
     if len(scale_facs) == 1:
+        compute_missing_activations(
+            [layer for layer in model.layers if len(layer.weights) > 0],
+            model, x_norm, batch_size, activ_dir)
         i = 0
         sparsity = []
         for layer in model.layers:
@@ -97,10 +125,16 @@ def normalize_parameters(model, config, **kwargs):
                                                  batch_size, activ_dir)
             nonzero_activations = activations[np.nonzero(activations)]
             sparsity.append(1 - nonzero_activations.size / activations.size)
-            del activations
             perc = get_percentile(config, i)
-            scale_facs[layer.name] = get_scale_fac(nonzero_activations, perc)
-            print("Scale factor: {:.2f}.".format(scale_facs[layer.name]))
+            if is_per_channel(layer, config):
+                scale_facs[layer.name] = get_scale_fac_per_channel(
+                    activations, perc, get_channel_axis(layer))
+            else:
+                scale_facs[layer.name] = get_scale_fac(nonzero_activations,
+                                                       perc)
+            del activations
+            print("Scale factor: {}.".format(
+                format_scale_fac(scale_facs[layer.name])))
             # Since we have calculated output activations here, check at this
             # point if the output is mostly negative, in which case we should
             # stick to softmax. Otherwise ReLU is preferred.
@@ -117,6 +151,17 @@ def normalize_parameters(model, config, **kwargs):
             #               "settings['softmax_to_relu'] = False.")
             #         settings['softmax_to_relu'] = False
             i += 1
+        np.savez_compressed(os.path.join(norm_dir, 'activations', 'sparsity'),
+                            sparsity=sparsity)
+
+    if is_computed:
+        if config.getboolean('normalization', 'threshold_balancing'):
+            if x_norm is None:
+                x_norm = kwargs[str('x_norm')] if 'x_norm' in kwargs else \
+                    kwargs[str('dataflow')].next()[0]
+            scale_facs = balance_thresholds(model, config,
+                                            x_norm[:batch_size], scale_facs)
+
         # Write scale factors to disk
         filepath = os.path.join(norm_dir, config.get('normalization',
                                                      'percentile') + '.json')
@@ -124,63 +169,20 @@ def normalize_parameters(model, config, **kwargs):
         if config.get('output', 'overwrite') or confirm_overwrite(filepath):
             with open(filepath, str('w')) as f:
                 json.dump(scale_facs, f)
-        np.savez_compressed(os.path.join(norm_dir, 'activations', 'sparsity'),
-                            sparsity=sparsity)
 
-    # Apply scale factors to normalize the parameters.
-    for layer in model.layers:
-        # Skip if layer has no parameters
-        if len(layer.weights) == 0:
-            continue
-
-        # Scale parameters
-        parameters = layer.get_weights()
-        if layer.activation.__name__ == 'softmax':
-            # When using a certain percentile or even the max, the scaling
-            # factor can be extremely low in case of many output classes
-            # (e.g. 0.01 for ImageNet). This amplifies weights and biases
-            # greatly. But large biases cause large offsets in the beginning
-            # of the simulation (spike input absent).
-            scale_fac = 1.0
-            print("Using scale factor {:.2f} for softmax layer.".format(
-                scale_fac))
-        else:
-            scale_fac = scale_facs[layer.name]
-        inbound = get_inbound_layers_with_params(layer)
-        if len(inbound) == 0:  # Input layer
-            parameters_norm = [
-                parameters[0] * scale_facs[model.layers[0].name] / scale_fac,
-                parameters[1] / scale_fac]
-        elif len(inbound) == 1:
-            parameters_norm = [
-                parameters[0] * scale_facs[inbound[0].name] / scale_fac,
-                parameters[1] / scale_fac]
-        else:
-            # In case of this layer receiving input from several layers, we can
-            # apply scale factor to bias as usual, but need to rescale weights
-            # according to their respective input.
-            parameters_norm = [parameters[0], parameters[1] / scale_fac]
-            if parameters[0].ndim == 4:
-                # In conv layers, just need to split up along channel dim.
-                offset = 0  # Index offset at input filter dimension
-                for inb in inbound:
-                    f_out = inb.filters  # Num output features of inbound layer
-                    f_in = range(offset, offset + f_out)
-                    parameters_norm[0][:, :, f_in, :] *= \
-                        scale_facs[inb.name] / scale_fac
-                    offset += f_out
-            else:
-                # Fully-connected layers need more consideration, because they
-                # could receive input from several conv layers that are
-                # concatenated and then flattened. The neuron position in the
-                # flattened layer depend on the image_data_format.
-                raise NotImplementedError
+        if store_path is not None:
+            if not os.path.exists(os.path.dirname(store_path)):
+                os.makedirs(os.path.dirname(store_path))
+            with open(store_path, str('w')) as f:
+                json.dump(scale_facs, f)
 
-        # Update model with modified parameters
-        layer.set_weights(parameters_norm)
+    # Apply scale factors to normalize the parameters.
+    apply_scale_facs(model, scale_facs)
 
     # Plot distributions of weights and activations before and after norm.
-    if 'normalization_activations' in eval(config.get('output', 'plot_vars')):
+    # In streaming mode, the activations are not stored, so skip the plots.
+    if 'normalization_activations' in eval(config.get('output', 'plot_vars')) \
+            and not streaming:
         from snntoolbox.simulation.plotting import plot_hist
         from snntoolbox.simulation.plotting import plot_max_activ_hist
 
@@ -189,6 +191,18 @@ def normalize_parameters(model, config, **kwargs):
 
         # Load original parsed model to get parameters before normalization
         weights = np.load(os.path.join(activ_dir, 'weights.npz'))
+        layers = [layer for layer in model.layers if len(layer.weights) > 0]
+        # Compute activations with modified parameters in one pass over the
+        # data set. They are written to disk batch by batch and loaded one
+        # layer at a time, like the activations before normalization.
+        if x_norm is not None:
+            import shutil
+            norm_activ_dir = os.path.join(norm_dir, 'activations_norm')
+            shutil.rmtree(norm_activ_dir, ignore_errors=True)
+            os.makedirs(norm_activ_dir)
+            cache_norm = ActivationCache(norm_activ_dir, len(x_norm),
+                                         batch_size)
+            cache_norm.fill(model, layers, x_norm)
         for idx, layer in enumerate(model.layers):
             # Skip if layer has no parameters
             if len(layer.weights) == 0:
@@ -210,14 +224,12 @@ def normalize_parameters(model, config, **kwargs):
             if activations is None or x_norm is None:
                 continue
 
-            # Compute activations with modified parameters
             nonzero_activations = activations[np.nonzero(activations)]
-            activations_norm = get_activations_layer(model.input, layer.output,
-                                                     x_norm, batch_size)
+            activations_norm = cache_norm.load(layer.name)
             activation_dict = {'Activations': nonzero_activations,
                                'Activations_norm':
                                activations_norm[np.nonzero(activations_norm)]}
-            scale_fac = scale_facs[layer.name]
+            scale_fac = np.max(scale_facs[layer.name])
             plot_hist(activation_dict, 'Activation', label, norm_dir,
                       scale_fac)
             ax = tuple(np.arange(len(layer.output_shape))[1:])
@@ -227,6 +239,645 @@ def normalize_parameters(model, config, **kwargs):
     print('')
 
 
+def apply_scale_facs(model, scale_facs):
+    """Normalize the parameters of ``model`` in place.
+
+    The weights and biases of each layer are divided by the scale factor of
+    the layer, and the weights are multiplied by the scale factor of their
+    input.
+
+    A scale factor is either a scalar, or a list with one entry per output
+    channel of the layer (option ``per_channel``). The scale factors of the
+    inbound layers are propagated to the input of a layer through the layers
+    without parameters in between (e.g. pooling, ``Flatten`` and
+    ``Concatenate``), see `get_scale_map`.
+
+    Parameters
+    ----------
+
+    model: keras.models.Model
+        The parsed model.
+    scale_facs: dict
+        The scale factor of each layer with parameters, and of the input
+        layer, keyed by layer name.
+    """
+
+    from snntoolbox.parsing.utils import get_inbound_layers, get_type
+
+    for layer in model.layers:
+        # Skip if layer has no parameters
+        if len(layer.weights) == 0:
+            continue
+
+        # Scale parameters
+        parameters = layer.get_weights()
+        if layer.activation.__name__ == 'softmax':
+            # When using a certain percentile or even the max, the scaling
+            # factor can be extremely low in case of many output classes
+            # (e.g. 0.01 for ImageNet). This amplifies weights and biases
+            # greatly. But large biases cause large offsets in the beginning
+            # of the simulation (spike input absent).
+            scale_fac = 1.0
+            print("Using scale factor {:.2f} for softmax layer.".format(
+                scale_fac))
+        else:
+            scale_fac = np.asarray(scale_facs[layer.name], float)
+
+        # Scale factor of each input channel (or input neuron of a Dense
+        # layer). In case of this layer receiving input from several layers
+        # (via Concatenate), the inputs are rescaled according to their
+        # respective source.
+        input_scales = get_channel_scales(get_scale_map(
+            as_list(get_inbound_layers(layer))[0], model, scale_facs),
+            get_channel_axis(layer))
+
+        # The input channels are in the second to last dimension of the
+        # kernel.
+        kernel = parameters[0]
+        kernel_norm = kernel * np.expand_dims(input_scales, -1)
+        if get_type(layer) == 'DepthwiseConv2D' and np.ndim(scale_fac):
+            # Output channel ``i * depth_multiplier + j`` is computed from
+            # input channel ``i``.
+            kernel_norm /= np.reshape(scale_fac, kernel.shape[-2:])
+        else:
+            kernel_norm /= scale_fac
+        parameters_norm = [kernel_norm, parameters[1] / scale_fac]
+
+        # Update model with modified parameters
+        layer.set_weights(parameters_norm)
+
+
+def as_list(layers):
+    """Wrap a single inbound layer in a list.
+
+    Depending on the Keras version, a layer with a single inbound layer
+    returns that layer instead of a list.
+    """
+
+    return list(layers) if isinstance(layers, (list, tuple)) else [layers]
+
+
+def get_channel_axis(layer):
+    """Return the channel axis of the output of ``layer``.
+
+    The batch dimension is not counted.
+    """
+
+    if getattr(layer, 'data_format', None) == 'channels_first' and \
+            len(layer.output_shape) > 2:
+        return 0
+    return -1
+
+
+def get_channel_scales(scale_map, axis):
+    """Return the scale factor of each channel of a scale map.
+
+    The entries of a channel are equal, so the first one is taken.
+    """
+
+    scale_map = np.moveaxis(scale_map, axis, -1)
+    return np.reshape(scale_map, (-1, scale_map.shape[-1]))[0]
+
+
+def broadcast_channel_scales(scale_fac, shape, axis):
+    """Broadcast a scalar or per-channel scale factor to a layer shape."""
+
+    scale_fac = np.asarray(scale_fac, float)
+    if scale_fac.ndim == 0:
+        return np.full(shape, scale_fac)
+    channel_shape = [1] * len(shape)
+    channel_shape[axis] = -1
+    return np.broadcast_to(np.reshape(scale_fac, channel_shape), shape)
+
+
+def get_scale_map(layer, model, scale_facs):
+    """Return the scale factor of each element of the output of ``layer``.
+
+    For a layer with parameters, this is its (scalar or per-channel) scale
+    factor. Layers without parameters pass on the scale factors of their
+    inputs, rearranged like the input itself (e.g. by ``Flatten`` or
+    ``Concatenate``).
+
+    Parameters
+    ----------
+
+    layer: keras.layers.Layer
+        A layer of ``model``.
+    model: keras.models.Model
+        The parsed model.
+    scale_facs: dict
+        The scale factor of each layer with parameters, and of the input
+        layer, keyed by layer name.
+
+    Returns
+    -------
+
+    scale_map: ndarray
+        Array with the shape of the layer output (without batch dimension).
+    """
+
+    from snntoolbox.parsing.utils import get_inbound_layers, get_type
+
+    output_shape = layer.output_shape
+    if isinstance(output_shape, list):  # InputLayer in newer Keras versions
+        output_shape = output_shape[0]
+    shape = tuple(output_shape[1:])
+    axis = get_channel_axis(layer)
+    if len(layer.weights) > 0:
+        return broadcast_channel_scales(scale_facs[layer.name], shape, axis)
+    inbound = [] if get_type(layer) == 'InputLayer' else \
+        as_list(get_inbound_layers(layer))
+    if len(inbound) == 0:  # Input layer
+        return broadcast_channel_scales(scale_facs[model.layers[0].name],
+                                        shape, axis)
+
+    scale_maps = [get_scale_map(inb, model, scale_facs) for inb in inbound]
+    layer_type = get_type(layer)
+    if layer_type == 'Concatenate':
+        concat_axis = layer.axis - 1 if layer.axis > 0 else layer.axis
+        return np.concatenate(scale_maps, concat_axis)
+    scale_map = scale_maps[0]
+    if layer_type == 'Flatten':
+        # With channels_first, Keras moves the channels last before
+        # flattening.
+        if getattr(layer, 'data_format', None) == 'channels_first' and \
+                scale_map.ndim > 1:
+            scale_map = np.moveaxis(scale_map, 0, -1)
+        return np.ravel(scale_map)
+    if scale_map.shape == shape:
+        return scale_map
+    if layer_type == 'Reshape':
+        return np.reshape(scale_map, shape)
+    # Pooling, padding, etc. keep the scale factor of each channel.
+    return broadcast_channel_scales(get_channel_scales(scale_map, axis),
+                                    shape, axis)
+
+
+def get_scale_fac_per_channel(activations, percentile, axis=-1):
+    """Determine the activation value at ``percentile`` of each channel.
+
+    Parameters
+    ----------
+
+    activations: np.array
+        The activations of a layer, including the batch dimension.
+    percentile: int
+        Percentile at which to determine activation.
+    axis: int
+        Channel axis of the layer, not counting the batch dimension (see
+        `get_channel_axis`).
+
+    Returns
+    -------
+
+    scale_facs: list[float]
+        Scale factor of each channel, see `get_scale_fac`.
+    """
+
+    activations = np.moveaxis(activations,
+                              axis % (activations.ndim - 1) + 1, -1)
+    activations = np.reshape(activations, (-1, activations.shape[-1]))
+    return [float(get_scale_fac(a[np.nonzero(a)], percentile))
+            for a in activations.T]
+
+
+def is_per_channel(layer, config):
+    """Whether ``layer`` is normalized with a scale factor per channel."""
+
+    from snntoolbox.parsing.utils import get_type
+
+    return config.getboolean('normalization', 'per_channel') and \
+        get_type(layer) in {'Dense', 'Conv1D', 'Conv2D',
+                            'DepthwiseConv2D'} and \
+        layer.activation.__name__ != 'softmax'
+
+
+def format_scale_fac(scale_fac):
+    """Format a scalar or per-channel scale factor for printing."""
+
+    if np.ndim(scale_fac):
+        return "{:.2f} to {:.2f}".format(np.min(scale_fac), np.max(scale_fac))
+    return "{:.2f}".format(scale_fac)
+
+
+def balance_thresholds(model, config, x_calib, scale_facs):
+    """Adjust the scale factors to the spike rates of the converted network.
+
+    The percentile of ANN activations does not account for how rates are
+    transmitted through the spiking network, so deeper layers often fire far
+    below their maximum rate and need a long simulation to reach a stable
+    output. Here the network is converted and simulated with INIsim on the
+    calibration batch ``x_calib``, once per layer, starting at the input.
+    The scale factor of a layer is then multiplied by the percentile (see
+    `get_percentile`) of the spike rates of its active neurons, relative to
+    the maximum rate of one spike per time step. This lowers the effective
+    threshold of the layer until the neurons at that percentile fire at the
+    maximum rate. Each layer is calibrated with the balanced layers below it.
+
+    The parameters of ``model`` are restored afterwards.
+
+    Parameters
+    ----------
+
+    model: keras.models.Model
+        The parsed model, before normalization.
+    config: configparser.ConfigParser
+        Settings. The number of time steps simulated per layer is set by the
+        option ``calibration_duration``.
+    x_calib: np.array
+        Calibration batch.
+    scale_facs: collections.OrderedDict
+        The scale factors to start from, e.g. from the activations of the
+        ANN.
+
+    Returns
+    -------
+
+    scale_facs: collections.OrderedDict
+        The balanced scale factors.
+    """
+
+    from collections import OrderedDict
+    from snntoolbox.simulation.target_simulators.\
+        INI_temporal_mean_rate_target_sim import SNN
+    from snntoolbox.utils.utils import import_configparser
+
+    # The calibration runs INIsim with constant input and without any
+    # logging, independently of the simulator used later.
+    configparser = import_configparser()
+    calib_config = configparser.ConfigParser()
+    calib_config.read_dict({section: dict(config.items(section, raw=True))
+                            for section in config.sections()})
+    calib_config.read_dict({
+        'simulation': {'simulator': 'INI', 'keras_backend': 'tensorflow',
+                       'batch_size': str(len(x_calib)),
+                       'duration': config.get('normalization',
+                                              'calibration_duration'),
+                       'fused_steps': '0', 'early_exit_margin': '0'},
+        'conversion': {'spike_code': 'temporal_mean_rate'},
+        'input': {'poisson_input': 'False', 'input_encoding': ''},
+        'output': {'log_vars': '{}', 'plot_vars': '{}',
+                   'record_on_device': 'False'}})
+
+    dt = calib_config.getfloat('simulation', 'dt')
+    num_timesteps = int(calib_config.getint('simulation', 'duration') / dt)
+    weights = model.get_weights()
+    scale_facs = OrderedDict(scale_facs)
+    i = 0
+    for layer in model.layers:
+        # Skip if layer has no parameters
+        if len(layer.weights) == 0:
+            continue
+
+        if layer.activation.__name__ == 'softmax':
+            i += 1
+            continue
+
+        apply_scale_facs(model, scale_facs)
+        snn = SNN(calib_config)
+        snn.build(model)
+        probe = keras.models.Model(snn.snn.input,
+                                   snn.snn.get_layer(layer.name).output)
+        spikecounts = 0
+        input_b_l = x_calib * dt
+        for sim_step_int in range(num_timesteps):
+            snn.set_time((sim_step_int + 1) * dt)
+            spikecounts += np.asarray(probe.predict_on_batch(input_b_l)) != 0
+        model.set_weights(weights)
+
+        spikerates = spikecounts / num_timesteps
+        perc = get_percentile(config, i)
+        if np.ndim(scale_facs[layer.name]):
+            # Balance each channel separately.
+            rate = get_scale_fac_per_channel(spikerates, perc,
+                                             get_channel_axis(layer))
+        else:
+            rate = get_scale_fac(spikerates[np.nonzero(spikerates)], perc)
+        # A scale factor is never increased, and reduced at most to the
+        # lowest rate that can be measured in the calibration.
+        rate = np.clip(rate, 1 / num_timesteps, 1)
+        if np.ndim(scale_facs[layer.name]):
+            scale_facs[layer.name] = list(np.multiply(scale_facs[layer.name],
+                                                      rate))
+        else:
+            scale_facs[layer.name] *= float(rate)
+        print("Spike rate of layer {} at percentile: {}. Balanced scale "
+              "factor: {}.".format(layer.name, format_scale_fac(rate),
+                                   format_scale_fac(scale_facs[layer.name])))
+        i += 1
+
+    return scale_facs
+
+
+def get_scale_facs_store_path(model, config, **kwargs):
+    """Return the path of the scale factors in the content-addressed store.
+
+    The file name is a hash of the parsed model (architecture and weights
+    before normalization), the normalization data and the normalization
+    settings, so stored scale factors are only reused if none of these has
+    changed. With ``threshold_balancing``, the cell parameters and time
+    resolution of the calibration are hashed as well. The store is located
+    in the working directory and shared by all runs.
+
+    Parameters
+    ----------
+
+    model: keras.models.Model
+        The parsed model, before normalization.
+    config: configparser.ConfigParser
+        Settings.
+    kwargs
+        Either ``x_norm``, the normalization data set, or ``dataflow``, a
+        Keras iterator. Of the latter, the directory and file names are
+        hashed, together with the data generator settings.
+
+    Returns
+    -------
+
+    : str
+        Path of the ``.json`` file of the scale factors.
+    """
+
+    import hashlib
+    import json
+
+    sha1 = hashlib.sha1(model.to_json().encode())
+    for weights in model.get_weights():
+        sha1.update(np.ascontiguousarray(weights).data)
+    if 'x_norm' in kwargs:
+        x_norm = np.ascontiguousarray(kwargs[str('x_norm')])
+        sha1.update(str((x_norm.shape, x_norm.dtype.str)).encode())
+        sha1.update(x_norm.data)
+    else:
+        dataflow = kwargs[str('dataflow')]
+        sha1.update(json.dumps(
+            [dataflow.directory, sorted(dataflow.filenames),
+             config.get('input', 'datagen_kwargs'),
+             config.get('input', 'dataflow_kwargs')]).encode())
+    settings = dict(config.items('normalization'))
+    settings['batch_size'] = config.getint('simulation', 'batch_size')
+    if config.getboolean('normalization', 'threshold_balancing'):
+        # The balanced scale factors depend on the simulated neurons.
+        settings['cell'] = {key: config.get('cell', key)
+                            for key in ['v_thresh', 'tau_refrac', 'reset']}
+        settings['dt'] = config.get('simulation', 'dt')
+    sha1.update(json.dumps(settings, sort_keys=True).encode())
+    return os.path.join(config.get('paths', 'path_wd'), 'scale_facs',
+                        sha1.hexdigest() + '.json')
+
+
+def get_scale_facs_streaming(model, config, norm_dir, **kwargs):
+    """Compute the scale factors of all layers in a single pass over the
+    normalization data set.
+
+    The data set is processed batch by batch, and the activations of each
+    layer are collected in a `LogHistogram`. Memory is thus independent of
+    the number of samples used for normalization.
+
+    Parameters
+    ----------
+
+    model: keras.models.Model
+        The parsed model.
+    config: configparser.ConfigParser
+        Settings.
+    norm_dir: str
+        Directory where to write the sparsity of the layers.
+    kwargs
+        Either ``x_norm``, the normalization data set, or ``dataflow``, a
+        Keras iterator. All batches of the iterator are used.
+
+    Returns
+    -------
+
+    scale_facs: collections.OrderedDict
+        The scale factor of each layer with parameters, keyed by layer name.
+    """
+
+    from collections import OrderedDict
+
+    batch_size = config.getint('simulation', 'batch_size')
+    if 'x_norm' in kwargs:
+        x_norm = kwargs[str('x_norm')]
+        batches = (x_norm[i:i + batch_size]
+                   for i in range(0, len(x_norm), batch_size))
+        num_batches = int(np.ceil(len(x_norm) / batch_size))
+    else:
+        dataflow = kwargs[str('dataflow')]
+        batches = (dataflow.next()[0] for _ in range(len(dataflow)))
+        num_batches = len(dataflow)
+
+    layers = [layer for layer in model.layers if len(layer.weights) > 0]
+    model_out = get_activations_model(model, layers)
+    bins_per_octave = config.getint('normalization', 'bins_per_octave')
+    # With per-channel scale factors, there is one histogram per channel.
+    histograms = [[LogHistogram(bins_per_octave) for _ in range(
+        layer.output_shape[1:][get_channel_axis(layer)])]
+        if is_per_channel(layer, config) else [LogHistogram(bins_per_octave)]
+        for layer in layers]
+    print("Computing activation histograms of {} layers on {} batches..."
+          "".format(len(layers), num_batches))
+    for x_batch in batches:
+        activations_n = model_out.predict_on_batch(x_batch)
+        if len(layers) == 1:
+            activations_n = [activations_n]
+        for layer, histograms_c, activations in zip(layers, histograms,
+                                                    activations_n):
+            activations = np.asarray(activations)
+            if len(histograms_c) == 1:
+                histograms_c[0].update(activations)
+                continue
+            # Channel axis including the batch dimension.
+            axis = get_channel_axis(layer) % (activations.ndim - 1) + 1
+            update_histograms_per_channel(histograms_c, activations, axis)
+
+    scale_facs = OrderedDict({model.layers[0].name: 1})
+    sparsity = []
+    for i, (layer, histograms_c) in enumerate(zip(layers, histograms)):
+        perc = get_percentile(config, i)
+        if is_per_channel(layer, config):
+            scale_facs[layer.name] = [h.percentile(perc)
+                                      for h in histograms_c]
+        else:
+            scale_facs[layer.name] = histograms_c[0].percentile(perc)
+        print("Scale factor of layer {}: {}.".format(
+            layer.name, format_scale_fac(scale_facs[layer.name])))
+        sparsity.append(1 - sum(h.num_nonzero for h in histograms_c) /
+                        max(sum(h.num_values for h in histograms_c), 1))
+
+    np.savez_compressed(os.path.join(norm_dir, 'activations', 'sparsity'),
+                        sparsity=sparsity)
+
+    return scale_facs
+
+
+class LogHistogram(object):
+    """Histogram of values with logarithmically spaced bins.
+
+    A sketch of the distribution of the nonzero activations of a layer, from
+    which percentiles can be estimated with bounded relative error. The bins
+    are created as values arrive, so the range of the values need not be
+    known in advance, and the memory grows with the number of occupied bins
+    (the dynamic range of the values), not with the number of values.
+    Histograms of different batches can be merged.
+
+    The minimum and maximum are tracked exactly, so the 0th and 100th
+    percentile (max-norm) are exact. Other percentiles are returned as the
+    geometric center of the bin that contains them, which is within a factor
+    ``2 ** (1 / bins_per_octave)`` of the exact value.
+
+    Parameters
+    ----------
+
+    bins_per_octave: int
+        Number of bins between a value and its double.
+    """
+
+    def __init__(self, bins_per_octave=64):
+
+        self.bins_per_octave = bins_per_octave
+        # Counts per bin, separately for positive and negative values.
+        self.counts = {1: {}, -1: {}}
+        self.num_values = 0
+        self.num_nonzero = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def sparsity(self):
+        """Fraction of zeros among the values."""
+
+        return 1 - self.num_nonzero / self.num_values if self.num_values \
+            else 0
+
+    def update(self, values):
+        """Add the nonzero entries of the array ``values``."""
+
+        values = np.ravel(values)
+        self.num_values += values.size
+        values = values[np.nonzero(values)]
+        if values.size == 0:
+            return
+        self.num_nonzero += values.size
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+        bins = self.get_bins(values)
+        for sign in [1, -1]:
+            bins_unique, counts = np.unique(bins[np.sign(values) == sign],
+                                            return_counts=True)
+            self._add_counts(sign, bins_unique, counts)
+
+    def get_bins(self, values):
+        """Return the bin index of each of the nonzero ``values``."""
+
+        return np.floor(np.log2(np.abs(values).astype('float64')) *
+                        self.bins_per_octave).astype('int64')
+
+    def merge(self, other):
+        """Add the values collected in another histogram."""
+
+        assert other.bins_per_octave == self.bins_per_octave, \
+            "Cannot merge histograms with different bin sizes."
+        for sign, counts in other.counts.items():
+            self._add_counts(sign, list(counts.keys()),
+                             list(counts.values()))
+        self.num_values += other.num_values
+        self.num_nonzero += other.num_nonzero
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _add_counts(self, sign, bins, counts):
+        for b, count in zip(bins, counts):
+            self.counts[sign][int(b)] = self.counts[sign].get(int(b), 0) + \
+                int(count)
+
+    def percentile(self, percentile):
+        """Estimate the value at ``percentile`` of the nonzero values.
+
+        Follows `get_scale_fac`: Returns 1 if no nonzero values were added.
+        """
+
+        if self.num_nonzero == 0:
+            return 1
+        if percentile >= 100:
+            return self.max
+        if percentile <= 0:
+            return self.min
+
+        # Bins in ascending order of their values: Negative values with
+        # decreasing magnitude, then positive values with increasing one.
+        bins_neg = sorted(self.counts[-1], reverse=True)
+        bins_pos = sorted(self.counts[1])
+        centers = np.concatenate([
+            -np.exp2((np.array(bins_neg, 'float64') + 0.5) /
+                     self.bins_per_octave),
+            np.exp2((np.array(bins_pos, 'float64') + 0.5) /
+                    self.bins_per_octave)])
+        counts = [self.counts[-1][b] for b in bins_neg] + \
+            [self.counts[1][b] for b in bins_pos]
+
+        # Same rank as the linear interpolation of ``np.percentile``.
+        rank = percentile / 100 * (self.num_nonzero - 1)
+        i = np.searchsorted(np.cumsum(counts), rank, 'right')
+        return float(np.clip(centers[i], self.min, self.max))
+
+
+def update_histograms_per_channel(histograms, activations, axis):
+    """Add the activations of each channel to the histogram of the channel.
+
+    Equivalent to calling `LogHistogram.update` for each channel, but the
+    bins of all channels are computed at once, and the (channel, sign, bin)
+    triples are counted in a single pass.
+
+    Parameters
+    ----------
+
+    histograms: list[LogHistogram]
+        One histogram per channel.
+    activations: np.array
+        Activations of a layer.
+    axis: int
+        Channel axis of ``activations``.
+    """
+
+    # Group the activations by channel, so that the nonzero values of each
+    # channel are contiguous.
+    num_channels = len(histograms)
+    activations = np.reshape(np.moveaxis(activations, axis, 0),
+                             (num_channels, -1))
+    is_nonzero = activations != 0
+    num_nonzero_c = np.count_nonzero(is_nonzero, 1)
+    values = activations[is_nonzero]
+    channels = np.flatnonzero(num_nonzero_c)
+    starts = (np.cumsum(num_nonzero_c) - num_nonzero_c)[channels]
+    for histogram, num_nonzero in zip(histograms, num_nonzero_c.tolist()):
+        histogram.num_values += activations.shape[1]
+        histogram.num_nonzero += num_nonzero
+    if values.size == 0:
+        return
+    for c, min_value, max_value in zip(
+            channels.tolist(), np.minimum.reduceat(values, starts).tolist(),
+            np.maximum.reduceat(values, starts).tolist()):
+        histograms[c].min = min(histograms[c].min, min_value)
+        histograms[c].max = max(histograms[c].max, max_value)
+
+    # Encode each triple as a single index.
+    bins = histograms[0].get_bins(values)
+    min_bin = np.min(bins)
+    num_bins = int(np.max(bins)) - min_bin + 1
+    keys = (2 * np.repeat(np.arange(num_channels), num_nonzero_c) +
+            (values < 0)) * num_bins + bins - min_bin
+    counts = np.bincount(keys)
+    keys = np.flatnonzero(counts)
+    channel_signs, bins = np.divmod(keys, num_bins)
+    for channel_sign, b, count in zip(channel_signs.tolist(),
+                                      (bins + min_bin).tolist(),
+                                      counts[keys].tolist()):
+        bin_counts = histograms[channel_sign // 2].counts[
+            -1 if channel_sign % 2 else 1]
+        bin_counts[b] = bin_counts.get(b, 0) + count
+
+
 def get_scale_fac(activations, percentile):
     """
     Determine the activation value at ``percentile`` of the layer distribution.
@@ -372,30 +1023,339 @@ def get_activations_batch(ann, x_batch):
         ``label`` is a string specifying the layer type, e.g. ``'Dense'``.
     """
 
-    activations_batch = []
-    for layer in ann.layers:
-        if layer.__class__.__name__ in ['Input', 'InputLayer', 'Flatten',
-                                        'Concatenate']:
-            continue
-        activations = keras.models.Model(
-            ann.input, layer.output).predict_on_batch(x_batch)
-        activations_batch.append((activations, layer.name))
-    return activations_batch
+    layers = [layer for layer in ann.layers if layer.__class__.__name__
+              not in ['Input', 'InputLayer', 'Flatten', 'Concatenate']]
+    activations_n = get_activations_model(ann, layers).predict_on_batch(
+        x_batch)
+    if len(layers) == 1:
+        activations_n = [activations_n]
+    return [(np.asarray(activations), layer.name)
+            for activations, layer in zip(activations_n, layers)]
+
+
+def get_activations_model(ann, layers):
+    """Create a model that outputs the activations of several layers.
+
+    The activations of all ``layers`` are thus obtained in a single forward
+    pass, instead of running the network from the input once per layer.
+
+    Parameters
+    ----------
+
+    ann: keras.models.Model
+        The network.
+    layers: list[keras.layers.Layer]
+        The layers of ``ann`` for which to compute the activations.
+
+    Returns
+    -------
+
+    : keras.models.Model
+        Model with an output for each layer in ``layers``.
+    """
+
+    return keras.models.Model(ann.input, [layer.output for layer in layers])
+
+
+def get_activations_layers(ann, layers, x, batch_size=None):
+    """Get activations of several layers in one pass over the data set.
+
+    Like `get_activations_layer`, but the network is evaluated only once per
+    batch for all ``layers``.
+
+    Parameters
+    ----------
+
+    ann: keras.models.Model
+        The network.
+    layers: list[keras.layers.Layer]
+        The layers of ``ann`` for which to compute the activations.
+    x: np.array
+        The samples to compute activations for.
+    batch_size: Optional[int]
+        Batch size. Samples that do not fill a complete batch are dropped.
+
+    Returns
+    -------
+
+    activations_n: list[ndarray]
+        The activations of each layer in ``layers``, with the same shape as
+        the layer output.
+    """
+
+    if batch_size is None:
+        batch_size = 10
+
+    if len(x) % batch_size != 0:
+        x = x[: -(len(x) % batch_size)]
+
+    model_out = get_activations_model(ann, layers)
+    activations_n = [np.empty((len(x),) + tuple(layer.output_shape[1:]),
+                              keras.backend.floatx()) for layer in layers]
+    for i in range(0, len(x), batch_size):
+        activations_batch = model_out.predict_on_batch(x[i:i + batch_size])
+        if len(layers) == 1:
+            activations_batch = [activations_batch]
+        for activations, activations_b in zip(activations_n,
+                                              activations_batch):
+            activations[i:i + batch_size] = activations_b
+    return activations_n
 
 
 def try_reload_activations(layer, model, x_norm, batch_size, activ_dir):
-    try:
-        activations = np.load(os.path.join(activ_dir,
-                                           layer.name + '.npz'))['arr_0']
-    except IOError:
-        if x_norm is None:
-            return
+    """Get the activations of ``layer`` on the normalization data set.
 
-        print("Calculating activations of layer {} ...".format(layer.name))
-        activations = get_activations_layer(model.input, layer.output, x_norm,
-                                            batch_size)
-        print("Writing activations to disk...")
-        np.savez_compressed(os.path.join(activ_dir, layer.name), activations)
-    else:
+    The activations are loaded from the `ActivationCache` in ``activ_dir``,
+    or from the compressed archive written by earlier versions of the
+    toolbox. Missing activations are computed if ``x_norm`` is given.
+
+    Returns
+    -------
+
+    activations: Optional[np.memmap]
+        The activations of ``layer``, memory-mapped in read-only mode, or
+        ``None`` if they are neither cached nor can be computed.
+    """
+
+    cache = ActivationCache(activ_dir, None if x_norm is None else len(x_norm),
+                            batch_size)
+    if cache.is_complete(layer.name):
+        print("Loading activations of layer {}.".format(layer.name))
+        return cache.load(layer.name)
+
+    filepath = os.path.join(activ_dir, layer.name + '.npz')
+    if os.path.isfile(filepath):
         print("Loading activations stored during a previous run.")
-    return np.array(activations)
+        return np.load(filepath)['arr_0']
+
+    if x_norm is None:
+        return
+
+    print("Calculating activations of layer {} ...".format(layer.name))
+    cache.fill(model, [layer], x_norm)
+    return cache.load(layer.name)
+
+
+def compute_missing_activations(layers, model, x_norm, batch_size,
+                                activ_dir):
+    """Compute and store the activations of all layers that have not been
+    stored during a previous run.
+
+    The activations of these layers are computed in a single pass over
+    ``x_norm``, and written to the `ActivationCache` in ``activ_dir`` where
+    `try_reload_activations` finds them. If a previous run was interrupted,
+    only the missing batches are computed.
+
+    Parameters
+    ----------
+
+    layers: list[keras.layers.Layer]
+        The layers for which activations are needed.
+    model: keras.models.Model
+        The network.
+    x_norm: Optional[np.array]
+        The normalization data set. If ``None``, nothing is computed.
+    batch_size: int
+        Batch size.
+    activ_dir: str
+        Directory of the stored activations.
+    """
+
+    if x_norm is None:
+        return
+
+    cache = ActivationCache(activ_dir, len(x_norm), batch_size)
+    missing = [layer for layer in layers if not cache.is_complete(layer.name)
+               and not os.path.isfile(os.path.join(activ_dir,
+                                                   layer.name + '.npz'))]
+    if len(missing) == 0:
+        return
+
+    print("Calculating activations of {} layers ...".format(len(missing)))
+    cache.fill(model, missing, x_norm)
+
+
+class ActivationCache(object):
+    """Chunked, memory-mapped cache of the layer activations on the
+    normalization data set.
+
+    The activations of each layer are stored uncompressed in a ``.npy`` file,
+    which is memory-mapped so that it never needs to fit into memory, and is
+    filled one batch (shard) at a time. A manifest records which batches of
+    each layer have been written, so a run that was interrupted resumes with
+    the missing batches. The batches are written by a thread pool while the
+    next batch is computed.
+
+    Parameters
+    ----------
+
+    activ_dir: str
+        Directory of the cache.
+    num_samples: Optional[int]
+        Number of samples in the normalization data set. Samples that do not
+        fill a complete batch are dropped. If ``None``, the cache is opened
+        for reading with the size stored in the manifest.
+    batch_size: Optional[int]
+        Batch size. A cache written with a different number of samples or
+        batch size is discarded.
+    num_threads: int
+        Number of threads writing to disk.
+    """
+
+    def __init__(self, activ_dir, num_samples=None, batch_size=None,
+                 num_threads=2):
+        self.activ_dir = activ_dir
+        self.num_threads = num_threads
+        self.manifest = {'num_samples': 0, 'batch_size': batch_size,
+                         'layers': {}}
+        if num_samples is not None:
+            self.manifest['num_samples'] = \
+                num_samples - num_samples % batch_size
+        manifest = self._load_manifest()
+        if manifest is not None and (num_samples is None or (
+                manifest['num_samples'] == self.manifest['num_samples'] and
+                manifest['batch_size'] == batch_size)):
+            self.manifest = manifest
+        self._memmaps = {}
+
+    @property
+    def num_samples(self):
+        return self.manifest['num_samples']
+
+    @property
+    def batch_size(self):
+        return self.manifest['batch_size']
+
+    @property
+    def num_batches(self):
+        return self.num_samples // self.batch_size if self.batch_size else 0
+
+    def _load_manifest(self):
+        import json
+
+        filepath = os.path.join(self.activ_dir, 'manifest.json')
+        if not os.path.isfile(filepath):
+            return None
+        with open(filepath) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        import json
+        import shutil
+
+        filepath = os.path.join(self.activ_dir, 'manifest.json')
+        # Replace the manifest in one step, so an interrupted write does not
+        # leave a corrupt manifest behind.
+        with open(filepath + '.tmp', str('w')) as f:
+            json.dump(self.manifest, f)
+        shutil.move(filepath + '.tmp', filepath)
+
+    def get_filepath(self, layer_name):
+        return os.path.join(self.activ_dir, layer_name + '.npy')
+
+    def get_missing_batches(self, layer_name):
+        """Return the indices of the batches not yet written for a layer."""
+
+        entry = self.manifest['layers'].get(layer_name)
+        done = set() if entry is None else set(entry['batches'])
+        return [b for b in range(self.num_batches) if b not in done]
+
+    def is_complete(self, layer_name):
+        return layer_name in self.manifest['layers'] and \
+            len(self.get_missing_batches(layer_name)) == 0 and \
+            os.path.isfile(self.get_filepath(layer_name))
+
+    def load(self, layer_name):
+        """Memory-map the cached activations of a layer in read-only mode.
+        """
+
+        return np.load(self.get_filepath(layer_name), mmap_mode='r')
+
+    def _open(self, layer):
+        """Open the cache file of ``layer`` for writing, creating it unless it
+        contains batches of a previous run."""
+
+        shape = (self.num_samples,) + tuple(layer.output_shape[1:])
+        filepath = self.get_filepath(layer.name)
+        memmap = None
+        if layer.name in self.manifest['layers'] and \
+                os.path.isfile(filepath):
+            memmap = np.load(filepath, mmap_mode='r+')
+            if memmap.shape != shape:
+                memmap = None
+        if memmap is None:
+            memmap = np.lib.format.open_memmap(
+                filepath, str('w+'), keras.backend.floatx(), shape)
+            self.manifest['layers'][layer.name] = {'batches': []}
+        self._memmaps[layer.name] = memmap
+        return memmap
+
+    def _write(self, layer_name, b, activations):
+        self._memmaps[layer_name][b * self.batch_size:
+                                  (b + 1) * self.batch_size] = activations
+
+    def _commit(self, b, layer_names, futures):
+        """Wait for the writes of batch ``b`` and record them in the
+        manifest."""
+
+        for future in futures:
+            future.result()
+        for layer_name in layer_names:
+            self._memmaps[layer_name].flush()
+            self.manifest['layers'][layer_name]['batches'].append(b)
+        self._save_manifest()
+
+    def fill(self, model, layers, x):
+        """Compute and write the missing batches of ``layers``.
+
+        For each batch, the activations of all layers that miss it are
+        computed in one forward pass (see `get_activations_model`).
+
+        Parameters
+        ----------
+
+        model: keras.models.Model
+            The network.
+        layers: list[keras.layers.Layer]
+            The layers of ``model`` to cache.
+        x: np.array
+            The normalization data set.
+        """
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        for layer in layers:
+            self._open(layer)
+        missing = [set(self.get_missing_batches(layer.name))
+                   for layer in layers]
+        self._save_manifest()
+
+        models = {}
+        pending = []
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            for b in range(self.num_batches):
+                idxs = tuple(i for i in range(len(layers)) if b in missing[i])
+                if len(idxs) == 0:
+                    continue
+                if idxs not in models:
+                    models[idxs] = get_activations_model(
+                        model, [layers[i] for i in idxs])
+                activations_batch = models[idxs].predict_on_batch(
+                    x[b * self.batch_size: (b + 1) * self.batch_size])
+                if len(idxs) == 1:
+                    activations_batch = [activations_batch]
+                layer_names = [layers[i].name for i in idxs]
+                futures = [executor.submit(self._write, layer_name, b,
+                                           np.asarray(activations))
+                           for layer_name, activations
+                           in zip(layer_names, activations_batch)]
+                pending.append((b, layer_names, futures))
+                # Record finished batches, and limit the number of batches
+                # held in memory while waiting to be written.
+                while len(pending) > 0 and (
+                        len(pending) > self.num_threads or
+                        all(f.done() for f in pending[0][2])):
+                    self._commit(*pending.pop(0))
+            while len(pending) > 0:
+                self._commit(*pending.pop(0))
+        self._memmaps.clear()
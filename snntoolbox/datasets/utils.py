@@ -146,7 +146,10 @@ def try_get_normset_from_scalefacs(config):
     : Union[dict, None]
         A dictionary with single key 'scale_facs'. The corresponding value is
         itself a dictionary containing the scale factors for each layer.
-        Returns ``None`` if no scale factors were found.
+        Returns ``None`` if no scale factors were found, or if the scale
+        factors are to be taken from the content-addressed store instead
+        (option ``cache_scale_facs``), which needs the normalization data
+        set.
     """
 
     newpath = os.path.join(config.get('paths', 'log_dir_of_current_run'),
@@ -154,6 +157,8 @@ def try_get_normset_from_scalefacs(config):
     if not os.path.exists(newpath):
         os.makedirs(newpath)
         return
+    if config.getboolean('normalization', 'cache_scale_facs'):
+        return
     filepath = os.path.join(newpath, config.get('normalization',
                                                 'percentile') + '.json')
     if os.path.isfile(filepath):
@@ -0,0 +1,798 @@
+# -*- coding: utf-8 -*-
+"""INI temporal mean rate simulator with NumPy backend.
+
+This module defines the layer objects used to create a spiking neural network
+for the NumPy variant of our built-in INI simulator
+:py:mod:`~snntoolbox.simulation.target_simulators.INI_numpy_target_sim`.
+
+The neurons follow the same integrate-and-fire dynamics as the layers in
+:py:mod:`~snntoolbox.simulation.backends.inisim.temporal_mean_rate_tensorflow`.
+In contrast to the Keras backends, which perform dense ``Conv2D`` and
+``Dense`` operations at every time step, the connections are evaluated in an
+event-driven manner: Only the presynaptic neurons that are active in the
+current time step are gathered, and their outgoing weights are scatter-added
+into the membrane potential buffers of the postsynaptic layer. The cost of a
+time step therefore scales with the number of spikes instead of the layer
+size.
+
+This module does not depend on Keras or Tensorflow. A network that was
+converted by the toolbox and saved with :py:meth:`SpikingNetwork.save` can be
+restored with :py:func:`load_network` and simulated with
+:py:meth:`SpikingNetwork.run` in a process that only has NumPy installed.
+
+@author: rbodo
+"""
+
+from __future__ import division, absolute_import
+from __future__ import print_function, unicode_literals
+
+import json
+
+import numpy as np
+
+
+class Layer(object):
+    """Base class for layers without neurons (``Flatten``, ``Concatenate``,
+    ...), which only rearrange the spikes of their inbound layers.
+
+    Parameters
+    ----------
+
+    name: str
+        Layer name.
+    inbound: list[str]
+        Names of the inbound layers.
+    output_shape: tuple
+        Output shape of the layer, excluding the batch dimension.
+    """
+
+    is_spiking = False
+
+    def __init__(self, name, inbound, output_shape, **kwargs):
+        self.name = name
+        self.inbound = list(inbound)
+        self.output_shape = tuple(output_shape)
+
+    def __call__(self, x, t):
+        return self.call(x)
+
+    def call(self, x):
+        """Layer functionality."""
+
+        raise NotImplementedError
+
+    def reset(self, reset_mem=True):
+        """Reset layer variables."""
+
+        pass
+
+    def get_config(self):
+        """Get the (JSON serializable) arguments to construct the layer,
+        excluding the weights."""
+
+        return {'name': self.name, 'inbound': self.inbound,
+                'output_shape': list(self.output_shape)}
+
+    def get_weights(self):
+        """Get the weights of the layer as a dictionary of arrays, keyed by
+        the corresponding argument of the constructor."""
+
+        return {}
+
+
+class SpikeLayer(Layer):
+    """Base class for layer with spiking neurons.
+
+    Parameters
+    ----------
+
+    v_thresh: float
+        Threshold of the integrate-and-fire neurons.
+    tau_refrac: float
+        Refractory period.
+    reset: str
+        Reset mechanism after spike (see ``[cell] reset`` in the config).
+    leak: bool
+        Whether the membrane potential leaks.
+    dt: float
+        Time resolution of the simulator.
+    activation: str
+        Name of the activation function of the original layer. The spike
+        generation mechanism implements ReLU; ``'softmax'``,
+        ``'binary_sigmoid'`` and ``'binary_tanh'`` are treated separately.
+    record_spiketrain: bool
+        Whether to store the spike times of the current time step in
+        ``spiketrain``.
+    """
+
+    is_spiking = True
+
+    def __init__(self, name, inbound, output_shape, v_thresh=1.,
+                 tau_refrac=0., reset='Reset by subtraction', leak=False,
+                 dt=1., activation='linear', record_spiketrain=False,
+                 **kwargs):
+
+        Layer.__init__(self, name, inbound, output_shape)
+        self.v_thresh = np.float32(v_thresh)
+        self.tau_refrac = tau_refrac
+        self.reset_mode = reset
+        self.leak = leak
+        self.dt = dt
+        self.activation = activation
+        self.record_spiketrain = record_spiketrain
+        self.mem = self.refrac_until = self.spiketrain = None
+        self.cache_impulse = False
+        self._impulse = None
+
+    def init_state(self, batch_size):
+        """Allocate the state variables of the layer neurons.
+
+        Parameters
+        ----------
+
+        batch_size: int
+            Number of samples simulated in parallel.
+        """
+
+        shape = (batch_size,) + self.output_shape
+        self.mem = np.zeros(shape, 'float32')
+        if self.tau_refrac > 0:
+            self.refrac_until = np.zeros(shape, 'float32')
+        if self.record_spiketrain:
+            self.spiketrain = np.zeros(shape, 'float32')
+        self._impulse = None
+
+    def reset(self, reset_mem=True):
+        """Reset layer variables.
+
+        Parameters
+        ----------
+
+        reset_mem: bool
+            Whether to reset the membrane potential. Can be turned off for
+            instance when a video sequence is tested.
+        """
+
+        if reset_mem:
+            self.mem[:] = 0
+        if self.refrac_until is not None:
+            self.refrac_until[:] = 0
+        if self.spiketrain is not None:
+            self.spiketrain[:] = 0
+        self._impulse = None
+
+    def reset_slots(self, mask_b):
+        """Reset the state variables of the samples selected by the boolean
+        array ``mask_b``."""
+
+        self.mem[mask_b] = 0
+        if self.refrac_until is not None:
+            self.refrac_until[mask_b] = 0
+        if self.spiketrain is not None:
+            self.spiketrain[mask_b] = 0
+        self._impulse = None
+
+    def select(self, idx):
+        """Keep only the samples ``idx`` of the batch in the state
+        variables."""
+
+        self.mem = self.mem[idx]
+        if self.refrac_until is not None:
+            self.refrac_until = self.refrac_until[idx]
+        if self.spiketrain is not None:
+            self.spiketrain = self.spiketrain[idx]
+        if self._impulse is not None:
+            self._impulse = self._impulse[idx]
+
+    def __call__(self, x, t):
+
+        if self.cache_impulse and self._impulse is not None:
+            impulse = self._impulse
+        else:
+            impulse = self.get_impulse(x)
+            if self.cache_impulse:
+                self._impulse = impulse
+        return self.update_neurons(impulse, t)
+
+    def get_impulse(self, x):
+        """Compute the synaptic input from the spikes ``x`` of the inbound
+        layer."""
+
+        raise NotImplementedError
+
+    def update_neurons(self, impulse, t):
+        """Integrate ``impulse``, generate spikes and reset neurons.
+
+        Parameters
+        ----------
+
+        impulse: ndarray
+            Synaptic input in the current time step.
+        t: float
+            Current simulation time.
+
+        Returns
+        -------
+
+        output_spikes: ndarray
+            Spikes of the layer, with amplitude ``v_thresh``.
+        """
+
+        if self.tau_refrac > 0:
+            impulse = np.where(self.refrac_until > t, 0, impulse)
+
+        new_mem = self.mem + impulse
+
+        if self.leak:
+            new_mem = np.where(new_mem > 0, new_mem - 0.1 * self.dt, new_mem)
+
+        if self.activation == 'softmax':
+            output_spikes = self.softmax_activation(new_mem)
+        elif self.activation == 'binary_sigmoid':
+            output_spikes = np.greater(new_mem, 0) * self.v_thresh
+        elif self.activation == 'binary_tanh':
+            output_spikes = (np.greater(new_mem, 0) -
+                             np.less(new_mem, 0).astype('float32')) * \
+                self.v_thresh
+        else:
+            output_spikes = np.greater_equal(new_mem, self.v_thresh) * \
+                self.v_thresh
+        output_spikes = output_spikes.astype('float32')
+
+        self.mem = self.get_reset_mem(new_mem, output_spikes)
+
+        if self.tau_refrac > 0:
+            self.refrac_until = np.where(output_spikes != 0,
+                                         t + self.tau_refrac,
+                                         self.refrac_until)
+
+        if self.spiketrain is not None:
+            self.spiketrain = t * np.not_equal(output_spikes, 0).astype(
+                'float32')
+
+        return output_spikes
+
+    def get_config(self):
+        config = Layer.get_config(self)
+        config.update(v_thresh=float(self.v_thresh),
+                      tau_refrac=self.tau_refrac, reset=self.reset_mode,
+                      leak=self.leak, dt=self.dt, activation=self.activation,
+                      record_spiketrain=self.record_spiketrain)
+        return config
+
+    def softmax_activation(self, mem):
+        """Fire stochastically with the softmax of ``mem`` as probability."""
+
+        e = np.exp(mem - np.max(mem, -1, keepdims=True))
+        p = e / np.sum(e, -1, keepdims=True)
+        return np.less_equal(np.random.random_sample(mem.shape), p) * \
+            self.v_thresh
+
+    def get_reset_mem(self, mem, spikes):
+        """
+        Reset membrane potential ``mem`` array where ``spikes`` array is
+        nonzero.
+        """
+
+        spiked = spikes != 0
+        if self.activation == 'softmax':
+            return np.where(spiked, 0, mem).astype('float32')
+        if self.reset_mode == 'Reset by subtraction':
+            new = np.where(spikes > 0, mem - self.v_thresh, mem)
+            return np.where(spikes < 0, new + self.v_thresh, new).astype(
+                'float32')
+        if self.reset_mode == 'Reset by modulo':
+            return np.where(spiked, mem % self.v_thresh, mem).astype(
+                'float32')
+        # self.reset_mode == 'Reset to zero':
+        return np.where(spiked, 0, mem).astype('float32')
+
+
+def get_same_padding(input_size, output_size, kernel_size, stride):
+    """Get the number of zeros padded before the first row / column of a
+    feature map, following the Tensorflow convention for ``'same'`` padding.
+    """
+
+    total = max((output_size - 1) * stride + kernel_size - input_size, 0)
+    return total // 2
+
+
+def scatter_conv2d(spikes_b_l, kernel, strides, offsets, output_shape,
+                   depthwise=False):
+    """Propagate the active neurons of a layer through a 2D convolution.
+
+    For each kernel position, the output locations reached by the active
+    presynaptic neurons are computed by index arithmetic, and the
+    corresponding weight slices are scatter-added into the output.
+
+    Parameters
+    ----------
+
+    spikes_b_l: ndarray
+        Presynaptic activity in ``channels_last`` format. Shape:
+        (`batch_size`, ``rows``, ``cols``, ``channels``)
+    kernel: ndarray
+        Kernel of shape (``kernel_rows``, ``kernel_cols``, ``channels``,
+        ``filters``). For depthwise convolutions, the last dimension is the
+        depth multiplier.
+    strides: tuple[int]
+        Convolution strides.
+    offsets: tuple[int]
+        Zero-padding before the first row and column.
+    output_shape: tuple[int]
+        Output shape in ``channels_last`` format, excluding the batch
+        dimension.
+    depthwise: bool
+        Whether each input channel is convolved separately.
+
+    Returns
+    -------
+
+    out: ndarray
+        The summed input to the postsynaptic neurons. Shape:
+        (`batch_size`, ``output_shape``).
+    """
+
+    out = np.zeros((len(spikes_b_l),) + tuple(output_shape), kernel.dtype)
+    b, y, x, c = np.nonzero(spikes_b_l)
+    if len(b) == 0:
+        return out
+
+    s = spikes_b_l[b, y, x, c]
+    # Depthwise convolutions write into ``depth_multiplier`` consecutive
+    # output channels per input channel.
+    target = np.reshape(out, out.shape[:3] + kernel.shape[2:]) \
+        if depthwise else out
+    sy, sx = strides
+    out_rows, out_cols = output_shape[:2]
+    for ky in range(kernel.shape[0]):
+        oy, ry = np.divmod(y + offsets[0] - ky, sy)
+        valid_y = (ry == 0) & (oy >= 0) & (oy < out_rows)
+        if not np.any(valid_y):
+            continue
+        for kx in range(kernel.shape[1]):
+            ox, rx = np.divmod(x + offsets[1] - kx, sx)
+            idx = np.flatnonzero(valid_y & (rx == 0) & (ox >= 0) &
+                                 (ox < out_cols))
+            if len(idx) == 0:
+                continue
+            w = kernel[ky, kx, c[idx]] * s[idx, None]
+            if depthwise:
+                np.add.at(target, (b[idx], oy[idx], ox[idx], c[idx]), w)
+            else:
+                np.add.at(target, (b[idx], oy[idx], ox[idx]), w)
+    return out
+
+
+def scatter_dense(spikes_b_l, kernel):
+    """Propagate the active neurons of a layer through a dense connection.
+
+    Parameters
+    ----------
+
+    spikes_b_l: ndarray
+        Presynaptic activity. Shape: (`batch_size`, ``num_inputs``)
+    kernel: ndarray
+        Weight matrix of shape (``num_inputs``, ``units``).
+
+    Returns
+    -------
+
+    out: ndarray
+        The summed input to the postsynaptic neurons. Shape:
+        (`batch_size`, ``units``)
+    """
+
+    out = np.zeros((len(spikes_b_l), kernel.shape[1]), kernel.dtype)
+    for b, spikes_l in enumerate(spikes_b_l):
+        idx = np.flatnonzero(spikes_l)
+        if len(idx):
+            out[b] = np.dot(spikes_l[idx], kernel[idx])
+    return out
+
+
+class SpikeDense(SpikeLayer):
+    """Spike Dense layer."""
+
+    def __init__(self, kernel, bias=None, **kwargs):
+        SpikeLayer.__init__(self, **kwargs)
+        self.kernel = np.asarray(kernel, 'float32')
+        self.bias = None if bias is None or not np.any(bias) else \
+            np.asarray(bias, 'float32') * self.dt
+
+    def get_impulse(self, x):
+        impulse = scatter_dense(x, self.kernel)
+        if self.bias is not None:
+            impulse += self.bias
+        return impulse
+
+    def get_weights(self):
+        weights = {'kernel': self.kernel}
+        if self.bias is not None:
+            weights['bias'] = self.bias / self.dt
+        return weights
+
+
+class _SpikeConvBase(SpikeLayer):
+    """Shared functionality of convolution and pooling layers.
+
+    Parameters
+    ----------
+
+    input_shape: tuple
+        Input shape of the layer, excluding the batch dimension.
+    kernel_size: tuple[int]
+        Spatial extent of the kernel or pooling window.
+    strides: tuple[int]
+        Strides.
+    padding: str
+        One of ``'valid'`` or ``'same'``.
+    data_format: str
+        One of ``'channels_first'`` or ``'channels_last'``.
+    """
+
+    def __init__(self, input_shape, kernel_size, strides, padding='valid',
+                 data_format='channels_last', **kwargs):
+        SpikeLayer.__init__(self, **kwargs)
+        self.input_shape = tuple(input_shape)
+        self.data_format = data_format
+        self.strides = tuple(strides)
+        self.padding = padding
+        if data_format == 'channels_first':
+            self._input_shape = tuple(input_shape[1:]) + (input_shape[0],)
+            self._output_shape = tuple(self.output_shape[1:]) + \
+                (self.output_shape[0],)
+        else:
+            self._input_shape = tuple(input_shape)
+            self._output_shape = self.output_shape
+        if padding == 'valid':
+            self.offsets = (0, 0)
+        elif padding == 'same':
+            self.offsets = tuple(get_same_padding(
+                self._input_shape[i], self._output_shape[i], kernel_size[i],
+                self.strides[i]) for i in range(2))
+        else:
+            raise NotImplementedError("Padding {} not supported.".format(
+                padding))
+
+    def get_config(self):
+        config = SpikeLayer.get_config(self)
+        config.update(input_shape=list(self.input_shape),
+                      strides=list(self.strides), padding=self.padding,
+                      data_format=self.data_format)
+        return config
+
+    def to_channels_last(self, x):
+        """Move channel axis of a batch of feature maps to the back."""
+
+        return np.moveaxis(x, 1, -1) if self.data_format == 'channels_first' \
+            else x
+
+    def from_channels_last(self, x):
+        """Move channel axis of a batch of feature maps back to where the
+        ``data_format`` of the layer expects it."""
+
+        return np.moveaxis(x, -1, 1) if self.data_format == 'channels_first' \
+            else x
+
+
+class SpikeConv2D(_SpikeConvBase):
+    """Spike 2D Convolution."""
+
+    depthwise = False
+
+    def __init__(self, kernel, bias=None, **kwargs):
+        kernel = np.asarray(kernel, 'float32')
+        _SpikeConvBase.__init__(self, kernel_size=kernel.shape[:2], **kwargs)
+        self.kernel = kernel
+        self.bias = None if bias is None or not np.any(bias) else \
+            np.asarray(bias, 'float32') * self.dt
+
+    def get_impulse(self, x):
+        impulse = scatter_conv2d(self.to_channels_last(x), self.kernel,
+                                 self.strides, self.offsets,
+                                 self._output_shape, self.depthwise)
+        if self.bias is not None:
+            impulse += self.bias
+        return self.from_channels_last(impulse)
+
+    def get_weights(self):
+        weights = {'kernel': self.kernel}
+        if self.bias is not None:
+            weights['bias'] = self.bias / self.dt
+        return weights
+
+
+class SpikeDepthwiseConv2D(SpikeConv2D):
+    """Spike 2D depthwise Convolution."""
+
+    depthwise = True
+
+
+class SpikeAveragePooling2D(_SpikeConvBase):
+    """Spike Average Pooling."""
+
+    def __init__(self, pool_size, **kwargs):
+        _SpikeConvBase.__init__(self, kernel_size=pool_size, **kwargs)
+        self.pool_size = tuple(pool_size)
+        self.kernel = np.ones(tuple(pool_size) + (self._input_shape[-1], 1),
+                              'float32')
+        # Number of input neurons per pooling window. Smaller than the pool
+        # size at the border of a feature map with 'same' padding.
+        self.counts = scatter_conv2d(
+            np.ones((1,) + self._input_shape, 'float32'), self.kernel,
+            self.strides, self.offsets, self._output_shape, True)[0]
+
+    def get_impulse(self, x):
+        impulse = scatter_conv2d(self.to_channels_last(x), self.kernel,
+                                 self.strides, self.offsets,
+                                 self._output_shape, True)
+        return self.from_channels_last(impulse / self.counts)
+
+    def get_config(self):
+        config = _SpikeConvBase.get_config(self)
+        config['pool_size'] = list(self.pool_size)
+        return config
+
+
+class SpikeMaxPooling2D(SpikeAveragePooling2D):
+    """Spike Max Pooling."""
+
+    def __init__(self, **kwargs):
+        print("WARNING: Rate-based spiking MaxPooling layer is not "
+              "implemented in NumPy backend. Falling back on "
+              "AveragePooling.")
+        SpikeAveragePooling2D.__init__(self, **kwargs)
+
+
+class SpikeFlatten(Layer):
+    """Spike flatten layer."""
+
+    def call(self, x):
+        return np.reshape(x, (len(x), -1))
+
+
+class SpikeReshape(Layer):
+    """Spike reshape layer."""
+
+    def call(self, x):
+        return np.reshape(x, (len(x),) + self.output_shape)
+
+
+class SpikeConcatenate(Layer):
+    """Spike merge layer."""
+
+    def __init__(self, axis=-1, **kwargs):
+        Layer.__init__(self, **kwargs)
+        self.axis = axis
+
+    def call(self, x):
+        return np.concatenate(x, self.axis)
+
+    def get_config(self):
+        config = Layer.get_config(self)
+        config['axis'] = self.axis
+        return config
+
+
+class SpikeZeroPadding2D(Layer):
+    """Spike zero-padding layer."""
+
+    def __init__(self, padding, data_format='channels_last', **kwargs):
+        Layer.__init__(self, **kwargs)
+        self.padding = tuple(tuple(p) for p in padding)
+        self.data_format = data_format
+        (top, bottom), (left, right) = padding
+        if data_format == 'channels_first':
+            self.pad_width = ((0, 0), (0, 0), (top, bottom), (left, right))
+        else:
+            self.pad_width = ((0, 0), (top, bottom), (left, right), (0, 0))
+
+    def call(self, x):
+        return np.pad(x, self.pad_width, 'constant')
+
+    def get_config(self):
+        config = Layer.get_config(self)
+        config.update(padding=[list(p) for p in self.padding],
+                      data_format=self.data_format)
+        return config
+
+
+class SpikingNetwork(object):
+    """A network of NumPy spiking layers, simulated in discrete time steps.
+
+    Parameters
+    ----------
+
+    layers: list[Layer]
+        The layers of the network, in topological order. The last layer is
+        the output layer.
+    input_name: str
+        Name of the input layer, referred to by the ``inbound`` attribute of
+        the first layers.
+    batch_size: int
+        Number of samples simulated in parallel.
+    """
+
+    def __init__(self, layers, input_name, batch_size=1):
+        self.layers = layers
+        self.input_name = input_name
+        self.batch_size = None
+        self.spiking_layers = [layer for layer in layers if layer.is_spiking]
+        self._slots_b = self._mem_n_b_l = None
+        self.set_batch_size(batch_size)
+
+    def set_batch_size(self, batch_size):
+        """Reallocate the state variables for a new batch size."""
+
+        self.batch_size = batch_size
+        for layer in self.spiking_layers:
+            layer.init_state(batch_size)
+        self._slots_b = np.arange(batch_size)
+        self._mem_n_b_l = None
+
+    def set_constant_input(self, is_constant):
+        """Declare whether the input stays the same in every time step.
+
+        In that case, the synaptic input to the first layers is computed only
+        once per batch and reused in subsequent steps.
+        """
+
+        for layer in self.spiking_layers:
+            layer.cache_impulse = is_constant and \
+                layer.inbound == [self.input_name]
+            layer._impulse = None
+
+    def reset_slots(self, mask_b):
+        """Reset the state variables of the samples selected by the boolean
+        array ``mask_b``, e.g. to simulate a new sample in their place."""
+
+        for layer in self.spiking_layers:
+            layer.reset_slots(mask_b)
+
+    def select(self, idx):
+        """Keep only the samples ``idx`` of the batch.
+
+        Parameters
+        ----------
+
+        idx: ndarray
+            Indices or boolean mask of the samples to keep simulating.
+        """
+
+        # Keep the membrane potentials of the removed samples, so that the
+        # full batch can be restored with `restore_batch`.
+        if self._mem_n_b_l is None:
+            self._mem_n_b_l = [np.copy(layer.mem)
+                               for layer in self.spiking_layers]
+        for layer, mem_b_l in zip(self.spiking_layers, self._mem_n_b_l):
+            mem_b_l[self._slots_b] = layer.mem
+            layer.select(idx)
+        self._slots_b = self._slots_b[idx]
+        self.batch_size = len(self.spiking_layers[0].mem)
+
+    def restore_batch(self):
+        """Undo `select` and simulate the full batch again.
+
+        The membrane potential of each removed sample is restored to its
+        value at the time of removal, so that it can be carried over to the
+        next batch (see ``reset_between_nth_sample``). The other state
+        variables are reset.
+        """
+
+        if self._mem_n_b_l is None:
+            return
+        for layer, mem_b_l in zip(self.spiking_layers, self._mem_n_b_l):
+            mem_b_l[self._slots_b] = layer.mem
+            layer.init_state(len(mem_b_l))
+            layer.mem = mem_b_l
+        self.batch_size = len(self._mem_n_b_l[0])
+        self._slots_b = np.arange(self.batch_size)
+        self._mem_n_b_l = None
+
+    def step(self, input_b_l, t):
+        """Advance the network by one time step.
+
+        Parameters
+        ----------
+
+        input_b_l: ndarray
+            Input to the network in the current time step.
+        t: float
+            Current simulation time.
+
+        Returns
+        -------
+
+        output_b_l: ndarray
+            Spikes of the output layer.
+        """
+
+        activity = {self.input_name: input_b_l}
+        for layer in self.layers:
+            x = [activity[name] for name in layer.inbound]
+            activity[layer.name] = layer(x[0] if len(x) == 1 else x, t)
+        return activity[self.layers[-1].name]
+
+    def reset(self, reset_mem=True):
+        """Reset the state variables of all layers."""
+
+        for layer in self.layers:
+            layer.reset(reset_mem)
+
+    def run(self, x_b_l, num_timesteps, dt=1.):
+        """Simulate the network on a batch of samples with constant input.
+
+        Parameters
+        ----------
+
+        x_b_l: ndarray
+            Batch of input samples. Shape: (``batch_size``, ``layer_shape``).
+        num_timesteps: int
+            Number of time steps to simulate.
+        dt: float
+            Time resolution of the simulator.
+
+        Returns
+        -------
+
+        spikecounts_b_l: ndarray
+            Number of spikes of each neuron in the output layer.
+        """
+
+        if len(x_b_l) != self.batch_size:
+            self.set_batch_size(len(x_b_l))
+        else:
+            self.reset()
+        self.set_constant_input(True)
+        input_b_l = np.asarray(x_b_l, 'float32') * dt
+        spikecounts_b_l = 0
+        for sim_step_int in range(num_timesteps):
+            output_b_l = self.step(input_b_l, (sim_step_int + 1) * dt)
+            spikecounts_b_l += np.not_equal(output_b_l, 0).astype('int32')
+        return spikecounts_b_l
+
+    def save(self, filepath):
+        """Write the layer specifications and weights of the network to an
+        ``.npz`` file, which can be read by `load_network`."""
+
+        arrays = {}
+        specs = []
+        for i, layer in enumerate(self.layers):
+            specs.append({'class_name': layer.__class__.__name__,
+                          'config': layer.get_config()})
+            for key, value in layer.get_weights().items():
+                arrays['{}_{}'.format(i, key)] = value
+        arrays['network'] = np.array(json.dumps(
+            {'input_name': self.input_name, 'layers': specs}))
+        np.savez(filepath, **arrays)
+
+
+def load_network(filepath, batch_size=1):
+    """Restore a network that was saved with `SpikingNetwork.save`.
+
+    Parameters
+    ----------
+
+    filepath: str
+        Path to ``.npz`` file.
+    batch_size: int
+        Number of samples simulated in parallel.
+
+    Returns
+    -------
+
+    snn: SpikingNetwork
+        The spiking network.
+    """
+
+    with np.load(filepath) as f:
+        spec = json.loads(str(f['network']))
+        layers = []
+        for i, layer_spec in enumerate(spec['layers']):
+            kwargs = layer_spec['config']
+            prefix = '{}_'.format(i)
+            kwargs.update({key[len(prefix):]: f[key] for key in f.files
+                           if key.startswith(prefix)})
+            layers.append(globals()[layer_spec['class_name']](**kwargs))
+    return SpikingNetwork(layers, spec['input_name'], batch_size)
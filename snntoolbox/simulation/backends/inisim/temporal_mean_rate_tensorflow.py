@@ -23,6 +23,7 @@ from keras.layers import Dense, Flatten, AveragePooling2D, MaxPooling2D, Conv2D
 from keras.layers import Layer, Concatenate
 
 from snntoolbox.parsing.utils import get_inbound_layers
+from snntoolbox.simulation.backends.inisim.utils import reset_state
 
 standard_library.install_aliases()
 
@@ -45,6 +46,8 @@ class SpikeLayer(Layer):
         self.time = None
         self.mem = self.spiketrain = self.impulse = self.spikecounts = None
         self.refrac_until = self.max_spikerate = None
+        self.spiketrain_buffer = self.mem_buffer = None
+        self.record_every = self.config.getint('output', 'record_every')
         if self.config.getboolean('cell', 'bias_relaxation'):
             self.b0 = None
         if clamp_var:
@@ -81,12 +84,47 @@ class SpikeLayer(Layer):
                 kwargs.pop(kwarg)
         Layer.__init__(self, **kwargs)
         self.stateful = True
+        self.eager_updates = False
 
     def reset(self, sample_idx):
         """Reset layer variables."""
 
         self.reset_spikevars(sample_idx)
 
+    def reset_slots(self, mask_b):
+        """Reset the state variables of some samples in the batch.
+
+        Parameters
+        ----------
+
+        mask_b: ndarray
+            Boolean array of length `batch_size`, which is ``True`` at the
+            positions of the samples to reset.
+        """
+
+        self.reset_spikevars(None, mask_b)
+
+    def add_update(self, updates, inputs=None):
+        """Add state updates to the layer.
+
+        By default, the ``(variable, new_value)`` pairs are collected by Keras
+        and applied after each call of ``predict_on_batch``. If
+        ``eager_updates`` is set, the layer is executed inside a fused
+        multi-step graph (see
+        :py:meth:`~snntoolbox.simulation.target_simulators.INI_temporal_mean_rate_target_sim.SNN.run_fused_steps`),
+        and the updates are assigned immediately so that the next time step
+        sees the new state.
+        """
+
+        if self.eager_updates:
+            for update in updates:
+                # Update ops (e.g. from `record`) have already been executed.
+                if isinstance(update, tuple):
+                    variable, new_value = update
+                    variable.assign(new_value)
+        else:
+            Layer.add_update(self, updates, inputs)
+
     @property
     def class_name(self):
         """Get class name."""
@@ -139,11 +177,36 @@ class SpikeLayer(Layer):
                               k.max(self.spikecounts) * self.dt / self.time)])
 
         if self.spiketrain is not None:
-            self.add_update([(self.spiketrain, self.time * k.cast(
-                k.not_equal(output_spikes, 0), k.floatx()))])
+            spiketrain = self.time * k.cast(k.not_equal(output_spikes, 0),
+                                            k.floatx())
+            self.add_update([(self.spiketrain, spiketrain)])
+            if self.spiketrain_buffer is not None:
+                self.record(self.spiketrain_buffer, spiketrain)
 
         return k.cast(output_spikes, k.floatx())
 
+    def record(self, buffer, value):
+        """Write ``value`` into the recording ``buffer`` on the device.
+
+        The buffer has one slot per recorded time step, plus a last slot that
+        absorbs the writes of the time steps which are skipped when only every
+        ``record_every``-th step is recorded. This way, recording needs no
+        conditional in the graph.
+
+        Parameters
+        ----------
+
+        buffer: tf.Variable
+            Recording buffer of shape (``num_slots + 1``, ``output_shape``).
+        value: tf.Tensor
+            State variable to record in the current time step.
+        """
+
+        step = k.cast(k.round(self.time / self.dt), 'int32') - 1
+        slot = tf.where(k.equal(step % self.record_every, 0),
+                        step // self.record_every, k.shape(buffer)[0] - 1)
+        self.add_update([buffer[slot].assign(value)])
+
     def update_payload(self, residuals, spikes):
         """Update payloads.
 
@@ -258,6 +321,8 @@ class SpikeLayer(Layer):
         else:  # self.config.get('cell', 'reset') == 'Reset to zero':
             new = tf.where(k.not_equal(spikes, 0), k.zeros_like(mem), mem)
         self.add_update([(self.mem, new)])
+        if self.mem_buffer is not None:
+            self.record(self.mem_buffer, new)
 
     def get_new_thresh(self):
         """Get new threshhold."""
@@ -341,37 +406,55 @@ class SpikeLayer(Layer):
             init_mem = np.zeros(output_shape, k.floatx())
         return init_mem
 
-    def reset_spikevars(self, sample_idx):
+    def reset_spikevars(self, sample_idx, mask_b=None):
         """
         Reset variables present in spiking layers. Can be turned off for
         instance when a video sequence is tested.
+
+        Parameters
+        ----------
+
+        sample_idx: Optional[int]
+            Index of the sample that has just been simulated. Determines
+            whether the membrane potential is reset (see
+            ``reset_between_nth_sample``).
+        mask_b: Optional[ndarray]
+            Boolean array of length `batch_size`. If given, only the samples
+            of the batch where ``mask_b`` is ``True`` are reset, including
+            their membrane potential. The simulation time is left unchanged.
         """
 
-        mod = self.config.getint('simulation', 'reset_between_nth_sample')
-        mod = mod if mod else sample_idx + 1
-        do_reset = sample_idx % mod == 0
+        if mask_b is None:
+            mod = self.config.getint('simulation', 'reset_between_nth_sample')
+            mod = mod if mod else sample_idx + 1
+            do_reset = sample_idx % mod == 0
+        else:
+            do_reset = True
         if do_reset:
-            k.set_value(self.mem, self.init_membrane_potential())
-            k.set_value(self.time, np.float32(self.dt))
+            reset_state(self.mem, mask_b=mask_b)
+            if mask_b is None:
+                k.set_value(self.time, np.float32(self.dt))
         if self.tau_refrac > 0:
-            k.set_value(self.refrac_until,
-                        np.zeros(self.output_shape, k.floatx()))
+            reset_state(self.refrac_until, mask_b=mask_b)
         if self.spiketrain is not None:
-            k.set_value(self.spiketrain,
-                        np.zeros(self.output_shape, k.floatx()))
+            reset_state(self.spiketrain, mask_b=mask_b)
         if self.payloads:
-            k.set_value(self.payloads,
-                        np.zeros(self.output_shape, k.floatx()))
-            k.set_value(self.payloads_sum,
-                        np.zeros(self.output_shape, k.floatx()))
+            reset_state(self.payloads, mask_b=mask_b)
+            reset_state(self.payloads_sum, mask_b=mask_b)
+        # The recording buffers have the time dimension first and are only
+        # reset between batches.
+        if self.spiketrain_buffer is not None and mask_b is None:
+            reset_state(self.spiketrain_buffer)
+        if self.mem_buffer is not None and mask_b is None:
+            reset_state(self.mem_buffer)
         if self.online_normalization and do_reset:
-            k.set_value(self.spikecounts,
-                        np.zeros(self.output_shape, k.floatx()))
-            k.set_value(self.max_spikerate, np.float32(0.))
-            k.set_value(self.v_thresh, np.float32(self._v_thresh))
+            reset_state(self.spikecounts, mask_b=mask_b)
+            if mask_b is None:
+                k.set_value(self.max_spikerate, np.float32(0.))
+                k.set_value(self.v_thresh, np.float32(self._v_thresh))
         if clamp_var and do_reset:
-            k.set_value(self.spikerate, np.zeros(self.input_shape, k.floatx()))
-            k.set_value(self.var, np.zeros(self.input_shape, k.floatx()))
+            reset_state(self.spikerate, mask_b=mask_b)
+            reset_state(self.var, mask_b=mask_b)
 
     def init_neurons(self, input_shape):
         """Init layer neurons."""
@@ -392,6 +475,19 @@ class SpikeLayer(Layer):
                 'spiketrains_n_b_l_t'} & (get_plot_keys(self.config) |
                get_log_keys(self.config))):
             self.spiketrain = k.zeros(output_shape, name='spiketrains')
+        if self.config.getboolean('output', 'record_on_device') and \
+                self.is_recorded():
+            # Preallocate one slot per recorded time step (and one to discard
+            # the steps that are not recorded).
+            num_slots = int(np.ceil(self.duration / self.dt /
+                                    self.record_every)) + 1
+            buffer_shape = [num_slots] + list(output_shape)
+            if self.spiketrain is not None:
+                self.spiketrain_buffer = k.zeros(buffer_shape,
+                                                 name='spiketrain_buffer')
+            if 'mem_n_b_l_t' in get_log_keys(self.config) or \
+                    'v_mem' in get_plot_keys(self.config):
+                self.mem_buffer = k.zeros(buffer_shape, name='mem_buffer')
         if self.online_normalization:
             self.spikecounts = k.zeros(output_shape, name='spikecounts')
             self.max_spikerate = k.variable(0, name='max_spikerate')
@@ -404,6 +500,15 @@ class SpikeLayer(Layer):
         if hasattr(self, 'clamp_idx'):
             self.clamp_idx = self.get_clamp_idx()
 
+    def is_recorded(self):
+        """Whether the layer is selected for recording on the device."""
+
+        from snntoolbox.bin.utils import config_string_to_set_of_strings
+
+        record_layers = config_string_to_set_of_strings(
+            self.config.get('output', 'record_layers'))
+        return len(record_layers) == 0 or self.name in record_layers
+
     def get_layer_idx(self):
         """Get index of layer."""
 
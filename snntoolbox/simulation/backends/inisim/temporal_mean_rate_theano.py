@@ -341,34 +341,61 @@ class SpikeLayer(Layer):
             init_mem = np.zeros(output_shape, k.floatx())
         return init_mem
 
-    def reset_spikevars(self, sample_idx):
+    def reset_spikevars(self, sample_idx, mask_b=None):
         """
         Reset variables present in spiking layers. Can be turned off for
         instance when a video sequence is tested.
+
+        Parameters
+        ----------
+
+        sample_idx: Optional[int]
+            Index of the sample that has just been simulated. Determines
+            whether the membrane potential is reset (see
+            ``reset_between_nth_sample``).
+        mask_b: Optional[ndarray]
+            Boolean array of length `batch_size`. If given, only the samples
+            of the batch where ``mask_b`` is ``True`` are reset, including
+            their membrane potential. The simulation time is left unchanged.
         """
 
-        mod = self.config.getint('simulation', 'reset_between_nth_sample')
-        mod = mod if mod else sample_idx + 1
-        do_reset = sample_idx % mod == 0
+        if mask_b is None:
+            mod = self.config.getint('simulation', 'reset_between_nth_sample')
+            mod = mod if mod else sample_idx + 1
+            do_reset = sample_idx % mod == 0
+            self.time.set_value(np.float32(self.dt))
+        else:
+            do_reset = True
         if do_reset:
-            self.mem.set_value(self.init_membrane_potential())
-        self.time.set_value(np.float32(self.dt))
+            reset_state(self.mem, mask_b=mask_b)
         if self.tau_refrac > 0:
-            self.refrac_until.set_value(np.zeros(self.output_shape,
-                                                 k.floatx()))
+            reset_state(self.refrac_until, mask_b=mask_b)
         if self.spiketrain is not None:
-            self.spiketrain.set_value(np.zeros(self.output_shape, k.floatx()))
+            reset_state(self.spiketrain, mask_b=mask_b)
         if self.payloads:
-            self.payloads.set_value(np.zeros(self.output_shape, k.floatx()))
-            self.payloads_sum.set_value(np.zeros(self.output_shape,
-                                                 k.floatx()))
+            reset_state(self.payloads, mask_b=mask_b)
+            reset_state(self.payloads_sum, mask_b=mask_b)
         if self.online_normalization and do_reset:
-            self.spikecounts.set_value(np.zeros(self.output_shape, k.floatx()))
-            self.max_spikerate.set_value(np.float32(0.))
-            self.v_thresh.set_value(np.float32(self._v_thresh))
+            reset_state(self.spikecounts, mask_b=mask_b)
+            if mask_b is None:
+                self.max_spikerate.set_value(np.float32(0.))
+                self.v_thresh.set_value(np.float32(self._v_thresh))
         if clamp_var and do_reset:
-            self.spikerate.set_value(np.zeros(self.input_shape, k.floatx()))
-            self.var.set_value(np.zeros(self.input_shape, k.floatx()))
+            reset_state(self.spikerate, mask_b=mask_b)
+            reset_state(self.var, mask_b=mask_b)
+
+    def reset_slots(self, mask_b):
+        """Reset the state variables of some samples in the batch.
+
+        Parameters
+        ----------
+
+        mask_b: ndarray
+            Boolean array of length `batch_size`, which is ``True`` at the
+            positions of the samples to reset.
+        """
+
+        self.reset_spikevars(None, mask_b)
 
     def init_neurons(self, input_shape):
         """Init layer neurons."""
@@ -457,6 +484,32 @@ class SpikeLayer(Layer):
             0, 1 - (1 - 2 * self.time / self.duration) * i / 50), 1)
 
 
+def reset_state(variable, value=0, mask_b=None):
+    """Set the entries of a state variable to ``value``.
+
+    The buffer of the shared variable is modified in place, so that no new
+    array is allocated.
+
+    Parameters
+    ----------
+
+    variable: theano.compile.SharedVariable
+        State variable of a spiking layer, with the batch dimension first.
+    value: float
+        Value to reset to.
+    mask_b: Optional[ndarray]
+        Boolean array of length `batch_size`. If given, only the samples of
+        the batch where ``mask_b`` is ``True`` are reset.
+    """
+
+    buffer = variable.get_value(borrow=True)
+    if mask_b is None:
+        buffer.fill(value)
+    else:
+        buffer[mask_b] = value
+    variable.set_value(buffer, borrow=True)
+
+
 def add_payloads(prev_layer, input_spikes):
     """Get payloads from previous layer."""
 
@@ -26,6 +26,8 @@ from keras import backend as k
 from keras.layers import Dense, Flatten, AveragePooling2D, MaxPooling2D, Conv2D
 from keras.layers import Layer, Concatenate
 
+from snntoolbox.simulation.backends.inisim.utils import reset_state
+
 standard_library.install_aliases()
 
 
@@ -196,22 +198,49 @@ class SpikeLayer(Layer):
             init_mem = np.zeros(output_shape, k.floatx())
         return init_mem
 
-    def reset_spikevars(self, sample_idx):
+    def reset_spikevars(self, sample_idx, mask_b=None):
         """
         Reset variables present in spiking layers. Can be turned off for
         instance when a video sequence is tested.
+
+        Parameters
+        ----------
+
+        sample_idx: Optional[int]
+            Index of the sample that has just been simulated. Determines
+            whether the membrane potential is reset (see
+            ``reset_between_nth_sample``).
+        mask_b: Optional[ndarray]
+            Boolean array of length `batch_size`. If given, only the samples
+            of the batch where ``mask_b`` is ``True`` are reset, including
+            their membrane potential. The simulation time is left unchanged.
         """
 
-        mod = self.config.getint('simulation', 'reset_between_nth_sample')
-        mod = mod if mod else sample_idx + 1
-        do_reset = sample_idx % mod == 0
+        if mask_b is None:
+            mod = self.config.getint('simulation', 'reset_between_nth_sample')
+            mod = mod if mod else sample_idx + 1
+            do_reset = sample_idx % mod == 0
+            k.set_value(self.time, np.float32(self.dt))
+        else:
+            do_reset = True
         if do_reset:
-            k.set_value(self.mem, self.init_membrane_potential())
-        k.set_value(self.time, np.float32(self.dt))
-        zeros_output_shape = np.zeros(self.output_shape, k.floatx())
+            reset_state(self.mem, mask_b=mask_b)
         if self.spiketrain is not None:
-            k.set_value(self.spiketrain, zeros_output_shape)
-        k.set_value(self.last_spiketimes, zeros_output_shape - 1)
+            reset_state(self.spiketrain, mask_b=mask_b)
+        reset_state(self.last_spiketimes, -1, mask_b)
+
+    def reset_slots(self, mask_b):
+        """Reset the state variables of some samples in the batch.
+
+        Parameters
+        ----------
+
+        mask_b: ndarray
+            Boolean array of length `batch_size`, which is ``True`` at the
+            positions of the samples to reset.
+        """
+
+        self.reset_spikevars(None, mask_b)
 
     def init_neurons(self, input_shape):
         """Init layer neurons."""
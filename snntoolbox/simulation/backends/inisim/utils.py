@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Functions shared by the Tensorflow backends of the INI simulator.
+
+@author: rbodo
+"""
+
+from __future__ import division, absolute_import
+from __future__ import print_function, unicode_literals
+
+import tensorflow as tf
+
+
+def reset_state(variable, value=0, mask_b=None):
+    """Set the entries of a state variable to ``value``.
+
+    The assignment runs on the device; no array of the size of the variable
+    is allocated on the host or copied to the device.
+
+    Parameters
+    ----------
+
+    variable: tf.Variable
+        State variable of a spiking layer, with the batch dimension first.
+    value: float
+        Value to reset to.
+    mask_b: Optional[ndarray]
+        Boolean array of length `batch_size`. If given, only the samples of
+        the batch where ``mask_b`` is ``True`` are reset.
+    """
+
+    value = tf.cast(value, variable.dtype)
+    if mask_b is None:
+        variable.assign(tf.fill(tf.shape(variable), value))
+    else:
+        mask_b = tf.reshape(tf.convert_to_tensor(mask_b, tf.bool),
+                            [-1] + [1] * (len(variable.shape) - 1))
+        variable.assign(tf.where(mask_b, value, variable))
@@ -0,0 +1,461 @@
+# coding=utf-8
+
+"""Encoders that turn input samples into input frames of a spiking network.
+
+All encoders implement the same method ``encode(x_b_l, num_steps,
+sample_idxs_b, start_step)``, which returns the input of ``num_steps``
+consecutive time steps in a single array of shape (``num_steps``,
+`batch_size`, ``layer_shape``). This decouples the cost of encoding the input
+from the cost of simulating the network, and allows to benchmark it on its
+own. The encoder used by a simulator is selected with the config option
+``input_encoding`` (see :ref:`configuration`), and can be looked up by name
+in the ``encoders`` dictionary.
+
+Deterministic encodings can be stored in an `EncodingCache`, so that repeated
+simulations of the same samples (for instance in a parameter sweep) reuse the
+input spikes instead of generating them again.
+
+@author: rbodo
+"""
+
+from __future__ import division
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class Encoder(object):
+    """Base class of input encoders.
+
+    Parameters
+    ----------
+
+    num_timesteps: int
+        Number of time steps of a simulation.
+    dt: float
+        Time resolution of the simulation.
+
+    Attributes
+    ----------
+
+    name: str
+        Name of the encoding, used as key in ``encoders``.
+    is_spiking: bool
+        Whether the encoder emits spikes, which change from one time step to
+        the next. Otherwise, the same analog input is applied at each step.
+    is_cacheable: bool
+        Whether the encoding of a sample only depends on the sample and the
+        configuration of the encoder, so that it can be stored in an
+        `EncodingCache`.
+    """
+
+    name = None
+    is_spiking = True
+    is_cacheable = True
+
+    def __init__(self, num_timesteps, dt=1.):
+
+        self.num_timesteps = num_timesteps
+        self.dt = dt
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+        """Encode a batch of samples.
+
+        Parameters
+        ----------
+
+        x_b_l: ndarray
+            The input samples. Shape: (`batch_size`, ``layer_shape``).
+        num_steps: int
+            Number of time steps to encode.
+        sample_idxs_b: Optional[ndarray]
+            Index of each sample of the batch in the test set.
+        start_step: Union[int, ndarray]
+            Time step of the first frame. Can be given per sample.
+        x_max: Optional[Union[float, ndarray]]
+            Maximum input value, which sets the size of the spikes. Can be
+            given per sample. Defaults to the maximum of ``x_b_l``, in which
+            case the encoding of a sample depends on the rest of its batch.
+
+        Returns
+        -------
+
+        input_t_b_l: ndarray
+            Input frames of shape (``num_steps``, `batch_size`,
+            ``layer_shape``).
+        """
+
+        raise NotImplementedError
+
+    def get_config(self):
+        """Return the parameters that determine the encoding."""
+
+        return {'name': self.name, 'num_timesteps': self.num_timesteps,
+                'dt': self.dt}
+
+    def get_steps(self, x_b_l, num_steps, start_step):
+        """Return the time step of each frame and sample.
+
+        The result has shape (``num_steps``, `batch_size`, 1, ..., 1) so that
+        it broadcasts against the input frames.
+        """
+
+        start_steps_b = np.broadcast_to(start_step, len(x_b_l))
+        steps_t_b = start_steps_b + np.arange(num_steps)[:, None]
+        return np.reshape(steps_t_b, steps_t_b.shape + (1,) * (x_b_l.ndim - 1))
+
+    @staticmethod
+    def get_x_max(x_b_l, x_max=None):
+        """Return the maximum input value of each sample.
+
+        The result has shape (`batch_size`, 1, ..., 1) so that it broadcasts
+        against ``x_b_l``.
+        """
+
+        if x_max is None:
+            x_max = np.max(x_b_l)
+        x_max_b = np.broadcast_to(x_max, len(x_b_l))
+        return np.reshape(x_max_b, (-1,) + (1,) * (x_b_l.ndim - 1))
+
+
+class RateEncoder(Encoder):
+    """Apply the input sample as constant current in each time step."""
+
+    name = 'rate'
+    is_spiking = False
+    is_cacheable = False
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        input_b_l = (x_b_l * self.dt).astype('float32')
+        return np.broadcast_to(input_b_l, (num_steps,) + x_b_l.shape)
+
+
+class PoissonEncoder(Encoder):
+    """Emit Poisson spikes at a rate proportional to the input value.
+
+    See :py:func:`snntoolbox.simulation.utils.get_poisson_frames`.
+
+    Parameters
+    ----------
+
+    input_rate: float
+        Spike rate in Hz of a fully-on input neuron.
+    seed: int
+        Seed of the random number generator.
+    """
+
+    name = 'poisson'
+
+    def __init__(self, num_timesteps, dt=1., input_rate=1000, seed=0):
+
+        Encoder.__init__(self, num_timesteps, dt)
+        self.input_rate = input_rate
+        self.seed = seed
+        self.rescale_fac = 1000 / (input_rate * dt)
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        from snntoolbox.simulation.utils import get_poisson_frames
+
+        if sample_idxs_b is None:
+            sample_idxs_b = np.arange(len(x_b_l))
+        return get_poisson_frames(x_b_l, num_steps, self.rescale_fac,
+                                  self.seed, sample_idxs_b, start_step, x_max)
+
+    def get_config(self):
+
+        config = Encoder.get_config(self)
+        config.update(input_rate=self.input_rate, seed=self.seed)
+        return config
+
+
+class LatencyEncoder(Encoder):
+    """Time-to-first-spike encoding.
+
+    Each input neuron fires a single spike. The larger the input value, the
+    earlier the spike: The maximum input fires in the first time step, and a
+    vanishing input does not fire at all. As for the Poisson input, spikes
+    have the size of the maximum input value and the sign of the input. A
+    sample whose maximum input value is not positive does not fire.
+    """
+
+    name = 'latency'
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        x_max = self.get_x_max(x_b_l, x_max)
+        # Avoid dividing by a vanishing or negative maximum.
+        is_valid = x_max > 0
+        x_b_l_normed = np.abs(x_b_l) / np.where(is_valid, x_max, 1)
+        spiketimes_b_l = np.round((1 - x_b_l_normed) *
+                                  (self.num_timesteps - 1))
+        spiketimes_b_l[(x_b_l == 0) | ~is_valid] = -1
+        steps_t_b = self.get_steps(x_b_l, num_steps, start_step)
+        return np.where(steps_t_b == spiketimes_b_l,
+                        x_max * np.sign(x_b_l), 0).astype('float32')
+
+
+class BurstEncoder(Encoder):
+    """Burst coding.
+
+    An input neuron fires a burst of spikes at the beginning of the
+    simulation. The number of spikes grows with the input value, and the
+    inter-spike interval shrinks with it. Spikes have the size of the maximum
+    input value and the sign of the input. A sample whose maximum input value
+    is not positive does not fire.
+
+    Parameters
+    ----------
+
+    max_num_spikes: int
+        Number of spikes in the burst of the maximum input.
+    min_isi: int
+        Inter-spike interval (in time steps) of the maximum input.
+    max_isi: int
+        Inter-spike interval (in time steps) of a vanishing input.
+    """
+
+    name = 'burst'
+
+    def __init__(self, num_timesteps, dt=1., max_num_spikes=5, min_isi=2,
+                 max_isi=10):
+
+        Encoder.__init__(self, num_timesteps, dt)
+        self.max_num_spikes = max_num_spikes
+        self.min_isi = min_isi
+        self.max_isi = max_isi
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        x_max = self.get_x_max(x_b_l, x_max)
+        is_valid = x_max > 0
+        x_b_l_normed = np.abs(x_b_l) / np.where(is_valid, x_max, 1)
+        num_spikes_b_l = np.where(
+            is_valid, np.ceil(x_b_l_normed * self.max_num_spikes), 0)
+        isi_b_l = np.ceil(self.max_isi -
+                          (self.max_isi - self.min_isi) * x_b_l_normed)
+        steps_t_b = self.get_steps(x_b_l, num_steps, start_step)
+        is_spike = (steps_t_b % isi_b_l == 0) & \
+            (steps_t_b // isi_b_l < num_spikes_b_l)
+        return np.where(is_spike, x_max * np.sign(x_b_l), 0).astype('float32')
+
+    def get_config(self):
+
+        config = Encoder.get_config(self)
+        config.update(max_num_spikes=self.max_num_spikes,
+                      min_isi=self.min_isi, max_isi=self.max_isi)
+        return config
+
+
+class DVSEncoder(Encoder):
+    """Read event frames of a DVS recording.
+
+    The frames do not depend on ``x_b_l``, but are taken from the
+    `snntoolbox.datasets.aedat.DVSIterator` set with `set_source`.
+    """
+
+    name = 'dvs'
+    is_cacheable = False
+
+    def __init__(self, num_timesteps, dt=1.):
+
+        Encoder.__init__(self, num_timesteps, dt)
+        self.dvs_gen = None
+
+    def set_source(self, dvs_gen):
+        """Set the `DVSIterator` from which to read the event frames."""
+
+        self.dvs_gen = dvs_gen
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        return np.array([self.dvs_gen.next_eventframe_batch()
+                         for _ in range(num_steps)], 'float32')
+
+
+encoders = {encoder.name: encoder for encoder in [
+    RateEncoder, PoissonEncoder, LatencyEncoder, BurstEncoder, DVSEncoder]}
+
+
+class EncodingCache(object):
+    """Store the encoded input of samples.
+
+    The first time a sample is requested, it is encoded for the whole
+    simulation duration. Later requests slice the stored array. The cache
+    keeps the encodings in memory, or in ``.npy`` files in a subdirectory of
+    ``path`` that is specific to the configuration of the encoder. Files on
+    disk are memory-mapped when read, and persist between runs.
+
+    An encoding is keyed by the index of the sample in the test set and by a
+    fingerprint of the sample values and of the maximum input value that sets
+    the spike size. Changing the dataset, the preprocessing or the batch
+    composition therefore encodes the samples again instead of returning
+    stale spikes.
+
+    Parameters
+    ----------
+
+    encoder: Encoder
+        The encoder to cache. Must be cacheable.
+    path: Optional[str]
+        Directory where to store the encodings. If ``None``, the encodings are
+        kept in memory.
+    max_bytes: int
+        Maximum size of the encodings kept in memory. When exceeded, the least
+        recently used encodings are dropped.
+    """
+
+    def __init__(self, encoder, path=None, max_bytes=2 ** 30):
+
+        assert encoder.is_cacheable, \
+            "The {} encoding cannot be cached.".format(encoder.name)
+        self.encoder = encoder
+        self.name = encoder.name
+        self.is_spiking = encoder.is_spiking
+        self.num_timesteps = encoder.num_timesteps
+        self.max_bytes = max_bytes
+        self.path = None
+        self._cache = OrderedDict()
+        self._num_bytes = 0
+        if path is not None:
+            key = hashlib.sha1(json.dumps(encoder.get_config(),
+                                          sort_keys=True).encode()).hexdigest()
+            self.path = os.path.join(path, '{}_{}'.format(encoder.name,
+                                                          key[:16]))
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+
+    @staticmethod
+    def get_key(sample_idx, x_l, x_max):
+        """Return the key of a sample, given its values ``x_l`` and the
+        maximum input value ``x_max``."""
+
+        fingerprint = hashlib.sha1(np.ascontiguousarray(x_l).tobytes())
+        fingerprint.update(str((x_l.dtype.str, x_l.shape,
+                                float(x_max))).encode())
+        return '{}_{}'.format(sample_idx, fingerprint.hexdigest()[:16])
+
+    def get_filepath(self, key):
+        return os.path.join(self.path, '{}.npy'.format(key))
+
+    def load(self, key):
+        """Return the stored encoding of a sample, or ``None``."""
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        if self.path is not None:
+            filepath = self.get_filepath(key)
+            if os.path.isfile(filepath):
+                return np.load(filepath, mmap_mode='r')
+
+    def store(self, key, input_t_l):
+        """Store the encoding of a sample."""
+
+        if self.path is not None:
+            np.save(self.get_filepath(key), input_t_l)
+            return
+
+        if input_t_l.nbytes > self.max_bytes:
+            return
+        self._cache[key] = input_t_l
+        self._num_bytes += input_t_l.nbytes
+        while self._num_bytes > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._num_bytes -= evicted.nbytes
+
+    def encode(self, x_b_l, num_steps, sample_idxs_b=None, start_step=0,
+               x_max=None):
+
+        if sample_idxs_b is None:
+            sample_idxs_b = np.arange(len(x_b_l))
+        x_max_b = self.encoder.get_x_max(x_b_l, x_max).ravel()
+        keys_b = [self.get_key(int(i), x_l, m)
+                  for i, x_l, m in zip(sample_idxs_b, x_b_l, x_max_b)]
+        encodings_b = [self.load(key) for key in keys_b]
+
+        missing_b = [i for i, e in enumerate(encodings_b) if e is None]
+        if len(missing_b) > 0:
+            input_t_b_l = self.encoder.encode(
+                x_b_l[missing_b], self.num_timesteps,
+                np.asarray(sample_idxs_b)[missing_b], x_max=x_max_b[missing_b])
+            for j, i in enumerate(missing_b):
+                encodings_b[i] = np.ascontiguousarray(input_t_b_l[:, j])
+                self.store(keys_b[i], encodings_b[i])
+
+        start_steps_b = np.broadcast_to(start_step, len(x_b_l))
+        input_t_b_l = np.zeros((num_steps,) + x_b_l.shape, 'float32')
+        for i, (input_t_l, step) in enumerate(zip(encodings_b,
+                                                  start_steps_b)):
+            input_t_l = input_t_l[step:step + num_steps]
+            input_t_b_l[:len(input_t_l), i] = input_t_l
+        return input_t_b_l
+
+    def clear(self):
+        """Remove all encodings from the cache."""
+
+        self._cache = OrderedDict()
+        self._num_bytes = 0
+        if self.path is not None:
+            for filename in os.listdir(self.path):
+                os.remove(os.path.join(self.path, filename))
+
+
+def get_encoder(config, seed=None):
+    """Create the input encoder specified in the config.
+
+    Parameters
+    ----------
+
+    config: configparser.ConfigParser
+        Settings.
+    seed: Optional[int]
+        Seed of random encoders. Defaults to the ``poisson_seed`` option.
+
+    Returns
+    -------
+
+    encoder: Union[Encoder, EncodingCache]
+        The encoder, wrapped in an `EncodingCache` if the option
+        ``encoding_cache`` is set.
+    """
+
+    name = config.get('input', 'input_encoding')
+    if not name:
+        if config.getboolean('input', 'poisson_input'):
+            name = 'poisson'
+        elif config.get('input', 'dataset_format') == 'aedat':
+            name = 'dvs'
+        else:
+            name = 'rate'
+    if name not in encoders:
+        raise NotImplementedError("Input encoding {} not supported. Choose "
+                                  "from {}.".format(name, list(encoders)))
+
+    dt = config.getfloat('simulation', 'dt')
+    kwargs = eval(config.get('input', 'encoder_kwargs'))
+    if name == 'poisson':
+        if seed is None:
+            seed = config.get('input', 'poisson_seed')
+            seed = int(seed) if seed else np.random.randint(2 ** 31)
+        kwargs.update(input_rate=config.getint('input', 'input_rate'),
+                      seed=seed)
+    encoder = encoders[name](
+        int(config.getint('simulation', 'duration') / dt), dt, **kwargs)
+
+    cache = config.get('input', 'encoding_cache')
+    if cache and encoder.is_cacheable:
+        encoder = EncodingCache(encoder, None if cache == 'memory' else cache)
+
+    return encoder
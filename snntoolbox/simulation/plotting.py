@@ -1088,7 +1088,8 @@ def plot_spikecount_vs_time(spiketrains_n_b_l_t, duration, dt, path=None):
     Parameters
     ----------
 
-    spiketrains_n_b_l_t:
+    spiketrains_n_b_l_t: list[tuple[Union[np.array, SparseSpiketrains], str]]
+        Spike trains of each layer.
     duration: int
         Simulation duration.
     dt: float
@@ -1097,11 +1098,16 @@ def plot_spikecount_vs_time(spiketrains_n_b_l_t, duration, dt, path=None):
         Where to save the output.
     """
 
+    from snntoolbox.simulation.utils import SparseSpiketrains
+
     # batch time dimensions
     b_t_shape = (spiketrains_n_b_l_t[0][0].shape[0],
                  spiketrains_n_b_l_t[0][0].shape[-1])
     spikecounts_b_t = np.zeros(b_t_shape)
     for n in range(len(spiketrains_n_b_l_t)):  # Loop over layers
+        if isinstance(spiketrains_n_b_l_t[n][0], SparseSpiketrains):
+            spikecounts_b_t += spiketrains_n_b_l_t[n][0].get_spikecounts_b_t()
+            continue
         spiketrains_b_l_t = np.not_equal(spiketrains_n_b_l_t[n][0], 0)
         reduction_axes = tuple(np.arange(1, spiketrains_b_l_t.ndim-1))
         spikecounts_b_t += np.sum(spiketrains_b_l_t, reduction_axes)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""INI simulator with temporal mean rate code and event-driven NumPy backend.
+
+The spiking network is simulated with the layers defined in
+:py:mod:`~snntoolbox.simulation.backends.inisim.temporal_mean_rate_numpy`.
+Instead of evaluating every connection in every time step, only the spikes of
+active neurons are propagated to the next layer. This makes the simulator
+suitable for CPU-only machines and networks with sparse activity.
+
+@author: rbodo
+"""
+
+from __future__ import division, absolute_import
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+
+import numpy as np
+from future import standard_library
+
+from snntoolbox.simulation.utils import AbstractSNN
+
+standard_library.install_aliases()
+
+
+class SNN(AbstractSNN):
+    """
+    The compiled spiking neural network, using the event-driven layers of
+    `snntoolbox.simulation.backends.inisim.temporal_mean_rate_numpy`.
+
+    Attributes
+    ----------
+
+    snn: SpikingNetwork
+        The spiking network (see
+        `snntoolbox.simulation.backends.inisim.temporal_mean_rate_numpy`).
+    """
+
+    def __init__(self, config, queue=None):
+
+        AbstractSNN.__init__(self, config, queue)
+
+        assert config.get('conversion', 'spike_code') == \
+            'temporal_mean_rate', "The INI_numpy simulator only supports " \
+                                  "the 'temporal_mean_rate' spike code."
+
+        self.snn = None
+        self._layers = []
+        self._input_name = None
+        self.avg_rate = None
+        self._input_spikecount = None
+        self._early_exit_margin = config.getint('simulation',
+                                                'early_exit_margin')
+        self._early_exit_patience = config.getint('simulation',
+                                                  'early_exit_patience')
+
+    @property
+    def is_parallelizable(self):
+        return True
+
+    def add_input_layer(self, input_shape):
+        self._input_name = self.parsed_model.layers[0].name
+
+    def add_layer(self, layer):
+        from snntoolbox.bin.utils import get_log_keys, get_plot_keys
+        from snntoolbox.parsing.utils import get_type
+
+        layer_type = get_type(layer)
+        spike_layer_class = getattr(self.sim, 'Spike' + layer_type, None)
+        if spike_layer_class is None:
+            raise NotImplementedError(
+                "Layer type {} not supported by INI_numpy simulator.".format(
+                    layer_type))
+
+        # noinspection PyProtectedMember
+        inbound = [inb.name for inb in layer._inbound_nodes[0].inbound_layers]
+        layer_kwargs = {'name': layer.name, 'inbound': inbound,
+                        'output_shape': layer.output_shape[1:]}
+
+        if spike_layer_class.is_spiking:
+            layer_kwargs.update(
+                v_thresh=self.config.getfloat('cell', 'v_thresh'),
+                tau_refrac=self.config.getfloat('cell', 'tau_refrac'),
+                reset=self.config.get('cell', 'reset'),
+                leak=self.config.getboolean('cell', 'leak'), dt=self._dt,
+                activation=layer.activation.__name__
+                if hasattr(layer, 'activation') else 'linear',
+                record_spiketrain=any(
+                    {'spiketrains', 'spikerates', 'correlation',
+                     'spikecounts', 'hist_spikerates_activations',
+                     'operations', 'synaptic_operations_b_t',
+                     'neuron_operations_b_t', 'spiketrains_n_b_l_t'} &
+                    (get_plot_keys(self.config) | get_log_keys(self.config))))
+
+        if layer_type in {'Dense', 'Conv2D', 'DepthwiseConv2D'}:
+            weights = layer.get_weights()
+            layer_kwargs['kernel'] = weights[0]
+            layer_kwargs['bias'] = weights[1] if len(weights) > 1 else None
+        if layer_type in {'Conv2D', 'DepthwiseConv2D', 'MaxPooling2D',
+                          'AveragePooling2D'}:
+            layer_kwargs.update(input_shape=layer.input_shape[1:],
+                                strides=layer.strides, padding=layer.padding,
+                                data_format=layer.data_format)
+        if layer_type in {'MaxPooling2D', 'AveragePooling2D'}:
+            layer_kwargs['pool_size'] = layer.pool_size
+        elif layer_type == 'ZeroPadding2D':
+            layer_kwargs.update(padding=layer.padding,
+                                data_format=layer.data_format)
+        elif layer_type == 'Concatenate':
+            layer_kwargs['axis'] = layer.axis
+
+        self._layers.append(spike_layer_class(**layer_kwargs))
+
+    def build_dense(self, layer):
+        pass
+
+    def build_convolution(self, layer):
+        pass
+
+    def build_pooling(self, layer):
+        pass
+
+    def compile(self):
+
+        self.snn = self.sim.SpikingNetwork(self._layers, self._input_name,
+                                           self.batch_size)
+
+    def simulate(self, **kwargs):
+
+        from snntoolbox.utils.utils import echo
+        from snntoolbox.simulation.utils import get_layer_synaptic_operations
+        from snntoolbox.simulation.utils import update_confident_steps
+
+        x_b_l = kwargs[str('x_b_l')]
+        input_b_l = x_b_l * self._dt
+        # Fix the spike size of the input once per batch, so that removing
+        # decided samples does not change the input of the others.
+        x_max = np.max(x_b_l)
+
+        output_b_l_t = np.zeros((self.batch_size, self.num_classes,
+                                 self._num_timesteps))
+
+        # Without Poisson or DVS input, the input to the first layers is the
+        # same in every time step and can be computed once.
+        self.snn.set_constant_input(not self._spiking_input and
+                                    self._dataset_format != 'aedat')
+
+        print("Current accuracy of batch:")
+
+        # Loop through simulation time.
+        self.avg_rate = 0
+        self._input_spikecount = 0
+        num_sample_steps = 0
+        # Indices of the samples in the batch which are still simulated.
+        active_b = np.arange(self.batch_size)
+        confident_steps_b = np.zeros(self.batch_size, int)
+        for sim_step_int in range(self._num_timesteps):
+            sim_step = (sim_step_int + 1) * self._dt
+
+            # Generate new input in case it changes with each simulation step.
+            if self._spiking_input:
+                input_b_l = self.get_input_frame_batch(
+                    x_b_l[active_b], self._sample_idxs_b[active_b], x_max)
+            elif self._dataset_format == 'aedat':
+                input_b_l = kwargs[str('dvs_gen')].next_eventframe_batch()[
+                    active_b]
+            elif len(input_b_l) > len(active_b):
+                input_b_l = x_b_l[active_b] * self._dt
+
+            if self.config.getboolean('simulation', 'early_stopping') and \
+                    np.count_nonzero(input_b_l) == 0:
+                print("\nInput empty: Finishing simulation {} steps early."
+                      "".format(self._num_timesteps - sim_step_int))
+                break
+
+            # Main step: Propagate input through network and record output
+            # spikes.
+            out_spikes = self.snn.step(input_b_l, sim_step)
+            num_sample_steps += len(active_b)
+
+            output_b_l_t[active_b, :, sim_step_int] = out_spikes > 0
+
+            # Record neuron variables.
+            for i, layer in enumerate(self.snn.spiking_layers):
+                if layer.spiketrain is not None:
+                    spiketrains_b_l = layer.spiketrain
+                    self.avg_rate += np.count_nonzero(spiketrains_b_l)
+                    if self.spiketrains_n_b_l_t is not None:
+                        self.spiketrains_n_b_l_t[i][0][
+                            active_b, Ellipsis, sim_step_int] = spiketrains_b_l
+                    if self.synaptic_operations_b_t is not None:
+                        self.synaptic_operations_b_t[active_b,
+                                                     sim_step_int] += \
+                            get_layer_synaptic_operations(spiketrains_b_l,
+                                                          self.fanout[i + 1])
+                    if self.neuron_operations_b_t is not None:
+                        self.neuron_operations_b_t[active_b, sim_step_int] += \
+                            self.num_neurons_with_bias[i + 1]
+                if self.mem_n_b_l_t is not None:
+                    self.mem_n_b_l_t[i][0][active_b, Ellipsis,
+                                           sim_step_int] = layer.mem
+
+            if 'input_b_l_t' in self._log_keys:
+                self.input_b_l_t[active_b, Ellipsis, sim_step_int] = input_b_l
+            if self._spiking_input or self._dataset_format == 'aedat':
+                if self.synaptic_operations_b_t is not None:
+                    self.synaptic_operations_b_t[active_b, sim_step_int] += \
+                        get_layer_synaptic_operations(input_b_l,
+                                                      self.fanout[0])
+            else:
+                if self.neuron_operations_b_t is not None:
+                    if sim_step_int == 0:
+                        self.neuron_operations_b_t[:, 0] += self.fanin[1] * \
+                            self.num_neurons[1] * np.ones(self.batch_size) * 2
+
+            spike_sums_b_l = np.sum(output_b_l_t, 2)
+            undecided_b = np.sum(spike_sums_b_l, 1) == 0
+            guesses_b = np.argmax(spike_sums_b_l, 1)
+            none_class_b = -1 * np.ones(self.batch_size)
+            clean_guesses_b = np.where(undecided_b, none_class_b, guesses_b)
+            current_acc = np.mean(kwargs[str('truth_b')] == clean_guesses_b)
+            if self.config.getint('output', 'verbose') > 0 \
+                    and sim_step % 1 == 0:
+                echo('{:.2%}_'.format(current_acc))
+            else:
+                sys.stdout.write('\r{:>7.2%}'.format(current_acc))
+                sys.stdout.flush()
+
+            if self._early_exit_margin > 0:
+                # Freeze the output of decided samples and remove them from
+                # the simulated batch.
+                confident_steps_b = update_confident_steps(
+                    confident_steps_b, spike_sums_b_l[active_b],
+                    self._early_exit_margin)
+                keep_b = confident_steps_b < self._early_exit_patience
+                if not np.all(keep_b):
+                    active_b = active_b[keep_b]
+                    confident_steps_b = confident_steps_b[keep_b]
+                    self.snn.select(keep_b)
+                if len(active_b) == 0:
+                    print("\nOutput decided: Finishing simulation {} steps "
+                          "early.".format(self._num_timesteps -
+                                          sim_step_int - 1))
+                    break
+
+        if self._early_exit_margin > 0:
+            print("Average number of time steps per sample: {:.1f}".format(
+                num_sample_steps / self.batch_size))
+
+        self.avg_rate /= np.sum(self.num_neurons) * max(num_sample_steps, 1)
+
+        if self.spiketrains_n_b_l_t is None:
+            print("Average spike rate: {} spikes per simulation time step."
+                  "".format(self.avg_rate))
+
+        return np.cumsum(output_b_l_t, 2)
+
+    def reset(self, sample_idx):
+
+        mod = self.config.getint('simulation', 'reset_between_nth_sample')
+        mod = mod if mod else sample_idx + 1
+        # Bring back the samples removed from the batch by the early exit.
+        self.snn.restore_batch()
+        self.snn.reset(sample_idx % mod == 0)
+
+    def simulate_step(self, input_b_l, t):
+
+        return self.snn.step(input_b_l, t)
+
+    def reset_slots(self, mask_b):
+
+        if self.snn.batch_size != self.batch_size:
+            self.snn.set_batch_size(self.batch_size)
+        # The input of a slot changes when it is refilled.
+        self.snn.set_constant_input(False)
+        self.snn.reset_slots(mask_b)
+
+    def end_sim(self):
+        pass
+
+    def save(self, path, filename):
+
+        from snntoolbox.utils.utils import confirm_overwrite
+
+        filepath = os.path.join(path, filename + '.npz')
+        if self.config.getboolean('output', 'overwrite') \
+                or confirm_overwrite(filepath):
+            print("Saving model to {}...\n".format(filepath))
+            self.snn.save(filepath)
+
+    def load(self, path, filename):
+
+        filepath = os.path.join(path, filename + '.npz')
+        self.snn = self.sim.load_network(filepath, self.batch_size)
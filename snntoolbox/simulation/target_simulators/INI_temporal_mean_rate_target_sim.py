@@ -54,6 +54,35 @@ class SNN(AbstractSNN):
         self.latency = None
         self.acc_at_t = []
 
+        self._num_fused_steps = config.getint('simulation', 'fused_steps')
+        if self._num_fused_steps > 0 and \
+                config.getboolean('cell', 'bias_relaxation'):
+            print("SNN toolbox WARNING: Bias relaxation is not supported when "
+                  "fusing time steps. Setting fused_steps = 0.")
+            self._num_fused_steps = 0
+        self._fused_fn = None
+
+        # The state variables have a fixed batch size, so decided samples
+        # cannot be removed from a batch. Early exit only pays off with
+        # continuous batching, where their slots are refilled.
+        if config.getint('simulation', 'early_exit_margin') > 0 and \
+                not config.getboolean('simulation', 'continuous_batching'):
+            print("SNN toolbox WARNING: The INI simulator only supports "
+                  "early exit with continuous batching. Use "
+                  "continuous_batching = True, or the INI_numpy simulator. "
+                  "Setting early_exit_margin = 0.")
+            config.set('simulation', 'early_exit_margin', str(0))
+
+        self._record_on_device = config.getboolean('output',
+                                                   'record_on_device')
+        if self._record_on_device and \
+                config.get('simulation', 'keras_backend') != 'tensorflow':
+            print("SNN toolbox WARNING: Recording on the device is only "
+                  "supported with the tensorflow backend. Setting "
+                  "record_on_device = False.")
+            self._record_on_device = False
+            config.set('output', 'record_on_device', str(False))
+
     @property
     def is_parallelizable(self):
         return True
@@ -160,15 +189,33 @@ class SNN(AbstractSNN):
         self.avg_rate = 0
         self._input_spikecount = 0
         actual_num_timesteps = self._num_timesteps
+        input_t_b_l = fused_outputs = None
         for sim_step_int in range(self._num_timesteps):
             sim_step = (sim_step_int + 1) * self._dt
-            self.set_time(sim_step)
 
-            # Generate new input in case it changes with each simulation step.
-            if self._poisson_input:
-                input_b_l = self.get_poisson_frame_batch(kwargs[str('x_b_l')])
-            elif self._dataset_format == 'aedat':
-                input_b_l = kwargs[str('dvs_gen')].next_eventframe_batch()
+            if self._num_fused_steps > 0:
+                # Simulate a whole chunk of time steps in a single call, and
+                # read out the results of the current step below.
+                chunk_step = sim_step_int % self._num_fused_steps
+                if chunk_step == 0:
+                    num_steps = min(self._num_fused_steps,
+                                    self._num_timesteps - sim_step_int)
+                    input_t_b_l = self.get_fused_input_frames(
+                        input_b_l, num_steps, **kwargs)
+                    fused_outputs = self.run_fused_steps(input_t_b_l,
+                                                         sim_step, num_steps)
+                input_b_l = input_t_b_l[chunk_step % len(input_t_b_l)]
+            else:
+                chunk_step = None
+                self.set_time(sim_step)
+
+                # Generate new input in case it changes with each simulation
+                # step.
+                if self._spiking_input:
+                    input_b_l = self.get_input_frame_batch(
+                        kwargs[str('x_b_l')])
+                elif self._dataset_format == 'aedat':
+                    input_b_l = kwargs[str('dvs_gen')].next_eventframe_batch()
 
             if self.config.getboolean('simulation', 'early_stopping') and \
                     np.count_nonzero(input_b_l) == 0:
@@ -179,7 +226,10 @@ class SNN(AbstractSNN):
 
             # Main step: Propagate input through network and record output
             # spikes.
-            out_spikes = self.snn.predict_on_batch(input_b_l)
+            if fused_outputs is None:
+                out_spikes = self.snn.predict_on_batch(input_b_l)
+            else:
+                out_spikes = fused_outputs[0][chunk_step]
 
             # Add current spikes to previous spikes.
             if remove_classifier:  # Need to flatten output.
@@ -188,13 +238,18 @@ class SNN(AbstractSNN):
             else:
                 output_b_l_t[:, :, sim_step_int] = out_spikes > 0
 
-            # Record neuron variables.
+            # Record neuron variables. When recording on the device, the
+            # layers write into their buffers, which are fetched at the end.
             i = j = 0
-            for layer in self.snn.layers:
+            for layer in [] if self._record_on_device else self.snn.layers:
                 # Excludes Input, Flatten, Concatenate, etc:
                 if hasattr(layer, 'spiketrain') \
                         and layer.spiketrain is not None:
-                    spiketrains_b_l = keras.backend.get_value(layer.spiketrain)
+                    if fused_outputs is None:
+                        spiketrains_b_l = keras.backend.get_value(
+                            layer.spiketrain)
+                    else:
+                        spiketrains_b_l = fused_outputs[1][i][chunk_step]
                     self.avg_rate += np.count_nonzero(spiketrains_b_l)
                     if self.spiketrains_n_b_l_t is not None:
                         self.spiketrains_n_b_l_t[i][0][
@@ -209,12 +264,14 @@ class SNN(AbstractSNN):
                     i += 1
                 if hasattr(layer, 'mem') and self.mem_n_b_l_t is not None:
                     self.mem_n_b_l_t[j][0][Ellipsis, sim_step_int] = \
-                        keras.backend.get_value(layer.mem)
+                        keras.backend.get_value(layer.mem) \
+                        if fused_outputs is None \
+                        else fused_outputs[2][j][chunk_step]
                     j += 1
 
             if 'input_b_l_t' in self._log_keys:
                 self.input_b_l_t[Ellipsis, sim_step_int] = input_b_l
-            if self._poisson_input or self._dataset_format == 'aedat':
+            if self._spiking_input or self._dataset_format == 'aedat':
                 if self.synaptic_operations_b_t is not None:
                     self.synaptic_operations_b_t[:, sim_step_int] += \
                         get_layer_synaptic_operations(input_b_l,
@@ -247,7 +304,7 @@ class SNN(AbstractSNN):
         if self._dataset_format == 'aedat':
             remaining_events = \
                 len(kwargs[str('dvs_gen')].event_deques_batch[0])
-        elif self._poisson_input and self._num_poisson_events_per_sample > 0:
+        elif self._spiking_input and self._num_poisson_events_per_sample > 0:
             remaining_events = self._num_poisson_events_per_sample - \
                 self._input_spikecount
         else:
@@ -257,6 +314,11 @@ class SNN(AbstractSNN):
                   "but {} input events were not processed. Consider "
                   "increasing the simulation time.".format(remaining_events))
 
+        if self._record_on_device:
+            # Buffer slots of steps that were skipped by an early stop are
+            # still zero from the last reset.
+            self.fetch_recording_buffers(self._num_timesteps)
+
         self.avg_rate /= self.batch_size * np.sum(self.num_neurons) * \
             actual_num_timesteps
 
@@ -271,6 +333,17 @@ class SNN(AbstractSNN):
         for layer in self.snn.layers[1:]:  # Skip input layer
             layer.reset(sample_idx)
 
+    def simulate_step(self, input_b_l, t):
+
+        self.set_time(t)
+        return self.snn.predict_on_batch(input_b_l)
+
+    def reset_slots(self, mask_b):
+
+        for layer in self.snn.layers[1:]:
+            if hasattr(layer, 'reset_slots'):  # Excludes Flatten, etc.
+                layer.reset_slots(mask_b)
+
     def end_sim(self):
         pass
 
@@ -298,40 +371,188 @@ class SNN(AbstractSNN):
             # but since converting even large Keras models from scratch is so
             # fast, there's really no need.
 
-    def get_poisson_frame_batch(self, x_b_l):
-        """Get a batch of Poisson input spikes.
+    def fetch_recording_buffers(self, num_timesteps):
+        """Copy the variables recorded on the device to the host.
+
+        Fills the recorded time steps of ``spiketrains_n_b_l_t`` and
+        ``mem_n_b_l_t``, and derives the spike rate and operation counts from
+        the recorded spike trains. If only every ``record_every``-th step is
+        recorded, these counts are extrapolated from the recorded steps.
 
         Parameters
         ----------
 
-        x_b_l: ndarray
-            The input frame. Shape: (`batch_size`, ``layer_shape``).
+        num_timesteps: int
+            Number of time steps that were simulated.
+        """
+
+        from snntoolbox.simulation.utils import get_layer_synaptic_operations
+
+        every = self.config.getint('output', 'record_every')
+        num_slots = int(np.ceil(num_timesteps / every))
+        i = j = 0
+        for layer in self.snn.layers:
+            if hasattr(layer, 'spiketrain') and layer.spiketrain is not None:
+                if layer.spiketrain_buffer is not None:
+                    spiketrains_t_b_l = keras.backend.get_value(
+                        layer.spiketrain_buffer)[:num_slots]
+                    self.avg_rate += np.count_nonzero(spiketrains_t_b_l) * \
+                        every
+                    if self.spiketrains_n_b_l_t is not None:
+                        self.spiketrains_n_b_l_t[i][0][
+                            Ellipsis, :num_timesteps:every] = \
+                            np.moveaxis(spiketrains_t_b_l, 0, -1)
+                    if self.synaptic_operations_b_t is not None:
+                        for t, spiketrains_b_l in enumerate(spiketrains_t_b_l):
+                            ops_b = get_layer_synaptic_operations(
+                                spiketrains_b_l, self.fanout[i + 1])
+                            self.synaptic_operations_b_t[
+                                :, t * every:(t + 1) * every] += ops_b[:, None]
+                if self.neuron_operations_b_t is not None:
+                    self.neuron_operations_b_t[:, :num_timesteps] += \
+                        self.num_neurons_with_bias[i + 1]
+                i += 1
+            if hasattr(layer, 'mem') and self.mem_n_b_l_t is not None:
+                if layer.mem_buffer is not None:
+                    self.mem_n_b_l_t[j][0][Ellipsis, :num_timesteps:every] = \
+                        np.moveaxis(keras.backend.get_value(
+                            layer.mem_buffer)[:num_slots], 0, -1)
+                j += 1
+
+    def get_fused_input_frames(self, input_b_l, num_steps, **kwargs):
+        """Get the input frames for a chunk of fused time steps.
+
+        Parameters
+        ----------
+
+        input_b_l: ndarray
+            Constant input frame, scaled by the time resolution. Used if the
+            input does not change between time steps.
+        num_steps: int
+            Number of time steps in the chunk.
 
         Returns
         -------
 
-        input_b_l: ndarray
-            Array of Poisson input spikes, with same shape as ``x_b_l``.
+        input_t_b_l: ndarray
+            Array of shape (``num_steps``, `batch_size`, ``layer_shape``) if
+            the input changes with each time step (Poisson or DVS input).
+            Otherwise, a single frame of shape (1, `batch_size`,
+            ``layer_shape``) that is reused in every time step.
+        """
+
+        if self._spiking_input:
+            return self.get_input_frames(kwargs[str('x_b_l')], num_steps
+                                         ).astype(keras.backend.floatx())
+        floatx = keras.backend.floatx()
+        if self._dataset_format == 'aedat':
+            return np.array([kwargs[str('dvs_gen')].next_eventframe_batch()
+                             for _ in range(num_steps)], floatx)
+        return np.expand_dims(input_b_l, 0).astype(floatx)
+
+    def run_fused_steps(self, input_t_b_l, t_start, num_steps):
+        """Simulate several time steps in a single call.
+
+        The time loop over the state variables of the spiking layers is
+        compiled into one Tensorflow graph (see `get_fused_simulation_fn`),
+        so that the Keras dispatch and host / device transfers are paid once
+        per chunk instead of once per time step.
+
+        Parameters
+        ----------
+
+        input_t_b_l: ndarray
+            Input frames, as returned by `get_fused_input_frames`.
+        t_start: float
+            Simulation time of the first step in the chunk.
+        num_steps: int
+            Number of time steps to simulate.
+
+        Returns
+        -------
+
+        output_t_b_l: ndarray
+            Output spikes of the network for each time step.
+        spiketrains_n_t_b_l: list[ndarray]
+            Spike trains of the layers that record them, for each time step.
+        mem_n_t_b_l: list[ndarray]
+            Membrane potentials of the spiking layers, for each time step. Only
+            recorded if ``mem_n_b_l_t`` is logged.
+        """
+
+        import tensorflow as tf
+
+        if self._fused_fn is None:
+            self._fused_fn = self.get_fused_simulation_fn()
+
+        output_t_b_l, spiketrains_n_t_b_l, mem_n_t_b_l = self._fused_fn(
+            tf.constant(input_t_b_l),
+            tf.constant(t_start, keras.backend.floatx()),
+            tf.constant(num_steps))
+
+        return (output_t_b_l.numpy(), [s.numpy() for s in spiketrains_n_t_b_l],
+                [m.numpy() for m in mem_n_t_b_l])
+
+    def get_fused_simulation_fn(self):
+        """Compile the time loop of the network into a ``tf.function``.
+
+        Returns
+        -------
+
+        fused_fn: Callable
+            Function taking the input frames, the simulation time of the first
+            step, and the number of steps to simulate. Runs the steps in a
+            ``tf.while_loop`` and returns the stacked per-step outputs.
 
+        The layers apply their state updates immediately (see
+        ``SpikeLayer.add_update``) only while the function is traced, so that
+        `predict_on_batch` keeps working on the same network.
         """
 
-        if self._input_spikecount < self._num_poisson_events_per_sample \
-                or self._num_poisson_events_per_sample < 0:
-            spike_snapshot = np.random.random_sample(x_b_l.shape) \
-                             * self.rescale_fac * np.max(x_b_l)
-            input_b_l = (spike_snapshot <= np.abs(x_b_l)).astype('float32')
-            self._input_spikecount += \
-                int(np.count_nonzero(input_b_l) / self.batch_size)
-            # For BinaryNets, with input that is not normalized and
-            # not all positive, we stimulate with spikes of the same
-            # size as the maximum activation, and the same sign as
-            # the corresponding activation. Is there a better
-            # solution?
-            input_b_l *= np.max(x_b_l) * np.sign(x_b_l)
-        else:  # No more input spikes if _input_spikecount exceeded limit.
-            input_b_l = np.zeros(x_b_l.shape)
-
-        return input_b_l
+        import tensorflow as tf
+
+        spiking_layers = [layer for layer in self.snn.layers
+                          if hasattr(layer, 'eager_updates')]
+        spiketrain_layers = [layer for layer in self.snn.layers
+                             if getattr(layer, 'spiketrain', None) is not None]
+        mem_layers = [] if self.mem_n_b_l_t is None else \
+            [layer for layer in self.snn.layers if hasattr(layer, 'mem')]
+        if self._record_on_device:
+            # The layers write into their own recording buffers.
+            spiketrain_layers = mem_layers = []
+        dt = self._dt
+        floatx = keras.backend.floatx()
+
+        def run_steps(input_t_b_l, t_start, num_steps):
+            num_frames = tf.shape(input_t_b_l)[0]
+            outputs = tf.TensorArray(floatx, num_steps)
+            spiketrains = [tf.TensorArray(floatx, num_steps)
+                           for _ in spiketrain_layers]
+            mems = [tf.TensorArray(floatx, num_steps) for _ in mem_layers]
+            for i in tf.range(num_steps):
+                t = t_start + tf.cast(i, floatx) * dt
+                for layer in spiking_layers:
+                    layer.time.assign(t)
+                out_spikes = self.snn(input_t_b_l[i % num_frames])
+                outputs = outputs.write(i, out_spikes)
+                spiketrains = [s.write(i, tf.identity(layer.spiketrain)) for
+                               s, layer in zip(spiketrains, spiketrain_layers)]
+                mems = [m.write(i, tf.identity(layer.mem))
+                        for m, layer in zip(mems, mem_layers)]
+            return (outputs.stack(), [s.stack() for s in spiketrains],
+                    [m.stack() for m in mems])
+
+        @tf.function
+        def fused_fn(input_t_b_l, t_start, num_steps):
+            for layer in spiking_layers:
+                layer.eager_updates = True
+            try:
+                return run_steps(input_t_b_l, t_start, num_steps)
+            finally:
+                for layer in spiking_layers:
+                    layer.eager_updates = False
+
+        return fused_fn
 
     def set_time(self, t):
         """Set the simulation time variable of all layers in the network.
@@ -52,8 +52,8 @@ class SNN(SNN_):
             self.set_time(sim_step)
 
             # Generate new input in case it changes with each simulation step.
-            if self._poisson_input:
-                input_b_l = self.get_poisson_frame_batch(kwargs[str('x_b_l')])
+            if self._spiking_input:
+                input_b_l = self.get_input_frame_batch(kwargs[str('x_b_l')])
             elif self._dataset_format == 'aedat':
                 input_b_l = kwargs[str('dvs_gen')].next_eventframe_batch()
 
@@ -94,7 +94,7 @@ class SNN(SNN_):
 
             if 'input_b_l_t' in self._log_keys:
                 self.input_b_l_t[Ellipsis, sim_step_int] = input_b_l
-            if self._poisson_input or self._dataset_format == 'aedat':
+            if self._spiking_input or self._dataset_format == 'aedat':
                 if self.synaptic_operations_b_t is not None:
                     self.synaptic_operations_b_t[:, sim_step_int] += \
                         get_layer_synaptic_operations(input_b_l,
@@ -1204,7 +1204,7 @@ class SNN(AbstractSNN):
             self.megadirname))
 
     def simulate(self, **kwargs):
-        if self._poisson_input:
+        if self._spiking_input:
             np.random.seed(1)
             timestamp_batches = self.poisson_spike_generator_batchmode_megasim(
                 kwargs['x_b_l'])
@@ -1485,36 +1485,54 @@ class SNN(AbstractSNN):
         megasim sim folder.
         """
 
-        spikes = []
-        for t in np.arange(0, self._duration, self._dt):
-            # Create poisson input.
-            spike_snapshot = np.random.random_sample(mnist_digit.shape) * \
-                             self.rescale_fac
-            inp = (spike_snapshot <= mnist_digit).astype('float32')
-            # find the indexes of the non-zero
-            neuron_id = list(np.nonzero(inp))
-            # check if input is flattened or 2d in order to extract the X,Y
-            # addresses correctly
-            if len(inp.shape) == 1:
-                megasim_x = neuron_id[0]
-                megasim_y = 0
-            else:
-                megasim_x = neuron_id[2]
-                megasim_y = neuron_id[1]
-
-            spike_for_t = np.zeros((len(megasim_x), 6), dtype="int")
-            spike_for_t[:, 0] = t  # time-stamps
-            spike_for_t[:, 1] = -1  # REQ
-            spike_for_t[:, 2] = -1  # ACK
-            spike_for_t[:, 3] = megasim_x  # X address
-            spike_for_t[:, 4] = megasim_y  # Y address
-            spike_for_t[:, 5] = 1  # polarity
-            spikes.append(spike_for_t)
-
-        spikes = np.vstack(spikes)
+        spikes = self.get_poisson_events(mnist_digit, 0)
         np.savetxt(self.megadirname + self.layers[0].label + ".stim", spikes,
                    delimiter=" ", fmt="%d")
 
+    def get_poisson_events(self, digit, sample_idx):
+        """Generate the Poisson input events of a sample for all time steps.
+
+        The spikes of all time steps are drawn in one vectorized call with
+        `snntoolbox.simulation.utils.get_uniform_frames`.
+
+        Parameters
+        ----------
+
+        digit: ndarray
+            A 1d or 3d numpy array of a sample (normalised 0-1).
+        sample_idx: int
+            Index of the sample in the test set.
+
+        Returns
+        -------
+
+        spikes: ndarray
+            MegaSim events (time-stamp, REQ, ACK, X, Y, polarity), one row per
+            spike.
+        """
+
+        from snntoolbox.simulation.utils import get_uniform_frames
+
+        ts = np.arange(0, self._duration, self._dt)
+        u_t_l = get_uniform_frames(digit.shape, len(ts), self._poisson_seed,
+                                   sample_idx)
+        # find the indexes of the non-zero
+        neuron_id = np.nonzero(u_t_l * self.rescale_fac <= digit)
+        spikes = np.zeros((len(neuron_id[0]), 6), dtype="int")
+        spikes[:, 0] = ts[neuron_id[0]]  # time-stamps
+        spikes[:, 1] = -1  # REQ
+        spikes[:, 2] = -1  # ACK
+        # check if input is flattened or 2d in order to extract the X,Y
+        # addresses correctly
+        if digit.ndim == 1:
+            spikes[:, 3] = neuron_id[1]  # X address
+            spikes[:, 4] = 0  # Y address
+        else:
+            spikes[:, 3] = neuron_id[3]  # X address
+            spikes[:, 4] = neuron_id[2]  # Y address
+        spikes[:, 5] = 1  # polarity
+        return spikes
+
     def poisson_spike_generator_batchmode_megasim(self, mnist_digits):
         """
 
@@ -1539,39 +1557,21 @@ class SNN(AbstractSNN):
 
         last_ts = 0
 
+        input_rate = self.config.getint('input', 'input_rate')
+        ts = np.arange(0, self._duration, self._dt)
+        t_max = int(ts[-1])
         for i, digit in enumerate(mnist_digits):
-            for t in np.arange(0, self._duration, self._dt):
-                # Create poisson input.
-                spike_snapshot = np.random.random_sample(digit.shape) * \
-                                 self.rescale_fac
-                inp = (spike_snapshot <= digit).astype('float32')
-                # find the indexes of the non-zero
-                neuron_id = list(np.nonzero(inp))
-                # check if input is flattened or 2d in order to extract the X,Y
-                # addresses correctly
-                if len(inp.shape) == 1:
-                    megasim_x = neuron_id[0]
-                    megasim_y = 0
-                else:
-                    megasim_x = neuron_id[2]
-                    megasim_y = neuron_id[1]
-
-                spike_for_t = np.zeros((len(megasim_x), 6), dtype="int")
-                spike_for_t[:, 0] = t + last_ts  # time-stamps
-                spike_for_t[:, 1] = -1  # REQ
-                spike_for_t[:, 2] = -1  # ACK
-                spike_for_t[:, 3] = megasim_x  # X address
-                spike_for_t[:, 4] = megasim_y  # Y address
-                spike_for_t[:, 5] = 1  # polarity
-                spikes.append(spike_for_t)
-
-                # softmax control events
-                rnd = np.random.uniform(
-                    0, self.config.getint('input', 'input_rate'))
-                if rnd < 300:
-                    softmax_in_events.append([t + last_ts, -1, -1, 0, -1, -1])
-            timestamps.append([last_ts, spike_for_t[-1][0]])
-            last_ts = spike_for_t[-1][0] + 1  # (self._duration*(i+1)) + 1
+            spikes_for_digit = self.get_poisson_events(
+                digit, self._sample_idxs_b[i])
+            spikes_for_digit[:, 0] += last_ts
+            spikes.append(spikes_for_digit)
+
+            # softmax control events
+            rnd = np.random.uniform(0, input_rate, len(ts))
+            for t in ts[rnd < 300]:
+                softmax_in_events.append([t + last_ts, -1, -1, 0, -1, -1])
+            timestamps.append([last_ts, t_max + last_ts])
+            last_ts += t_max + 1  # (self._duration*(i+1)) + 1
             # reset control events
             reset_events.append([last_ts, -1, -1, 0, -2, -2])
             last_ts += 1
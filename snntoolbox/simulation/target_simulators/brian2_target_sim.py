@@ -28,11 +28,15 @@ class SNN(AbstractSNN):
 
     layers: list[brian2.NeuronGroup]
         Each entry represents a layer, i.e. a population of neurons, in form of
-        Brian2 ``NeuronGroup`` objects.
+        Brian2 ``NeuronGroup`` objects. To simulate a batch of samples at
+        once, the network is replicated `batch_size` times: A layer of ``n``
+        neurons is a group of ``batch_size * n`` neurons, where the neurons of
+        sample ``b`` have indices ``b * n`` to ``(b + 1) * n - 1``.
 
     connections: list[brian2.Synapses]
         Brian2 ``Synapses`` objects representing the connections between
-        individual layers.
+        individual layers. Connections are block-diagonal, i.e. they do not
+        cross between the replicas of different samples.
 
     threshold: str
         Defines spiking threshold.
@@ -43,6 +47,16 @@ class SNN(AbstractSNN):
     eqs: str
         Differential equation for membrane potential.
 
+    on_pre_maxpool: str
+        Synaptic update of max pooling layers. Each synapse counts the spikes
+        of its presynaptic neuron. The pooling neuron stores the index of the
+        presynaptic neuron with the highest spike count (``winner``), and
+        only the synapse of this neuron transmits. Thus the pooling neuron
+        passes on the spikes of the most active neuron in its pool
+        (``maxpool_type = fir_max``). A neuron has to exceed the count of the
+        current winner to take over, so of several neurons with equal counts
+        only one transmits.
+
     spikemonitors: list[brian2.SpikeMonitor]
         Brian2 ``SpikeMonitor`` s for each layer that records spikes.
 
@@ -52,6 +66,11 @@ class SNN(AbstractSNN):
 
     snn: brian2.Network
         The spiking network.
+
+    standalone_dir: Optional[str]
+        If ``brian2_standalone`` is enabled, the directory of the C++ project
+        of the network. Set when the project is built (see
+        `build_standalone`).
     """
 
     def __init__(self, config, queue=None):
@@ -67,28 +86,47 @@ class SNN(AbstractSNN):
             self.v_reset = 'v = v_reset'
         self.eqs = '''dv/dt = bias : 1
                       bias : hertz'''
+        self.on_pre_maxpool = '''spikecount += 1
+                                 leads = int(spikecount > maxcount)
+                                 winner = leads * i + (1 - leads) * winner
+                                 maxcount += leads
+                                 v += w * int(i == winner)'''
         self.spikemonitors = []
         self.statemonitors = []
         self.snn = None
         self._input_layer = None
         self._cell_params = None
+        self._standalone = config.getboolean('simulation', 'brian2_standalone')
+        self.standalone_dir = None
+
+        if self._standalone:
+            # Start from a fresh device, in case another network was built
+            # in this session. The project is built explicitly in
+            # `build_standalone`, once the cell parameters are known. The
+            # previous device is restored in `end_sim`.
+            self.sim.device.reinit()
+            self.sim.set_device('cpp_standalone', build_on_run=False)
 
         # Track the output layer spikes.
         self.output_spikemonitor = None
 
     @property
     def is_parallelizable(self):
-        return False
+        return True
 
     def add_input_layer(self, input_shape):
 
-        if self._poisson_input:
+        if self._spiking_input and self.input_encoder.name != 'poisson':
+            raise NotImplementedError("Input encoding {} not supported by "
+                                      "brian2 simulator.".format(
+                                          self.input_encoder.name))
+        num_neurons = self.batch_size * np.prod(input_shape[1:])
+        if self._spiking_input:
             self.layers.append(self.sim.PoissonGroup(
-                np.prod(input_shape[1:]), rates=0*self.sim.Hz,
-                dt=self._dt*self.sim.ms))
+                num_neurons, rates=0*self.sim.Hz, dt=self._dt*self.sim.ms))
         else:
             self.layers.append(self.sim.NeuronGroup(
-                np.prod(input_shape[1:]), model=self.eqs, method='euler',
+                num_neurons, model=self.eqs, method='euler',
                 reset=self.v_reset, threshold=self.threshold,
                 dt=self._dt * self.sim.ms))
         self.layers[0].add_attribute('label')
@@ -107,13 +145,27 @@ class SNN(AbstractSNN):
                 (layer.name, get_shape_from_label(self.layers[-1].label)))
             return
 
-        self.layers.append(self.sim.NeuronGroup(
-            np.prod(layer.output_shape[1:]), model=self.eqs, method='euler',
-            reset=self.v_reset, threshold=self.threshold,
-            dt=self._dt * self.sim.ms))
-        self.connections.append(self.sim.Synapses(
-            self.layers[-2], self.layers[-1], 'w:1', on_pre='v+=w',
-            dt=self._dt * self.sim.ms))
+        num_neurons = self.batch_size * np.prod(layer.output_shape[1:])
+        if self.is_gated_maxpool(layer):
+            self.layers.append(self.sim.NeuronGroup(
+                num_neurons, model=self.eqs + '''
+                                              maxcount : 1
+                                              winner : integer''',
+                method='euler', reset=self.v_reset, threshold=self.threshold,
+                dt=self._dt * self.sim.ms))
+            self.layers[-1].winner = -1
+            self.connections.append(self.sim.Synapses(
+                self.layers[-2], self.layers[-1], '''w : 1
+                                                     spikecount : 1''',
+                on_pre=self.on_pre_maxpool, dt=self._dt * self.sim.ms))
+        else:
+            self.layers.append(self.sim.NeuronGroup(
+                num_neurons, model=self.eqs, method='euler',
+                reset=self.v_reset, threshold=self.threshold,
+                dt=self._dt * self.sim.ms))
+            self.connections.append(self.sim.Synapses(
+                self.layers[-2], self.layers[-1], 'w:1', on_pre='v+=w',
+                dt=self._dt * self.sim.ms))
         self.layers[-1].add_attribute('label')
         self.layers[-1].label = layer.name
         if 'spiketrains' in self._plot_keys \
@@ -124,53 +176,32 @@ class SNN(AbstractSNN):
                                                             'v', True))
 
     def build_dense(self, layer, weights=None):
+        from snntoolbox.simulation.utils import build_dense, \
+            get_flatten_permutation
 
         if layer.activation == 'softmax':
             raise warnings.warn("Activation 'softmax' not implemented. Using "
                                 "'relu' activation instead.", RuntimeWarning)
 
         _weights, biases = layer.get_weights()
-        if weights is None:
-            weights = _weights
 
         self.set_biases(biases)
 
         delay = self.config.getfloat('cell', 'delay')
-        connections = []
+        permutation = None
 
         if len(self.flatten_shapes) == 1:
             print("Swapping data_format of Flatten layer.")
             flatten_name, shape = self.flatten_shapes.pop()
-            if self.data_format == 'channels_last':
-                y_in, x_in, f_in = shape
-            else:
-                f_in, y_in, x_in = shape
-            for i in range(weights.shape[0]):  # Input neurons
-                # Sweep across channel axis of feature map. Assumes that each
-                # consecutive input neuron lies in a different channel. This is
-                # the case for channels_last, but not for channels_first.
-                f = i % f_in
-                # Sweep across height of feature map. Increase y by one if all
-                # rows along the channel axis were seen.
-                y = i // (f_in * x_in)
-                # Sweep across width of feature map.
-                x = (i // f_in) % x_in
-                new_i = f * x_in * y_in + x_in * y + x
-                for j in range(weights.shape[1]):  # Output neurons
-                    connections.append((new_i, j, weights[i, j], delay))
+            permutation = get_flatten_permutation(shape, self.data_format)
         elif len(self.flatten_shapes) > 1:
             raise RuntimeWarning("Not all Flatten layers have been consumed.")
-        else:
-            for i in range(weights.shape[0]):
-                for j in range(weights.shape[1]):
-                    connections.append((i, j, weights[i, j], delay))
 
-        connections = np.array(connections)
+        connections = build_dense(_weights, delay, permutation)
+        if weights is not None:
+            connections['weight'] = weights.flatten()
 
-        self.connections[-1].connect(i=connections[:, 0].astype('int64'),
-                                     j=connections[:, 1].astype('int64'))
-
-        self.connections[-1].w = connections[:, 2]
+        self.connect(connections)
 
     def build_convolution(self, layer, weights=None):
         from snntoolbox.simulation.utils import build_convolution
@@ -178,30 +209,66 @@ class SNN(AbstractSNN):
         delay = self.config.getfloat('cell', 'delay')
         transpose_kernel = \
             self.config.get('simulation', 'keras_backend') == 'tensorflow'
-        conns, biases = build_convolution(layer, delay, transpose_kernel)
-        connections = np.array(conns)
+        connections, biases = build_convolution(layer, delay,
+                                                transpose_kernel)
 
         self.set_biases(biases)
 
-        print("Connecting layer...")
+        if weights is not None:
+            connections['weight'] = weights.flatten()
 
-        self.connections[-1].connect(i=connections[:, 0].astype('int64'),
-                                     j=connections[:, 1].astype('int64'))
+        print("Connecting layer...")
 
-        w = connections[:, 2] if weights is None else weights.flatten()
-        self.connections[-1].w = w
+        self.connect(connections)
 
     def build_pooling(self, layer, weights=None):
         from snntoolbox.simulation.utils import build_pooling
 
         delay = self.config.getfloat('cell', 'delay')
-        connections = np.array(build_pooling(layer, delay))
-
-        self.connections[-1].connect(i=connections[:, 0].astype('int64'),
-                                     j=connections[:, 1].astype('int64'))
-
-        w = connections[:, 2] if weights is None else weights.flatten()
-        self.connections[-1].w = w
+        connections = build_pooling(layer, delay,
+                                    not self.is_gated_maxpool(layer))
+        if weights is not None:
+            connections['weight'] = weights.flatten()
+
+        self.connect(connections)
+
+    def connect(self, connections):
+        """Connect the last two layers.
+
+        The connections of a single sample are replicated for each sample of
+        the batch (see
+        :py:func:`~snntoolbox.simulation.utils.replicate_connections`).
+
+        Parameters
+        ----------
+
+        connections: ndarray
+            Structured array of dtype
+            :py:data:`~snntoolbox.simulation.utils.connection_dtype`.
+        """
+
+        from snntoolbox.simulation.utils import replicate_connections
+
+        connections = replicate_connections(
+            connections, len(self.layers[-2]) // self.batch_size,
+            len(self.layers[-1]) // self.batch_size, self.batch_size)
+        self.connections[-1].connect(i=connections['source'],
+                                     j=connections['target'])
+        self.connections[-1].w = connections['weight']
+
+    def is_gated_maxpool(self, layer):
+        """Whether ``layer`` is a max pooling layer that is implemented by
+        gating the synapses with the spike count of the presynaptic neurons.
+        Other variants of ``maxpool_type`` fall back on average pooling."""
+
+        is_maxpool = layer.__class__.__name__ == 'MaxPooling2D'
+        maxpool_type = self.config.get('conversion', 'maxpool_type')
+        if is_maxpool and maxpool_type != 'fir_max':
+            warnings.warn("Max pooling type {} not supported by brian2 "
+                          "simulator. Falling back on 'AveragePooling'."
+                          "".format(maxpool_type), RuntimeWarning)
+            return False
+        return is_maxpool
 
     def compile(self):
 
@@ -209,7 +276,8 @@ class SNN(AbstractSNN):
         spikemonitors = self.spikemonitors + [self.output_spikemonitor]
         self.snn = self.sim.Network(self.layers, self.connections,
                                     spikemonitors, self.statemonitors)
-        self.snn.store()
+        if not self._standalone:
+            self.snn.store()
 
         # Set input layer
         for obj in self.snn.objects:
@@ -217,19 +285,70 @@ class SNN(AbstractSNN):
                 self._input_layer = obj
         assert self._input_layer, "No input layer found."
 
+    def get_standalone_dir(self):
+        """Return the directory of the C++ project of the network.
+
+        The name of the directory is a hash of the parsed model (architecture
+        and weights) and of the settings that determine the generated code.
+        Projects built in earlier sessions are thus reused, and only the
+        input changes from one run to the next.
+        """
+
+        import hashlib
+        import json
+
+        sha1 = hashlib.sha1(self.parsed_model.to_json().encode())
+        for weights in self.parsed_model.get_weights():
+            sha1.update(np.ascontiguousarray(weights).tobytes())
+        settings = {section: dict(self.config.items(section))
+                    for section in ['cell', 'conversion']}
+        settings['simulation'] = [self.batch_size, self._duration, self._dt]
+        settings['input'] = [self._spiking_input, self.input_encoder.name]
+        sha1.update(json.dumps(settings, sort_keys=True).encode())
+        return os.path.join(self.config.get('paths', 'path_wd'),
+                            'brian2_standalone', sha1.hexdigest()[:16])
+
+    def build_standalone(self):
+        """Generate and compile the C++ project of the network.
+
+        The network is run once symbolically to record the simulation in the
+        project. The generated sources are only rewritten where they change,
+        so compiling a cached project is a no-op.
+        """
+
+        self.standalone_dir = self.get_standalone_dir()
+        print("Building C++ standalone project in {}...".format(
+            self.standalone_dir))
+        self.snn.run(self._duration * self.sim.ms, namespace=self._cell_params,
+                     report='stdout', report_period=10 * self.sim.ms)
+        self.sim.device.build(directory=self.standalone_dir, compile=True,
+                              run=False)
+
     def simulate(self, **kwargs):
 
         inputs = kwargs[str('x_b_l')].flatten() / self.sim.ms
-        if self._poisson_input:
-            self._input_layer.rates = inputs / self.rescale_fac
+        if self._spiking_input:
+            input_variable = 'rates'
+            inputs = inputs / self.rescale_fac
         elif self._dataset_format == 'aedat':
             # TODO: Implement by using brian2.SpikeGeneratorGroup.
             raise NotImplementedError
         else:
-            self._input_layer.bias = inputs
-
-        self.snn.run(self._duration * self.sim.ms, namespace=self._cell_params,
-                     report='stdout', report_period=10 * self.sim.ms)
+            input_variable = 'bias'
+
+        if self._standalone:
+            if self.standalone_dir is None:
+                self.build_standalone()
+            # Each run of the compiled binary starts from the initial state,
+            # with the input passed as run argument.
+            input_layer_variable = getattr(self._input_layer, input_variable)
+            self.sim.device.run(
+                run_args={input_layer_variable: inputs})
+        else:
+            setattr(self._input_layer, input_variable, inputs)
+            self.snn.run(self._duration * self.sim.ms,
+                         namespace=self._cell_params, report='stdout',
+                         report_period=10 * self.sim.ms)
 
         output_b_l_t = self.get_recorded_vars(self.layers)
 
@@ -238,38 +357,60 @@ class SNN(AbstractSNN):
     def reset(self, sample_idx):
         mod = self.config.getint('simulation', 'reset_between_nth_sample')
         mod = mod if mod else sample_idx + 1
-        if sample_idx % mod == 0:
+        if sample_idx % mod == 0 and not self._standalone:
             print("Resetting simulator...")
             self.snn.restore()
 
     def end_sim(self):
 
-        pass
+        if self._standalone:
+            from brian2.devices.device import reset_device
+            self.sim.device.reinit()
+            reset_device()
 
     def save(self, path, filename):
         from snntoolbox.utils.utils import confirm_overwrite
+        from snntoolbox.simulation.utils import connection_dtype, \
+            save_connections, save_connectivity_manifest
+
+        dirpath = os.path.join(path, self.config.get('paths', 'filename_snn'),
+                               'brian2-model')
+        filepath = os.path.join(dirpath, 'manifest.json')
+        if not (self.config.getboolean('output', 'overwrite') or
+                confirm_overwrite(filepath)):
+            return
 
-        print("Saving weights ...")
+        print("Saving connections to {}...".format(dirpath))
+        projections = []
         for i, connection in enumerate(self.connections):
-            filepath = os.path.join(path,
-                                    self.config.get('paths', 'filename_snn'),
-                                    'brian2-model',
-                                    self.layers[i + 1].label + '.npz')
-            if self.config.getboolean('output', 'overwrite') \
-                    or confirm_overwrite(filepath):
-                directory = os.path.dirname(filepath)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-                print("Store weights of layer {} to file {}".format(
-                    self.layers[i + 1].label, filepath))
-                np.savez(filepath, self.connections[i].w)
+            label = self.layers[i + 1].label
+            # Only save the replica of the first sample in the batch, so that
+            # the model can be loaded with any batch size.
+            is_first = connection.i[:] < len(self.layers[i]) // self.batch_size
+            connections = np.empty(np.count_nonzero(is_first),
+                                   connection_dtype)
+            connections['source'] = connection.i[:][is_first]
+            connections['target'] = connection.j[:][is_first]
+            connections['weight'] = connection.w[:][is_first]
+            connections['delay'] = \
+                connection.delay[:][is_first] / self.sim.ms
+            num_connections = save_connections(dirpath, label, connections)
+            num_neurons = len(self.layers[i + 1]) // self.batch_size
+            np.save(os.path.join(dirpath, label, 'bias.npy'), np.asarray(
+                self.layers[i + 1].bias[:num_neurons] * self.sim.ms))
+            projections.append({'label': label,
+                                'pre': self.layers[i].label,
+                                'num_connections': num_connections})
+        save_connectivity_manifest(dirpath, projections)
 
     def load(self, path, filename):
         import keras
         from snntoolbox.parsing.utils import get_type
-        from snntoolbox.simulation.utils import get_ann_ops
+        from snntoolbox.simulation.utils import get_ann_ops, \
+            connection_dtype, load_connections, load_connectivity_manifest
 
         dirpath = os.path.join(path, filename, 'brian2-model')
+        projections = load_connectivity_manifest(dirpath)
         npz_files = [f for f in sorted(os.listdir(dirpath))
                      if os.path.isfile(os.path.join(dirpath, f))]
         print("Loading spiking model...")
@@ -290,7 +431,26 @@ class SNN(AbstractSNN):
 
         self.add_input_layer(batch_shape)
 
+        if projections is not None:
+            # Restore the stored connectivity without rebuilding it.
+            labels = [p['label'] for p in projections]
+            for layer in self.parsed_model.layers[1:]:
+                print("Building layer: {}".format(layer.name))
+                self.add_layer(layer)
+                if layer.name not in labels:
+                    continue
+                columns = load_connections(dirpath, layer.name)
+                connections = np.empty(len(columns['source']),
+                                       connection_dtype)
+                for name in connection_dtype.names:
+                    connections[name] = columns[name]
+                self.connect(connections)
+                self.set_biases(np.load(os.path.join(dirpath, layer.name,
+                                                     'bias.npy')))
+            npz_files = []
+
         # Iterate over layers to create spiking neurons and connections.
+        # Used for models that were saved as weights only by older versions.
         for layer, f in zip(self.parsed_model.layers[1:], npz_files):
             print("Building layer: {}".format(layer.name))
             self.add_layer(layer)
@@ -346,29 +506,31 @@ class SNN(AbstractSNN):
         # by `get_spiketrains_input()`.
         i = len(self.spikemonitors) - 1 if kwargs[str('monitor_index')] == -1 \
             else kwargs[str('monitor_index')] + 1
-        spiketrain_dict = self.spikemonitors[i].spike_trains()
-        spiketrains_flat = np.array([spiketrain_dict[key] / self.sim.ms for key
-                                     in spiketrain_dict.keys()])
-        spiketrains_b_l_t = \
-            self.reshape_flattened_spiketrains(spiketrains_flat, shape)
+        spiketrains_b_l_t = self.get_spiketrains_from_monitor(
+            self.spikemonitors[i], shape, self._sparse_spiketrains)
         return spiketrains_b_l_t
 
+    def get_spiketrains_from_monitor(self, spikemonitor, shape,
+                                     sparse=False):
+        """Convert the spikes recorded by a ``SpikeMonitor`` to an array of
+        the given ``shape``, using the flat index and time arrays of the
+        monitor. If ``sparse``, return `SparseSpiketrains` instead."""
+
+        return self.reshape_flattened_spiketrains(
+            np.asarray(spikemonitor.t[:] / self.sim.ms), shape,
+            neuron_idxs=np.asarray(spikemonitor.i[:]), sparse=sparse)
+
     def get_spiketrains_input(self):
-        shape = list(self.parsed_model.input_shape) + [self._num_timesteps]
-        spiketrain_dict = self.spikemonitors[0].spike_trains()
-        spiketrains_flat = np.array([spiketrain_dict[key] / self.sim.ms for key
-                                     in spiketrain_dict.keys()])
-        spiketrains_b_l_t = \
-            self.reshape_flattened_spiketrains(spiketrains_flat, shape)
+        shape = [self.batch_size] + list(self.parsed_model.input_shape[1:]) + \
+            [self._num_timesteps]
+        spiketrains_b_l_t = self.get_spiketrains_from_monitor(
+            self.spikemonitors[0], shape)
         return spiketrains_b_l_t
 
     def get_spiketrains_output(self):
         shape = [self.batch_size, self.num_classes, self._num_timesteps]
-        spiketrain_dict = self.output_spikemonitor.spike_trains()
-        spiketrains_flat = np.array([spiketrain_dict[key] / self.sim.ms for key
-                                     in spiketrain_dict.keys()])
-        spiketrains_b_l_t = \
-            self.reshape_flattened_spiketrains(spiketrains_flat, shape)
+        spiketrains_b_l_t = self.get_spiketrains_from_monitor(
+            self.output_spikemonitor, shape)
         return spiketrains_b_l_t
 
     def get_vmem(self, **kwargs):
@@ -385,8 +547,9 @@ class SNN(AbstractSNN):
         AbstractSNN.set_spiketrain_stats_input(self)
 
     def set_biases(self, biases):
-        """Set biases."""
+        """Set biases of a single sample, and replicate them for the batch."""
         if any(biases):
+            biases = np.tile(biases, self.batch_size)
             assert self.layers[-1].bias.shape == biases.shape, \
                 "Shape of biases and network do not match."
             self.layers[-1].bias = biases / self.sim.ms
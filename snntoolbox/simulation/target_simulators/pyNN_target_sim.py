@@ -38,11 +38,19 @@ class SNN(AbstractSNN):
 
     connections: list[pyNN.Projection]
         pyNN ``Projection`` objects representing the connections between
-        individual layers.
+        individual layers. Empty if the network is only converted and not
+        simulated (``[tools] simulate = False``); the connections are then
+        written to disk while building the network (see `add_projection`).
 
     cellparams: dict
         Neuron cell parameters determining properties of the spiking neurons in
         pyNN simulators.
+
+    maxpool_gates: list[pyNN.Population]
+        Gate neurons of the max pooling layers (see `connect_maxpool`).
+
+    maxpool_projections: list[pyNN.Projection]
+        Projections to, between and from the gate neurons.
     """
 
     def __init__(self, config, queue=None):
@@ -51,6 +59,11 @@ class SNN(AbstractSNN):
 
         self.layers = []
         self.connections = []
+        self._streamed_projections = []
+        self._stream_connections = None
+        self.maxpool_gates = []
+        self.maxpool_projections = []
+        self._maxpool_connections = {}
         self.cellparams = {key: config.getfloat('cell', key) for key in
                            config_string_to_set_of_strings(config.get(
                                'restrictions', 'cellparams_pyNN'))}
@@ -65,10 +78,11 @@ class SNN(AbstractSNN):
 
     def add_input_layer(self, input_shape):
 
-        celltype = self.sim.SpikeSourcePoisson() if self._poisson_input \
+        celltype = self.sim.SpikeSourcePoisson() \
+            if self.input_encoder.name == 'poisson' \
             else self.sim.SpikeSourceArray()
         self.layers.append(self.sim.Population(
-            np.prod(input_shape[1:], dtype=np.int).item(), celltype,
+            np.prod(input_shape[1:], dtype=int).item(), celltype,
             label='InputLayer'))
 
     def add_layer(self, layer):
@@ -81,7 +95,7 @@ class SNN(AbstractSNN):
             return
 
         self.layers.append(self.sim.Population(
-            np.prod(layer.output_shape[1:], dtype=np.int).item(),
+            np.prod(layer.output_shape[1:], dtype=int).item(),
             self.sim.IF_curr_exp, self.cellparams, label=layer.name))
 
         self.layers[-1].initialize(v=self.layers[-1].get('v_rest'))
@@ -98,6 +112,9 @@ class SNN(AbstractSNN):
 
         """
 
+        from snntoolbox.simulation.utils import get_flatten_permutation, \
+            iter_dense_connections
+
         if layer.activation.__name__ == 'softmax':
             warnings.warn("Activation 'softmax' not implemented. Using 'relu' "
                           "activation instead.", RuntimeWarning)
@@ -106,63 +123,154 @@ class SNN(AbstractSNN):
 
         self.set_biases(np.array(biases, 'float64'))
         delay = self.config.getfloat('cell', 'delay')
-        connections = []
         if len(self.flatten_shapes) == 1:
             print("Swapping data_format of Flatten layer.")
             flatten_name, shape = self.flatten_shapes.pop()
-            if self.data_format == 'channels_last':
-                y_in, x_in, f_in = shape
-            else:
-                f_in, y_in, x_in = shape
-            for i in range(weights.shape[0]):  # Input neurons
-                # Sweep across channel axis of feature map. Assumes that each
-                # consecutive input neuron lies in a different channel. This is
-                # the case for channels_last, but not for channels_first.
-                f = i % f_in
-                # Sweep across height of feature map. Increase y by one if all
-                # rows along the channel axis were seen.
-                y = i // (f_in * x_in)
-                # Sweep across width of feature map.
-                x = (i // f_in) % x_in
-                new_i = f * x_in * y_in + x_in * y + x
-                for j in range(weights.shape[1]):  # Output neurons
-                    connections.append((new_i, j, weights[i, j], delay))
+            permutation = get_flatten_permutation(shape, self.data_format)
+            weights_permuted = np.empty_like(weights)
+            weights_permuted[permutation] = weights
+            weights = weights_permuted
         elif len(self.flatten_shapes) > 1:
             raise RuntimeWarning("Not all Flatten layers have been consumed.")
-        else:
-            for i in range(weights.shape[0]):
-                for j in range(weights.shape[1]):
-                    connections.append((i, j, weights[i, j], delay))
 
         if self.config.getboolean('tools', 'simulate'):
+            # Pass the weight matrix directly instead of a list of
+            # connections.
             self.connections.append(self.sim.Projection(
-                self.layers[-2], self.layers[-1],
-                self.sim.FromListConnector(connections, ['weight', 'delay'])))
+                self.layers[-2], self.layers[-1], self.sim.AllToAllConnector(),
+                self.sim.StaticSynapse(weight=np.array(weights, 'float64'),
+                                       delay=delay)))
+        else:
+            self.add_projection(iter_dense_connections(weights, delay))
 
     def build_convolution(self, layer):
-        from snntoolbox.simulation.utils import build_convolution
+        from snntoolbox.simulation.utils import iter_convolution_connections
 
         delay = self.config.getfloat('cell', 'delay')
         transpose_kernel = \
             self.config.get('simulation', 'keras_backend') == 'tensorflow'
-        connections, biases = build_convolution(layer, delay, transpose_kernel)
 
-        self.set_biases(biases)
+        biases = layer.get_weights()[1]
+        n = int(np.prod(layer.output_shape[1:]) / len(biases))
+        self.set_biases(np.repeat(biases, n).astype('float64'))
 
-        if self.config.getboolean('tools', 'simulate'):
-            self.connections.append(self.sim.Projection(
-                self.layers[-2], self.layers[-1],
-                self.sim.FromListConnector(connections, ['weight', 'delay'])))
+        self.add_projection(iter_convolution_connections(layer, delay,
+                                                         transpose_kernel))
+        print('')
 
     def build_pooling(self, layer):
         from snntoolbox.simulation.utils import build_pooling
 
         delay = self.config.getfloat('cell', 'delay')
         connections = build_pooling(layer, delay)
+        if layer.__class__.__name__ != 'MaxPooling2D':
+            self.add_projection([connections])
+        elif self.config.getboolean('tools', 'simulate'):
+            self.connect_maxpool(connections, self.layers[-2],
+                                 self.layers[-1])
+        else:
+            self.add_projection([connections], maxpool=True)
+
+    def connect_maxpool(self, connections, pre, post):
+        """Connect a max pooling layer through a population of gate neurons.
+
+        See :py:func:`~snntoolbox.simulation.utils.build_maxpool_gates`. The
+        gates relay the spikes of the most active neuron in each pool, so the
+        pooling neurons approximate the maximum firing rate of their pools.
+        Neurons that spike in the same time step all pass their spikes,
+        because the inhibition between the gates arrives with a synaptic
+        delay.
+
+        The weights of the gates are chosen such that a spike changes the
+        membrane potential of a gate by 1.5 times the distance between reset
+        and threshold. For a current-based synapse with weight ``w``, this
+        change is about ``w * tau_syn / cm``, if ``tau_m`` is much larger than
+        ``tau_syn``.
+
+        Parameters
+        ----------
+
+        connections: ndarray
+            Connections of the max pooling layer, as returned by
+            :py:func:`~snntoolbox.simulation.utils.build_pooling`.
+        pre: pyNN.Population
+            Input layer of the pooling layer.
+        post: pyNN.Population
+            Pooling layer.
+        """
+
+        from snntoolbox.simulation.utils import build_maxpool_gates, \
+            get_connection_list
+
+        charge = 1.5 * (self.config.getfloat('cell', 'v_thresh') -
+                        self.config.getfloat('cell', 'v_reset')) * \
+            self.config.getfloat('cell', 'cm')
+        relay_weight = charge / self.config.getfloat('cell', 'tau_syn_E')
+        inhibition_weight = -charge / self.config.getfloat('cell', 'tau_syn_I')
+        input_connections, lateral_connections, output_connections = \
+            build_maxpool_gates(connections, relay_weight, inhibition_weight)
+
+        gates = self.sim.Population(len(connections), self.sim.IF_curr_exp,
+                                    self.cellparams,
+                                    label=post.label + '_gates')
+        gates.initialize(v=gates.get('v_rest'))
+        self.maxpool_gates.append(gates)
+        self._maxpool_connections[post.label] = connections
+        for source, target, gate_connections, receptor_type in [
+                (pre, gates, input_connections, 'excitatory'),
+                (gates, gates, lateral_connections, 'inhibitory'),
+                (gates, post, output_connections, 'excitatory')]:
+            self.maxpool_projections.append(self.sim.Projection(
+                source, target, self.sim.FromListConnector(
+                    get_connection_list(gate_connections),
+                    ['weight', 'delay']), receptor_type=receptor_type))
+
+    def add_projection(self, connections, maxpool=False):
+        """Connect the last two layers.
+
+        If the network is going to be simulated, the connections are passed to
+        a pyNN ``Projection``. Otherwise, no ``Projection`` is created, and
+        the connections are streamed chunk by chunk to the binary format
+        written by `save_connections`. Peak memory is then bounded by the size
+        of a chunk rather than by the largest layer.
+
+        Parameters
+        ----------
+
+        connections: Iterable[ndarray]
+            Chunks of connections, i.e. structured arrays of dtype
+            :py:data:`~snntoolbox.simulation.utils.connection_dtype`.
+        maxpool: bool
+            Whether the connections belong to a max pooling layer. They are
+            then marked in the manifest, so that the gates of the layer are
+            rebuilt when the network is loaded (see `connect_maxpool`).
+        """
+
+        from snntoolbox.simulation.utils import ConnectionWriter, \
+            get_connection_list
+
         if self.config.getboolean('tools', 'simulate'):
             self.connections.append(self.sim.Projection(
-                self.layers[-2], self.layers[-1],
-                self.sim.FromListConnector(connections, ['weight', 'delay'])))
+                self.layers[-2], self.layers[-1], self.sim.FromListConnector(
+                    get_connection_list(np.concatenate(list(connections))),
+                    ['weight', 'delay'])))
+            return
+
+        dirpath = os.path.join(self.config.get('paths', 'path_wd'),
+                               'connections')
+        if self._stream_connections is None:
+            self._stream_connections = \
+                self.config.getboolean('output', 'overwrite') or \
+                confirm_overwrite(os.path.join(dirpath, 'manifest.json'))
+        if not self._stream_connections:
+            return
+
+        writer = ConnectionWriter(dirpath, self.layers[-1].label)
+        for chunk in connections:
+            writer.write(chunk)
+        self._streamed_projections.append({
+            'label': self.layers[-1].label, 'pre': self.layers[-2].label,
+            'num_connections': writer.close(), 'maxpool': maxpool})
 
     def compile(self):
 
@@ -175,10 +283,18 @@ class SNN(AbstractSNN):
             data = np.moveaxis(data, 3, 1)
 
         x_flat = np.ravel(data)
-        if self._poisson_input:
+        if self.input_encoder.name == 'poisson':
             self.layers[0].set(rate=list(x_flat / self.rescale_fac * 1000))
         elif self._dataset_format == 'aedat':
             raise NotImplementedError
+        elif self._spiking_input:
+            # Spike times of the frames generated by the input encoder.
+            input_t_l = np.reshape(self.input_encoder.encode(
+                data, self._num_timesteps, self._sample_idxs_b),
+                (self._num_timesteps, -1))
+            spike_times = [np.flatnonzero(input_t) * self._dt
+                           for input_t in input_t_l.T]
+            self.layers[0].set(spike_times=spike_times)
         else:
             spike_times = \
                 [np.linspace(0, self._duration, self._duration * amplitude)
@@ -214,14 +330,42 @@ class SNN(AbstractSNN):
         print("Done.\n")
 
     def load(self, path, filename):
+        from snntoolbox.simulation.utils import connection_dtype, \
+            get_connection_list, load_connections, load_connectivity_manifest
 
         self.layers = self.load_assembly(path, filename)
+        dirpath = os.path.join(path, 'connections')
+        projections = load_connectivity_manifest(dirpath)
         for i in range(len(self.layers) - 1):
-            filepath = os.path.join(path, self.layers[i + 1].label)
-            assert os.path.isfile(filepath), \
-                "Connections were not found at specified location."
-            self.sim.Projection(self.layers[i], self.layers[i + 1],
-                                self.sim.FromFileConnector(filepath))
+            label = self.layers[i + 1].label
+            if projections is not None:
+                assert label in [p['label'] for p in projections], \
+                    "Connections of layer {} not found in {}.".format(
+                        label, dirpath)
+                connections = load_connections(dirpath, label)
+                if any(p['label'] == label and p.get('maxpool', False)
+                       for p in projections):
+                    columns = connections
+                    connections = np.empty(len(columns['source']),
+                                           connection_dtype)
+                    for name in connection_dtype.names:
+                        connections[name] = columns[name]
+                    self.layers[i + 1].set(**self.cellparams)
+                    self.layers[i + 1].initialize(
+                        v=self.layers[i + 1].get('v_rest'))
+                    self.connect_maxpool(connections, self.layers[i],
+                                         self.layers[i + 1])
+                    continue
+                connector = self.sim.FromListConnector(
+                    get_connection_list(connections), ['weight', 'delay'])
+            else:
+                # Connections saved as text files by older versions.
+                filepath = os.path.join(path, label)
+                assert os.path.isfile(filepath), \
+                    "Connections were not found at specified location."
+                connector = self.sim.FromFileConnector(filepath)
+            self.connections.append(self.sim.Projection(
+                self.layers[i], self.layers[i + 1], connector))
             self.layers[i + 1].set(**self.cellparams)
             self.layers[i + 1].initialize(v=self.layers[i + 1].get('v_rest'))
             # Biases should be already be loaded from the assembly file.
@@ -291,7 +435,7 @@ class SNN(AbstractSNN):
             kwargs[str('monitor_index')] + 1
         spiketrains_flat = self.layers[i].get_data().segments[-1].spiketrains
         spiketrains_b_l_t = self.reshape_flattened_spiketrains(
-            spiketrains_flat, shape)
+            spiketrains_flat, shape, sparse=self._sparse_spiketrains)
         return spiketrains_b_l_t
 
     def get_spiketrains_input(self):
@@ -364,34 +508,60 @@ class SNN(AbstractSNN):
     def save_connections(self, path):
         """Write parameters of a neural network to disk.
 
-        The parameters between two layers are saved in a text file.
-        They can then be used to connect pyNN populations e.g. with
-        ``sim.Projection(layer1, layer2, sim.FromListConnector(filename))``,
-        where ``sim`` is a simulator supported by pyNN, e.g. Brian, NEURON, or
-        NEST.
+        The connections of each projection are saved in a binary columnar
+        format (see :py:class:`~snntoolbox.simulation.utils.ConnectionWriter`)
+        in the subdirectory ``connections`` of ``path``, together with a
+        manifest listing the projections. Each column can be memory-mapped,
+        so the network can be reloaded without recomputing the connectivity.
 
         Parameters
         ----------
 
         path: str
             Path to directory where connections are saved.
-
-        Return
-        ------
-
-            Text files containing the layer connections. Each file is named
-            after the layer it connects to, e.g. ``layer2.txt`` if connecting
-            layer1 to layer2.
         """
 
+        from snntoolbox.simulation.utils import connection_dtype, \
+            save_connections, save_connectivity_manifest
+
         print("Saving connections...")
 
-        # Iterate over layers to save each projection in a separate txt file.
+        dirpath = os.path.join(path, 'connections')
+        if self._streamed_projections:
+            # The connections were written while building the network.
+            save_connectivity_manifest(dirpath, self._streamed_projections)
+            return
+
+        filepath = os.path.join(dirpath, 'manifest.json')
+        if not (self.config.getboolean('output', 'overwrite') or
+                confirm_overwrite(filepath)):
+            return
+
+        # Iterate over layers to save each projection in a separate folder.
+        projections = []
         for projection in self.connections:
-            filepath = os.path.join(path, projection.label.partition('→')[-1])
-            if self.config.getboolean('output', 'overwrite') or \
-                    confirm_overwrite(filepath):
-                projection.save('connections', filepath)
+            label = projection.label.partition('→')[-1]
+            connection_list = np.reshape(projection.get(
+                ['weight', 'delay'], format='list', with_address=True),
+                (-1, 4))
+            connections = np.empty(len(connection_list), connection_dtype)
+            for i, name in enumerate(connection_dtype.names):
+                connections[name] = connection_list[:, i]
+            num_connections = save_connections(dirpath, label, connections)
+            projections.append({'label': label, 'pre': projection.pre.label,
+                                'num_connections': num_connections,
+                                'maxpool': False})
+        # Max pooling layers are saved without their gates.
+        for i, layer in enumerate(self.layers[1:]):
+            if layer.label in self._maxpool_connections:
+                num_connections = save_connections(
+                    dirpath, layer.label,
+                    self._maxpool_connections[layer.label])
+                projections.append({'label': layer.label,
+                                    'pre': self.layers[i].label,
+                                    'num_connections': num_connections,
+                                    'maxpool': True})
+        save_connectivity_manifest(dirpath, projections)
 
     def save_biases(self, path):
         """Write biases of a neural network to disk.
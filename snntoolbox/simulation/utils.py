@@ -17,6 +17,7 @@ from abc import abstractmethod
 import numpy as np
 
 from snntoolbox.bin.utils import get_log_keys, get_plot_keys
+from snntoolbox.simulation.encoders import get_encoder
 from snntoolbox.parsing.utils import get_type
 from snntoolbox.utils.utils import echo
 import keras
@@ -120,6 +121,8 @@ class AbstractSNN:
         fanout varies between neurons.
     rescale_fac: float
         Scales spike probability when using Poisson input.
+    input_encoder: snntoolbox.simulation.encoders.Encoder
+        Encodes the input samples. See `snntoolbox.simulation.encoders`.
     num_classes: int
         Number of classes of the data set.
     top_k: int
@@ -166,12 +169,22 @@ class AbstractSNN:
         self.sim = initialize_simulator(config)
 
         self._dataset_format = self.config.get('input', 'dataset_format')
-        self._poisson_input = self.config.getboolean('input', 'poisson_input')
         self._num_poisson_events_per_sample = \
             self.config.getint('input', 'num_poisson_events_per_sample')
+        seed = self.config.get('input', 'poisson_seed')
+        self._poisson_seed = int(seed) if seed else np.random.randint(2 ** 31)
+        self.input_encoder = get_encoder(self.config, self._poisson_seed)
+        # Input spikes are generated by the encoder in each time step.
+        self._spiking_input = self.input_encoder.is_spiking and \
+            self._dataset_format != 'aedat'
+        self._input_step = 0
+        self._input_spikecount = 0
+        self._sample_idxs_b = np.arange(self.batch_size)
 
         self._plot_keys = get_plot_keys(self.config)
         self._log_keys = get_log_keys(self.config)
+        self._sparse_spiketrains = self.config.getboolean(
+            'output', 'sparse_spiketrains')
         self._mem_container_counter = None
         self._spiketrains_container_counter = None
 
@@ -403,6 +416,47 @@ class AbstractSNN:
 
         pass
 
+    def simulate_step(self, input_b_l, t):
+        """Advance the network by a single time step.
+
+        Only needed by simulators that support ``continuous_batching`` (see
+        `run_continuous`).
+
+        Parameters
+        ----------
+
+        input_b_l: ndarray
+            Input to the network in the current time step.
+        t: float
+            Current simulation time.
+
+        Returns
+        -------
+
+        output_b_l: ndarray
+            Spikes of the output layer.
+        """
+
+        raise NotImplementedError(
+            "Simulator does not support continuous batching.")
+
+    def reset_slots(self, mask_b):
+        """Reset the state variables of some samples in the batch.
+
+        Only needed by simulators that support ``continuous_batching`` (see
+        `run_continuous`).
+
+        Parameters
+        ----------
+
+        mask_b: ndarray
+            Boolean array of length `batch_size`, which is ``True`` at the
+            positions of the samples to reset.
+        """
+
+        raise NotImplementedError(
+            "Simulator does not support continuous batching.")
+
     def build(self, parsed_model, **kwargs):
         """Assemble a spiking neural network to prepare for simulation.
 
@@ -522,6 +576,9 @@ class AbstractSNN:
         x_test, y_test = get_samples_from_list(x_test, y_test, dataflow,
                                                self.config)
 
+        if self.config.getboolean('simulation', 'continuous_batching'):
+            return self.run_continuous(x_test, y_test, dataflow, log_dir)
+
         # Divide the test set into batches and run all samples in a batch in
         # parallel.
         dataset_format = self.config.get('input', 'dataset_format')
@@ -574,6 +631,8 @@ class AbstractSNN:
                 eval(self.config.get('input', 'chip_size')), image_shape,
                 eval(self.config.get('input', 'label_dict')))
             data_batch_kwargs['dvs_gen'] = dvs_gen
+            if hasattr(self.input_encoder, 'set_source'):
+                self.input_encoder.set_source(dvs_gen)
 
         # Simulate the SNN on a batch of samples in parallel.
         for batch_idx in range(num_batches):
@@ -604,6 +663,11 @@ class AbstractSNN:
             data_batch_kwargs['truth_b'] = truth_b
             data_batch_kwargs['x_b_l'] = x_b_l
 
+            # The encoded input of a sample is identified by its index.
+            self._sample_idxs_b = np.arange(self.batch_size * batch_idx,
+                                            self.batch_size * (batch_idx + 1))
+            self._input_step = 0
+
             # Main step: Run the network on a batch of samples for the duration
             # of the simulation.
             print("\nStarting new simulation...\n")
@@ -778,6 +842,187 @@ class AbstractSNN:
 
         return top1acc_total
 
+    def run_continuous(self, x_test, y_test, dataflow, log_dir):
+        """Simulate a spiking network with continuous batching.
+
+        In contrast to `run`, the samples of a batch do not start and end
+        together. A sample occupies a slot of the batch until it has been
+        simulated for ``duration``, or until its output has been decided (see
+        ``early_exit_margin``). The slot is then reset and refilled with the
+        next test sample, so that the simulator is always busy with a full
+        batch. Requires the target simulator to implement `simulate_step` and
+        `reset_slots`. Logging and plotting of network variables are not
+        supported in this mode.
+
+        All slots share the simulation time passed to `simulate_step`, which
+        keeps increasing across refills. The layers of the simulator must
+        therefore not depend on the absolute time since the start of a
+        sample. Online normalization, which does, is not supported. Spike
+        input is generated from the time step of each slot, with the spike
+        size set by the maximum value of the sample. Poisson input is limited
+        to ``num_poisson_events_per_sample`` per slot.
+
+        Parameters
+        ----------
+
+        x_test: Optional[ndarray]
+            The input samples to test.
+        y_test: Optional[ndarray]
+            Ground truth of test data.
+        dataflow: Optional[keras.DataFlowGenerator]
+            Loads images from disk and processes them on the fly.
+        log_dir: str
+            Where to store the accuracy log.
+
+        Returns
+        -------
+
+        top1acc_total: float
+            Number of correctly classified samples divided by total number of
+            test samples.
+        """
+
+        import time
+        from snntoolbox.utils.utils import in_top_k
+
+        assert self.config.get('input', 'dataset_format') != 'aedat', \
+            "Continuous batching is not supported with DVS input."
+        assert not self.config.getboolean('normalization',
+                                          'online_normalization'), \
+            "Continuous batching is not supported with online normalization."
+        if len(self._plot_keys) > 0 or len(self._log_keys) > 0:
+            print("SNN toolbox WARNING: Variables are not logged or plotted "
+                  "when using continuous batching.")
+
+        num_to_test = self.config.getint('simulation', 'num_to_test')
+        margin = self.config.getint('simulation', 'early_exit_margin')
+        patience = self.config.getint('simulation', 'early_exit_patience')
+
+        def iterate_samples():
+            if x_test is not None:
+                for x_l, y_l in zip(x_test, y_test):
+                    yield x_l, np.argmax(y_l)
+            else:
+                while True:
+                    x_b_l, y_b_l = dataflow.next()
+                    for x_l, y_l in zip(x_b_l, y_b_l):
+                        yield x_l, np.argmax(y_l)
+
+        samples = iterate_samples()
+        num_samples_queued = 0
+
+        batch_shape = list(self.parsed_model.input_shape)
+        batch_shape[0] = self.batch_size
+        x_b_l = np.zeros(batch_shape, 'float32')
+        truth_b = np.zeros(self.batch_size, int)
+        sample_idxs_b = np.zeros(self.batch_size, int)
+        x_max_b = np.zeros(self.batch_size, 'float32')
+        active_b = np.zeros(self.batch_size, bool)
+        steps_b = np.zeros(self.batch_size, int)
+        confident_steps_b = np.zeros(self.batch_size, int)
+        spikecounts_b_l = np.zeros((self.batch_size, self.num_classes), int)
+        input_spikecounts_b = np.zeros(self.batch_size, int)
+        limit_input = self._spiking_input and \
+            self.input_encoder.name == 'poisson' and \
+            self._num_poisson_events_per_sample >= 0
+        truth_d = []
+        guesses_d = []
+        top_k_correct_d = []
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        path_acc = os.path.join(log_dir, 'accuracy.txt')
+        if os.path.isfile(path_acc):
+            os.remove(path_acc)
+
+        # Fill all slots of the batch before starting the simulation.
+        free_b = np.ones(self.batch_size, bool)
+        self.reset_slots(free_b)
+
+        print("\nStarting continuous simulation...\n")
+        start_time = time.time()
+        sim_step_int = 0
+        while True:
+            # Refill free slots with the next samples from the test set.
+            for i in np.flatnonzero(free_b):
+                sample = next(samples, None) \
+                    if num_samples_queued < num_to_test else None
+                if sample is None:
+                    break
+                x_b_l[i], truth_b[i] = sample
+                x_max_b[i] = np.max(x_b_l[i])
+                sample_idxs_b[i] = num_samples_queued
+                active_b[i] = True
+                num_samples_queued += 1
+            if not np.any(active_b):
+                break
+
+            sim_step_int += 1
+            if self._spiking_input:
+                input_b_l = self.input_encoder.encode(
+                    x_b_l, 1, sample_idxs_b, steps_b, x_max_b)[0]
+                if limit_input:
+                    # No more input spikes in slots that exceeded the limit.
+                    input_b_l[input_spikecounts_b >=
+                              self._num_poisson_events_per_sample] = 0
+                    input_spikecounts_b += np.count_nonzero(np.reshape(
+                        input_b_l, (self.batch_size, -1)), 1)
+            else:
+                input_b_l = x_b_l * self._dt
+            out_spikes = self.simulate_step(input_b_l, sim_step_int * self._dt)
+
+            spikecounts_b_l += out_spikes > 0
+            steps_b += 1
+            if margin > 0:
+                confident_steps_b = update_confident_steps(
+                    confident_steps_b, spikecounts_b_l, margin)
+            free_b = active_b & ((steps_b >= self._num_timesteps) |
+                                 (confident_steps_b >= patience))
+            if not np.any(free_b):
+                continue
+
+            # Store the results of finished samples and reset their slots.
+            guesses_b = np.argmax(spikecounts_b_l, 1)
+            guesses_b[np.sum(spikecounts_b_l, 1) == 0] = -1
+            truth_d += list(truth_b[free_b])
+            guesses_d += list(guesses_b[free_b])
+            top_k_correct_d += list(in_top_k(spikecounts_b_l[free_b],
+                                             truth_b[free_b], self.top_k))
+            x_b_l[free_b] = 0
+            active_b[free_b] = False
+            steps_b[free_b] = 0
+            confident_steps_b[free_b] = 0
+            spikecounts_b_l[free_b] = 0
+            input_spikecounts_b[free_b] = 0
+            self.reset_slots(free_b)
+
+            top1acc_moving = np.mean(np.array(truth_d) == np.array(guesses_d))
+            top5acc_moving = np.mean(top_k_correct_d)
+            print("{} of {} samples completed. Moving accuracy of SNN "
+                  "(top-1, top-{}): {:.2%}, {:.2%}.".format(
+                      len(truth_d), num_to_test, self.top_k, top1acc_moving,
+                      top5acc_moving))
+            with open(path_acc, str('a')) as f_acc:
+                f_acc.write(str("{} {:.2%} {:.2%}\n".format(
+                    len(truth_d), top1acc_moving, top5acc_moving)))
+
+        duration = time.time() - start_time
+        top1acc_total = np.mean(np.array(truth_d) == np.array(guesses_d))
+        top5acc_total = np.mean(top_k_correct_d)
+
+        print("Simulation finished.\n\n")
+        print("Total accuracy: {:.2%} on {} test samples.\n\n".format(
+            top1acc_total, len(guesses_d)))
+        print("Top-{} accuracy: {:.2%}.\n\n".format(self.top_k,
+                                                    top5acc_total))
+        print("Simulated {} time steps; throughput: {:.1f} samples per "
+              "second.".format(sim_step_int, len(guesses_d) / duration))
+
+        # If batch_size was modified, change back to original value now.
+        if self.batch_size != self._batch_size:
+            self.config.set('simulation', 'batch_size', str(self._batch_size))
+
+        return top1acc_total
+
     def adjust_batchsize(self):
         """Reduce batch size to single sample if necessary.
 
@@ -831,7 +1076,10 @@ class AbstractSNN:
                 if not is_spiking(layer, self.config):
                     continue
                 shape = list(layer.output_shape) + [self._num_timesteps]
-                self.spiketrains_n_b_l_t.append((np.zeros(shape, 'float32'),
+                shape[0] = self.batch_size
+                spiketrains_b_l_t = SparseSpiketrains(shape) \
+                    if self._sparse_spiketrains else np.zeros(shape, 'float32')
+                self.spiketrains_n_b_l_t.append((spiketrains_b_l_t,
                                                  layer.name))
 
         if self.config.get('conversion', 'spike_code') == 'temporal_pattern':
@@ -872,9 +1120,13 @@ class AbstractSNN:
 
         if self.spiketrains_n_b_l_t is not None:
             for l in range(len(self.spiketrains_n_b_l_t)):
-                self.spiketrains_n_b_l_t[l] = (
-                    np.zeros_like(self.spiketrains_n_b_l_t[l][0]),
-                    self.spiketrains_n_b_l_t[l][1])
+                spiketrains_b_l_t, name = self.spiketrains_n_b_l_t[l]
+                if isinstance(spiketrains_b_l_t, SparseSpiketrains):
+                    spiketrains_b_l_t = SparseSpiketrains(
+                        spiketrains_b_l_t.shape)
+                else:
+                    spiketrains_b_l_t = np.zeros_like(spiketrains_b_l_t)
+                self.spiketrains_n_b_l_t[l] = (spiketrains_b_l_t, name)
 
         if self.synaptic_operations_b_t is not None:
             self.synaptic_operations_b_t = np.zeros_like(
@@ -971,15 +1223,7 @@ class AbstractSNN:
 
         # For each time step, get number of spikes of all neurons in the output
         # layer.
-        shape = (self.batch_size, self.num_classes, self._num_timesteps)
-        output_b_l_t = np.zeros(shape, 'int32')
-        spiketrains_b_l_t = self.get_spiketrains_output()
-        for b in range(shape[0]):
-            for l in range(shape[1]):
-                for t in range(shape[2]):
-                    output_b_l_t[b, l, t] = np.count_nonzero(
-                        spiketrains_b_l_t[b, l, :t+1])
-        return output_b_l_t
+        return get_cumulative_spikecounts(self.get_spiketrains_output())
 
     def reset_container_counters(self):
         self._mem_container_counter = 0
@@ -1011,7 +1255,7 @@ class AbstractSNN:
         simulation.
         """
 
-        if self._poisson_input or self._dataset_format == 'aedat':
+        if self._spiking_input or self._dataset_format == 'aedat':
             spiketrains_b_l_t = self.get_spiketrains_input()
             if self.input_b_l_t is not None:
                 self.input_b_l_t = spiketrains_b_l_t
@@ -1044,7 +1288,7 @@ class AbstractSNN:
         Parameters
         ----------
 
-        spiketrains_b_l_t: ndarray
+        spiketrains_b_l_t: Union[ndarray, SparseSpiketrains]
             A batch of spikes for a layer over the simulation time.
             Shape: (`batch_size`, ``layer_shape``, ``num_timesteps``)
 
@@ -1052,6 +1296,9 @@ class AbstractSNN:
 
         i = self._spiketrains_container_counter
 
+        if self._sparse_spiketrains:
+            spiketrains_b_l_t = to_sparse_spiketrains(spiketrains_b_l_t)
+
         # Add spike trains to log variables.
         if self.spiketrains_n_b_l_t is not None:
             self.spiketrains_n_b_l_t[i] = (spiketrains_b_l_t,
@@ -1059,7 +1306,11 @@ class AbstractSNN:
             self._spiketrains_container_counter += 1
 
         # Use spike trains to compute the number of synaptic operations.
-        if self.synaptic_operations_b_t is not None:
+        if isinstance(spiketrains_b_l_t, SparseSpiketrains):
+            if self.synaptic_operations_b_t is not None:
+                self.synaptic_operations_b_t += \
+                    spiketrains_b_l_t.get_spikecounts_b_t(self.fanout[i + 1])
+        elif self.synaptic_operations_b_t is not None:
             for t in range(self._num_timesteps):
                 self.synaptic_operations_b_t[:, t] += \
                     get_layer_synaptic_operations(
@@ -1071,7 +1322,8 @@ class AbstractSNN:
                 self.neuron_operations_b_t[:, t] += \
                     self.num_neurons_with_bias[i + 1]
 
-    def reshape_flattened_spiketrains(self, spiketrains, shape, is_list=True):
+    def reshape_flattened_spiketrains(self, spiketrains, shape, is_list=True,
+                                      neuron_idxs=None, sparse=False):
         """
         Convert list of spike times into array where nonzero entries
         (indicating spike times) are properly spread out across array. Then
@@ -1089,6 +1341,14 @@ class AbstractSNN:
             In this case, we distribute the spike times across a numpy array.
             If ``False``, ``spiketrains`` is already a 2D array of shape
             (num_neurons, num_timesteps).
+        neuron_idxs: Optional[ndarray]
+            Index of the neuron that emitted each spike. If given,
+            ``spiketrains`` is a flat array of the spike times of all neurons,
+            as recorded for instance by a Brian2 ``SpikeMonitor`` (``i`` and
+            ``t``). This avoids grouping the spikes by neuron.
+        sparse: Optional[bool]
+            If ``True``, return `SparseSpiketrains` instead of a dense array.
+            Requires ``is_list``.
 
         Returns
         -------
@@ -1099,10 +1359,19 @@ class AbstractSNN:
         """
 
         if is_list:
+            if neuron_idxs is None:
+                neuron_idxs = np.repeat(np.arange(len(spiketrains)),
+                                        [len(s) for s in spiketrains])
+                spiketrains = np.concatenate(
+                    [np.asarray(s, float) for s in spiketrains] + [[]])
+            spiketimes = np.asarray(spiketrains, float)
+            neuron_idxs = np.asarray(neuron_idxs, int)
+            steps = (spiketimes / self._dt).astype(int)
+            if sparse:
+                return self.get_sparse_spiketrains(neuron_idxs, steps,
+                                                   spiketimes, shape)
             spiketrains_flat = np.zeros((np.prod(shape[:-1]), shape[-1]))
-            for k, spiketrain in enumerate(spiketrains):
-                for t in spiketrain:
-                    spiketrains_flat[k, int(t / self._dt)] = t
+            spiketrains_flat[neuron_idxs, steps] = spiketimes
         else:
             spiketrains_flat = np.reshape(spiketrains, (-1, shape[-1]))
 
@@ -1119,6 +1388,40 @@ class AbstractSNN:
 
         return spiketrains_b_l_t
 
+    def get_sparse_spiketrains(self, neuron_idxs, steps, spiketimes, shape):
+        """Sparse counterpart of `reshape_flattened_spiketrains`.
+
+        Parameters
+        ----------
+
+        neuron_idxs: ndarray
+            Index of the neuron of each spike in the flattened batch (sample
+            index first, then neurons in ``channels_first`` order).
+        steps: ndarray
+            Time step of each spike.
+        spiketimes: ndarray
+            Time of each spike.
+        shape
+            Layer shape, including batch size and number of time steps.
+
+        Returns
+        -------
+
+        spiketrains_b_l_t: SparseSpiketrains
+            A batch of spikes for a layer over the simulation time.
+        """
+
+        spiketrains_b_l_t = SparseSpiketrains(shape)
+        batch_idxs, neuron_idxs = np.divmod(neuron_idxs,
+                                            spiketrains_b_l_t.num_neurons)
+        # Same reordering as for the dense array, applied to the indices.
+        if self.data_format == 'channels_last' and len(shape) == 5:
+            c, y, x = np.unravel_index(neuron_idxs,
+                                       [shape[i] for i in [3, 1, 2]])
+            neuron_idxs = np.ravel_multi_index((y, x, c), shape[1:4])
+        spiketrains_b_l_t.add(batch_idxs, neuron_idxs, steps, spiketimes)
+        return spiketrains_b_l_t
+
     def get_avg_rate_from_trains(self):
         """
         Compute spike rate of neurons averaged over batches, the neurons in the
@@ -1131,13 +1434,87 @@ class AbstractSNN:
 
         avg_rate = 0
         for i in range(len(self.spiketrains_n_b_l_t)):
-            avg_rate += np.count_nonzero(self.spiketrains_n_b_l_t[i][0])
+            avg_rate += count_spikes(self.spiketrains_n_b_l_t[i][0])
 
         avg_rate /= np.sum(self.num_neurons) * self.batch_size * \
             self._num_timesteps
 
         return avg_rate
 
+    def get_input_frames(self, x_b_l, num_steps, sample_idxs_b=None,
+                         x_max=None):
+        """Get input spikes for the next ``num_steps`` time steps.
+
+        The frames are generated by the `input_encoder` in a single vectorized
+        call. With the Poisson encoding (see `get_poisson_frames`), they are
+        reproducible given the ``poisson_seed``, the index of the sample, the
+        time step and ``x_max``. Only then is the number of input spikes
+        limited by ``num_poisson_events_per_sample``.
+
+        Parameters
+        ----------
+
+        x_b_l: ndarray
+            The input frame. Shape: (`batch_size`, ``layer_shape``).
+        num_steps: int
+            Number of time steps to generate.
+        sample_idxs_b: Optional[ndarray]
+            Index of each sample of ``x_b_l`` in the test set. Defaults to the
+            indices of the current batch.
+        x_max: Optional[Union[float, ndarray]]
+            Maximum input value, which sets the size of the spikes. Can be
+            given per sample. Defaults to the maximum of ``x_b_l``.
+
+        Returns
+        -------
+
+        input_t_b_l: ndarray
+            Array of input spikes, with shape (``num_steps``,
+            `batch_size`, ``layer_shape``).
+        """
+
+        if sample_idxs_b is None:
+            sample_idxs_b = self._sample_idxs_b
+        input_t_b_l = self.input_encoder.encode(
+            x_b_l, num_steps, sample_idxs_b, self._input_step, x_max)
+        self._input_step += num_steps
+
+        if self.input_encoder.name == 'poisson' and \
+                self._num_poisson_events_per_sample >= 0:
+            # No more input spikes once _input_spikecount exceeded limit.
+            spikecounts_t = np.count_nonzero(np.reshape(
+                input_t_b_l, (num_steps, -1)), 1) // len(x_b_l)
+            spikecounts_before_t = self._input_spikecount + \
+                np.cumsum(spikecounts_t) - spikecounts_t
+            mute_t = spikecounts_before_t >= \
+                self._num_poisson_events_per_sample
+            input_t_b_l[mute_t] = 0
+            self._input_spikecount += int(np.sum(spikecounts_t[~mute_t]))
+
+        return input_t_b_l
+
+    def get_input_frame_batch(self, x_b_l, sample_idxs_b=None, x_max=None):
+        """Get a batch of input spikes for the next time step.
+
+        Parameters
+        ----------
+
+        x_b_l: ndarray
+            The input frame. Shape: (`batch_size`, ``layer_shape``).
+        sample_idxs_b: Optional[ndarray]
+            Index of each sample of ``x_b_l`` in the test set.
+        x_max: Optional[Union[float, ndarray]]
+            Maximum input value, which sets the size of the spikes.
+
+        Returns
+        -------
+
+        input_b_l: ndarray
+            Array of input spikes, with same shape as ``x_b_l``.
+        """
+
+        return self.get_input_frames(x_b_l, 1, sample_idxs_b, x_max)[0]
+
     def preprocessing(self, **kwargs):
         """
 
@@ -1180,6 +1557,221 @@ def get_samples_from_list(x_test, y_test, dataflow, config):
     return x_test, y_test
 
 
+def get_uniform_frames(shape, num_steps, seed, sample_idx, start_step=0):
+    """Draw uniform random numbers for the Poisson input of a sample.
+
+    The numbers are generated with the counter-based Philox generator. Its key
+    is given by ``seed`` and ``sample_idx``, and its counter by the time step.
+    Hence the frame of any time step can be regenerated on demand, and
+    drawing a chunk of frames at once yields the same numbers as drawing them
+    one by one.
+
+    Parameters
+    ----------
+
+    shape: tuple
+        Shape of a single input frame.
+    num_steps: int
+        Number of consecutive time steps to generate.
+    seed: int
+        Seed of the random number generator.
+    sample_idx: int
+        Index of the sample in the test set.
+    start_step: int
+        Time step of the first frame.
+
+    Returns
+    -------
+
+    u_t_l: ndarray
+        Array of shape (``num_steps``, ``shape``) with random numbers in
+        [0, 1).
+    """
+
+    size = int(np.prod(shape))
+    # Philox produces four 64-bit words per counter increment. Aligning each
+    # frame to a full block makes the counter a function of the time step.
+    num_blocks = -(-size // 4)
+    rng = np.random.Generator(np.random.Philox(
+        key=[seed, sample_idx], counter=start_step * num_blocks))
+    u_t_l = rng.random((num_steps, 4 * num_blocks))[:, :size]
+    return np.reshape(u_t_l, (num_steps,) + tuple(shape))
+
+
+def get_poisson_frames(x_b_l, num_steps, rescale_fac, seed, sample_idxs_b,
+                       start_step=0, x_max=None):
+    """Generate Poisson input spikes for several time steps at once.
+
+    A neuron of the input layer fires with a probability proportional to the
+    corresponding input value. Spikes have the size of the maximum input
+    value, and the sign of the corresponding input value.
+
+    The maximum input value defaults to the maximum of ``x_b_l``. In that
+    case, the spikes of a sample depend on the other samples in the batch:
+    The stream of a sample is only reproducible for the same batch, or if
+    ``x_max`` is passed explicitly.
+
+    Parameters
+    ----------
+
+    x_b_l: ndarray
+        The input frame. Shape: (`batch_size`, ``layer_shape``).
+    num_steps: int
+        Number of time steps to generate.
+    rescale_fac: float
+        Scales spike probability (inverse of the input rate in units of the
+        time resolution).
+    seed: int
+        Seed of the random number generator.
+    sample_idxs_b: ndarray
+        Index of each sample of the batch in the test set. Identifies the
+        random stream used for the sample.
+    start_step: Union[int, ndarray]
+        Time step of the first frame. Can be given per sample.
+    x_max: Optional[Union[float, ndarray]]
+        Maximum input value, which scales the spike probability and sets the
+        size of the spikes. Can be given per sample. Defaults to the maximum
+        of ``x_b_l``.
+
+    Returns
+    -------
+
+    input_t_b_l: ndarray
+        Array of Poisson input spikes, with shape (``num_steps``,
+        `batch_size`, ``layer_shape``).
+    """
+
+    if x_max is None:
+        x_max = np.max(x_b_l)
+    x_max_b = np.broadcast_to(x_max, len(x_b_l))
+    threshold_b_l = np.abs(x_b_l)
+    start_steps_b = np.broadcast_to(start_step, len(x_b_l))
+    input_t_b_l = np.empty((num_steps,) + x_b_l.shape, 'float32')
+    for i, (sample_idx, step) in enumerate(zip(sample_idxs_b, start_steps_b)):
+        u_t_l = get_uniform_frames(x_b_l.shape[1:], num_steps, seed,
+                                   sample_idx, step)
+        # For BinaryNets, with input that is not normalized and not all
+        # positive, we stimulate with spikes of the same size as the maximum
+        # activation, and the same sign as the corresponding activation.
+        amplitude_l = (x_max_b[i] * np.sign(x_b_l[i])).astype('float32')
+        input_t_b_l[:, i] = np.where(
+            u_t_l * (rescale_fac * x_max_b[i]) <= threshold_b_l[i],
+            amplitude_l, 0)
+    return input_t_b_l
+
+
+connection_dtype = np.dtype([('source', 'int32'), ('target', 'int32'),
+                             ('weight', 'float32'), ('delay', 'float32')])
+
+
+def get_flatten_permutation(shape, data_format):
+    """Map the outputs of a Flatten layer to the neurons of its input layer.
+
+    Keras flattens feature maps in the order given by the ``data_format``,
+    while the neurons of the spiking layers are indexed in
+    ``channels_first`` order.
+
+    Parameters
+    ----------
+
+    shape: tuple
+        Shape of the feature map that is flattened.
+    data_format: str
+        Either ``channels_first`` or ``channels_last``.
+
+    Returns
+    -------
+
+    permutation: ndarray
+        Index of the neuron in the spiking layer that corresponds to each
+        output of the Flatten layer.
+    """
+
+    if data_format == 'channels_last':
+        y_in, x_in, f_in = shape
+    else:
+        f_in, y_in, x_in = shape
+    i = np.arange(f_in * y_in * x_in)
+    # Sweep across channel axis of feature map. Assumes that each consecutive
+    # input neuron lies in a different channel. This is the case for
+    # channels_last, but not for channels_first.
+    f = i % f_in
+    # Sweep across height of feature map. Increase y by one if all rows along
+    # the channel axis were seen.
+    y = i // (f_in * x_in)
+    # Sweep across width of feature map.
+    x = (i // f_in) % x_in
+    return f * x_in * y_in + x_in * y + x
+
+
+def build_dense(weights, delay, permutation=None):
+    """Build dense layer.
+
+    Parameters
+    ----------
+
+    weights: ndarray
+        Weight matrix of shape (``num_inputs``, ``num_outputs``).
+    delay: float
+        Synaptic delay.
+    permutation: Optional[ndarray]
+        Index of the source neuron of each row of ``weights``, e.g. the result
+        of `get_flatten_permutation`. Defaults to the row index.
+
+    Returns
+    -------
+
+    connections: ndarray
+        A structured array of dtype ``connection_dtype``, with the
+        connections ordered by input and then output neuron.
+    """
+
+    num_inputs, num_outputs = weights.shape
+    if permutation is None:
+        permutation = np.arange(num_inputs)
+    connections = np.empty(weights.size, connection_dtype)
+    connections['source'] = np.repeat(permutation, num_outputs)
+    connections['target'] = np.tile(np.arange(num_outputs), num_inputs)
+    connections['weight'] = np.ravel(weights)
+    connections['delay'] = delay
+    return connections
+
+
+def iter_dense_connections(weights, delay, permutation=None,
+                           chunk_size=2 ** 20):
+    """Generate the connections of a dense layer in chunks.
+
+    Parameters
+    ----------
+
+    weights: ndarray
+        Weight matrix of shape (``num_inputs``, ``num_outputs``).
+    delay: float
+        Synaptic delay.
+    permutation: Optional[ndarray]
+        Index of the source neuron of each row of ``weights`` (see
+        `build_dense`).
+    chunk_size: int
+        Approximate number of connections per chunk. A chunk contains at least
+        one row of ``weights``.
+
+    Yields
+    ------
+
+    connections: ndarray
+        A structured array of dtype ``connection_dtype``. Concatenating the
+        chunks gives the result of `build_dense`.
+    """
+
+    num_inputs, num_outputs = weights.shape
+    if permutation is None:
+        permutation = np.arange(num_inputs)
+    num_rows = max(1, chunk_size // max(1, num_outputs))
+    for start in range(0, num_inputs, num_rows):
+        yield build_dense(weights[start:start + num_rows], delay,
+                          permutation[start:start + num_rows])
+
+
 def build_convolution(layer, delay, transpose_kernel=False):
     """Build convolution layer.
 
@@ -1197,25 +1789,61 @@ def build_convolution(layer, delay, transpose_kernel=False):
     Returns
     -------
 
-    connections: List[tuple]
-        A list where each entry is a tuple containing the source neuron index,
-        the target neuron index, the connection strength (weight), and the
-        synaptic ``delay``.
+    connections: ndarray
+        A structured array of dtype ``connection_dtype``, where each entry
+        contains the source neuron index, the target neuron index, the
+        connection strength (weight), and the synaptic ``delay``.
     i_offset: ndarray
         Flattened array containing the biases of all neurons in the ``layer``.
     """
 
+    connections = np.concatenate(list(iter_convolution_connections(
+        layer, delay, transpose_kernel)))
+    print('')
+
     weights, biases = layer.get_weights()
 
+    # Biases.
+    n = int(np.prod(layer.output_shape[1:]) / len(biases))
+    i_offset = np.repeat(biases, n).astype('float64')
+
+    return connections, i_offset
+
+
+def iter_convolution_connections(layer, delay, transpose_kernel=False):
+    """Generate the connections of a convolution layer.
+
+    The connections are computed with array operations, one output feature
+    map at a time. This bounds the memory needed to build the connectivity
+    of a layer by the size of a single chunk.
+
+    Parameters
+    ----------
+
+    layer: keras.layers.Conv2D
+        Parsed model layer.
+    delay: float
+        Synaptic delay.
+    transpose_kernel: bool
+        Whether or not to convert kernels from Tensorflow to Theano format
+        (correlation instead of convolution).
+
+    Yields
+    ------
+
+    connections: ndarray
+        A structured array of dtype ``connection_dtype`` with the connections
+        targeting one output feature map. Neurons are indexed in
+        ``channels_first`` order.
+    """
+
+    weights = layer.get_weights()[0]
+
     if transpose_kernel:
         from keras.utils.conv_utils import convert_kernel
         print("Transposing kernels.")
         weights = convert_kernel(weights)
 
-    # Biases.
-    n = int(np.prod(layer.output_shape[1:]) / len(biases))
-    i_offset = np.repeat(biases, n).astype('float64')
-
     ii = 1 if keras.backend.image_data_format() == 'channels_first' else 0
 
     ny = layer.input_shape[1 + ii]  # Height of feature map
@@ -1241,34 +1869,263 @@ def build_convolution(layer, delay, transpose_kernel=False):
         raise NotImplementedError("Border_mode {} not supported".format(
             layer.padding))
 
-    connections = []
+    # Axes: output row y, output column x, input filter fin, kernel row k,
+    # kernel column j.
+    y = np.arange(y0, ny - y0, sy)[:, None, None, None, None]
+    x = np.arange(x0, nx - x0, sx)[None, :, None, None, None]
+    fin = np.arange(weights.shape[2])[None, None, :, None, None]
+    k = np.arange(-py, py + 1)[None, None, None, :, None]
+    j = np.arange(-px, px + 1)[None, None, None, None, :]
+
+    shape = np.broadcast(y, x, fin, k, j).shape
+    is_valid = np.broadcast_to((0 <= y + k) & (y + k < ny) &
+                               (0 <= x + j) & (x + j < nx), shape)
+    source = np.broadcast_to(j + x + (y + k) * nx + fin * nx * ny,
+                             shape)[is_valid]
+    target = np.broadcast_to((x - x0) // sx + (y - y0) // sy * mx,
+                             shape)[is_valid]
+    kernel_idxs = (py - k, px - j, fin)
 
     # Loop over output filters 'fout'
     for fout in range(weights.shape[3]):
-        for y in range(y0, ny - y0, sy):
-            for x in range(x0, nx - x0, sx):
-                target = int((x - x0) / sx + (y - y0) / sy * mx +
-                             fout * mx * my)
-                # Loop over input filters 'fin'
-                for fin in range(weights.shape[2]):
-                    for k in range(-py, py + 1):
-                        if not 0 <= y + k < ny:
-                            continue
-                        for l in range(-px, px + 1):
-                            if not 0 <= x + l < nx:
-                                continue
-                            source = l + x + (y + k) * nx + fin * nx * ny
-                            connections.append((source, target,
-                                                weights[py - k, px - l, fin,
-                                                        fout], delay))
+        connections = np.empty(len(source), connection_dtype)
+        connections['source'] = source
+        connections['target'] = target + fout * mx * my
+        connections['weight'] = np.broadcast_to(
+            weights[..., fout][kernel_idxs], shape)[is_valid]
+        connections['delay'] = delay
+        yield connections
         echo('.')
-    print('')
 
-    return connections, i_offset
 
+def get_connection_list(connections):
+    """Convert a structured array of connections to a two-dimensional array.
+
+    Parameters
+    ----------
+
+    connections: ndarray
+        Structured array of dtype ``connection_dtype``.
+
+    Returns
+    -------
+
+    connection_list: ndarray
+        Array of shape (``len(connections)``, 4) with columns source, target,
+        weight and delay, as accepted by the ``FromListConnector`` of pyNN.
+    """
+
+    return np.column_stack([connections[name].astype('float64')
+                            for name in connection_dtype.names])
+
+
+def replicate_connections(connections, num_pre, num_post, num_replicas):
+    """Replicate the connections of a projection for several independent
+    copies of a network.
+
+    The neurons of replica ``b`` occupy the index range ``[b * n, (b + 1) *
+    n)`` of each layer of size ``n``, so the connectivity of the replicated
+    projection is block-diagonal. This allows to simulate a batch of samples
+    in a single network, with neuron groups laid out in the order of
+    `reshape_flattened_spiketrains` (batch dimension first).
+
+    Parameters
+    ----------
+
+    connections: ndarray
+        Structured array of dtype ``connection_dtype`` with the connections of
+        a single replica.
+    num_pre: int
+        Number of neurons in the presynaptic layer of a single replica.
+    num_post: int
+        Number of neurons in the postsynaptic layer of a single replica.
+    num_replicas: int
+        Number of replicas, usually the batch size.
+
+    Returns
+    -------
+
+    connections: ndarray
+        The connections of all replicas, ordered by replica.
+    """
+
+    if num_replicas == 1:
+        return connections
+    offsets = np.arange(num_replicas)[:, None]
+    replicated = np.empty(num_replicas * len(connections), connection_dtype)
+    replicated['source'] = np.ravel(connections['source'] + offsets * num_pre)
+    replicated['target'] = np.ravel(connections['target'] +
+                                    offsets * num_post)
+    replicated['weight'] = np.tile(connections['weight'], num_replicas)
+    replicated['delay'] = np.tile(connections['delay'], num_replicas)
+    return replicated
+
+
+class ConnectionWriter(object):
+    """Write the connections of a projection to disk, chunk by chunk.
+
+    Each column of ``connection_dtype`` is stored in a separate ``.npy`` file
+    in the directory ``dirpath/label``, so that it can be memory-mapped when
+    loading (see `load_connections`). Chunks are appended to the files
+    directly; the array headers are completed when the writer is closed.
+
+    Parameters
+    ----------
+
+    dirpath: str
+        Directory containing the connections of all projections.
+    label: str
+        Name of the projection, usually the label of the postsynaptic layer.
+    """
+
+    # Number of bytes reserved for the header of a one-dimensional ``.npy``
+    # file. Large enough for any length of the array.
+    header_size = 128
+
+    def __init__(self, dirpath, label):
+
+        self.path = os.path.join(dirpath, label)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.num_connections = 0
+        self._files = {}
+        for name in connection_dtype.names:
+            self._files[name] = open(os.path.join(self.path, name + '.npy'),
+                                     'wb')
+            self._write_header(name)
+
+    def _write_header(self, name):
+        f = self._files[name]
+        f.seek(0)
+        header = {'descr': np.lib.format.dtype_to_descr(
+            connection_dtype[name]), 'fortran_order': False,
+            'shape': (self.num_connections,)}
+        np.lib.format.write_array_header_1_0(f, header)
+        assert f.tell() == self.header_size
+
+    def write(self, connections):
+        """Append a chunk of connections (structured array of dtype
+        ``connection_dtype``)."""
+
+        for name, f in self._files.items():
+            f.write(np.ascontiguousarray(connections[name],
+                                         connection_dtype[name]).tobytes())
+        self.num_connections += len(connections)
+
+    def close(self):
+        """Complete the files.
+
+        Returns
+        -------
+
+        num_connections: int
+            Total number of connections written.
+        """
+
+        for name, f in self._files.items():
+            self._write_header(name)
+            f.close()
+        return self.num_connections
+
+
+def save_connections(dirpath, label, connections):
+    """Save the connections of a projection.
+
+    Parameters
+    ----------
+
+    dirpath: str
+        Directory containing the connections of all projections.
+    label: str
+        Name of the projection.
+    connections: ndarray
+        Structured array of dtype ``connection_dtype``.
+
+    Returns
+    -------
+
+    num_connections: int
+        Number of connections written.
+    """
+
+    writer = ConnectionWriter(dirpath, label)
+    writer.write(connections)
+    return writer.close()
+
+
+def load_connections(dirpath, label, mmap_mode='r'):
+    """Load the connections of a projection saved with `save_connections` or
+    `ConnectionWriter`.
+
+    Parameters
+    ----------
+
+    dirpath: str
+        Directory containing the connections of all projections.
+    label: str
+        Name of the projection.
+    mmap_mode: Optional[str]
+        Passed on to ``np.load``. By default, the columns are memory-mapped.
+
+    Returns
+    -------
+
+    connections: dict[str, ndarray]
+        The columns of ``connection_dtype``, indexed by their name.
+    """
+
+    return {name: np.load(os.path.join(dirpath, label, name + '.npy'),
+                          mmap_mode=mmap_mode)
+            for name in connection_dtype.names}
+
+
+def save_connectivity_manifest(dirpath, projections):
+    """Write the manifest of the projections saved in ``dirpath``.
+
+    Parameters
+    ----------
+
+    dirpath: str
+        Directory containing the connections of all projections.
+    projections: list[dict]
+        One entry per projection, in the order of the layers. Each entry
+        contains at least the ``label`` under which the connections were
+        saved, and the number of connections ``num_connections``.
+    """
+
+    import json
+
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    with open(os.path.join(dirpath, 'manifest.json'), str('w')) as f:
+        json.dump({'version': 1, 'columns': [
+            [name, np.lib.format.dtype_to_descr(connection_dtype[name])]
+            for name in connection_dtype.names],
+            'projections': projections}, f, indent=2)
+
+
+def load_connectivity_manifest(dirpath):
+    """Read the manifest written by `save_connectivity_manifest`.
+
+    Returns
+    -------
+
+    projections: Optional[list[dict]]
+        The projections stored in ``dirpath``, or ``None`` if there is no
+        manifest.
+    """
+
+    import json
+
+    filepath = os.path.join(dirpath, 'manifest.json')
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath) as f:
+        return json.load(f)['projections']
 
-def build_pooling(layer, delay):
-    """Build average pooling layer.
+
+def build_pooling(layer, delay, max2avg=False):
+    """Build pooling layer.
 
     Parameters
     ----------
@@ -1277,23 +2134,25 @@ def build_pooling(layer, delay):
         Parsed model layer.
     delay: float
         Synaptic delay.
+    max2avg: bool
+        If ``True``, max pooling layers are connected like average pooling
+        layers.
 
     Returns
     -------
 
-    connections: List[tuple]
-        A list where each entry is a tuple containing the source neuron index,
-        the target neuron index, the connection strength (weight), and the
-        synaptic ``delay``. The weight is given by :math:`\\frac{1}{k_x k_y}`,
-        where :math:`k_x, k_y` are the dimensions of the pooling kernel.
+    connections: ndarray
+        A structured array of dtype ``connection_dtype``, where each entry
+        contains the source neuron index, the target neuron index, the
+        connection strength (weight), and the synaptic ``delay``. For average
+        pooling, the weight is given by :math:`\\frac{1}{k_x k_y}`, where
+        :math:`k_x, k_y` are the dimensions of the pooling kernel (with
+        ``'same'`` padding, only the part of the kernel inside the feature
+        map is counted). For max pooling, the weight is 1; the target
+        simulator has to gate the connections so that only the maximally
+        active neuron in a pool passes its spikes.
     """
 
-    if layer.__class__.__name__ == 'MaxPooling2D':
-        import warnings
-
-        warnings.warn("Layer type 'MaxPooling' not supported yet. " +
-                      "Falling back on 'AveragePooling'.", RuntimeWarning)
-
     ii = 1 if keras.backend.image_data_format() == 'channels_first' else 0
 
     nx = layer.input_shape[2 + ii]  # Width of feature map
@@ -1304,25 +2163,270 @@ def build_pooling(layer, delay):
     sx = layer.strides[1]
     sy = layer.strides[0]
 
-    weight = 1 / (dx * dy)
+    if layer.padding == 'valid':
+        mx = (nx - dx) // sx + 1  # Number of columns in output filters
+        my = (ny - dy) // sy + 1  # Number of rows in output filters
+        px = py = 0
+    elif layer.padding == 'same':
+        mx = -(-nx // sx)
+        my = -(-ny // sy)
+        px = max((mx - 1) * sx + dx - nx, 0) // 2  # Zero-padding columns
+        py = max((my - 1) * sy + dy - ny, 0) // 2  # Zero-padding rows
+    else:
+        raise NotImplementedError("Border_mode {} not supported".format(
+            layer.padding))
 
-    connections = []
+    # Connections of a single feature map. Axes: output row, output column,
+    # pool row, pool column.
+    y_out = np.arange(my)[:, None, None, None]
+    x_out = np.arange(mx)[None, :, None, None]
+    y = y_out * sy - py + np.arange(dy)[None, None, :, None]
+    x = x_out * sx - px + np.arange(dx)[None, None, None, :]
+    is_valid = (0 <= y) & (y < ny) & (0 <= x) & (x < nx)
+    shape = is_valid.shape
+    source = (y * nx + x)[is_valid]
+    target = np.broadcast_to(y_out * mx + x_out, shape)[is_valid]
+    if get_type(layer) == 'MaxPooling2D' and not max2avg:
+        weight = 1
+    else:
+        weight = np.broadcast_to(1 / np.sum(is_valid, (2, 3), keepdims=True),
+                                 shape)[is_valid]
 
-    for fout in range(nz):
-        for y in range(0, ny - dy + 1, sy):
-            for x in range(0, nx - dx + 1, sx):
-                target = int(x / sx + y / sy * ((nx - dx) / sx + 1) +
-                             fout * nx * ny / (dx * dy))
-                for k in range(dy):
-                    source = x + (y + k) * nx + fout * nx * ny
-                    for l in range(dx):
-                        connections.append((source + l, target, weight, delay))
-        echo('.')
-    print('')
+    # Replicate for all feature maps.
+    fout = np.arange(nz)[:, None]
+    connections = np.empty(nz * len(source), connection_dtype)
+    connections['source'] = np.ravel(source + fout * nx * ny)
+    connections['target'] = np.ravel(target + fout * mx * my)
+    connections['weight'] = np.tile(weight, nz) if np.ndim(weight) else weight
+    connections['delay'] = delay
 
     return connections
 
 
+def build_maxpool_gates(connections, relay_weight, inhibition_weight):
+    """Build the connections of a gated max pooling layer.
+
+    For simulators that cannot gate the synapses of a pool directly, each
+    connection of the pool is routed through a gate neuron. Gate neuron ``c``
+    relays the spikes of the source neuron of connection ``c`` to its target
+    pooling neuron. The gates of a pool inhibit each other, so that the gate
+    of the most active neuron in the pool suppresses the others
+    (winner-take-all).
+
+    Parameters
+    ----------
+
+    connections: ndarray
+        Connections of the max pooling layer, as returned by `build_pooling`.
+    relay_weight: float
+        Weight from a source neuron to its gate. Has to be large enough that
+        every input spike triggers a spike of the gate.
+    inhibition_weight: float
+        Weight between the gates of a pool.
+
+    Returns
+    -------
+
+    input_connections: ndarray
+        Connections from the input layer of the pooling layer to the gates.
+    lateral_connections: ndarray
+        Connections between the gates of each pool.
+    output_connections: ndarray
+        Connections from the gates to the pooling layer.
+    """
+
+    num_gates = len(connections)
+    gates = np.arange(num_gates)
+
+    input_connections = np.empty(num_gates, connection_dtype)
+    input_connections['source'] = connections['source']
+    input_connections['target'] = gates
+    input_connections['weight'] = relay_weight
+    input_connections['delay'] = connections['delay']
+
+    output_connections = np.copy(connections)
+    output_connections['source'] = gates
+
+    # Connect all pairs of gates that share a pooling neuron.
+    order = np.argsort(connections['target'], kind='stable')
+    _, pool_starts, pool_sizes = np.unique(connections['target'][order],
+                                           return_index=True,
+                                           return_counts=True)
+    num_pairs_g = np.repeat(pool_sizes, pool_sizes)
+    pair_starts_g = np.cumsum(num_pairs_g) - num_pairs_g
+    offset = np.arange(np.sum(num_pairs_g)) - np.repeat(pair_starts_g,
+                                                        num_pairs_g)
+    source = np.repeat(order, num_pairs_g)
+    target = order[np.repeat(np.repeat(pool_starts, pool_sizes),
+                             num_pairs_g) + offset]
+    is_other = source != target
+    lateral_connections = np.empty(np.count_nonzero(is_other),
+                                   connection_dtype)
+    lateral_connections['source'] = source[is_other]
+    lateral_connections['target'] = target[is_other]
+    lateral_connections['weight'] = inhibition_weight
+    lateral_connections['delay'] = np.repeat(connections['delay'][order],
+                                             num_pairs_g)[is_other]
+
+    return input_connections, lateral_connections, output_connections
+
+
+class SparseSpiketrains(object):
+    """Spike trains of a layer in coordinate (COO) format.
+
+    Replaces the dense array of shape (`batch_size`, ``layer_shape``,
+    ``num_timesteps``) in ``spiketrains_n_b_l_t`` if the option
+    ``sparse_spiketrains`` is set. Only the nonzero entries are stored, as
+    arrays of batch index, flat neuron index, time step and value (usually
+    the spike time). The memory needed to record a layer is thus proportional
+    to the number of spikes, not to the number of neurons times the number of
+    time steps.
+
+    The recording code of the simulators assigns spikes with the same
+    indexing as for the dense array (see `__setitem__`). Each time step is
+    expected to be assigned at most once between two resets.
+
+    Parameters
+    ----------
+
+    shape: tuple
+        Shape of the equivalent dense array.
+    """
+
+    def __init__(self, shape):
+
+        self.shape = tuple(int(i) for i in shape)
+        self.ndim = len(self.shape)
+        self.num_neurons = int(np.prod(self.shape[1:-1]))
+        self._chunks = []
+
+    @classmethod
+    def from_dense(cls, spiketrains_b_l_t):
+        """Create the sparse representation of a dense array."""
+
+        spiketrains = cls(np.shape(spiketrains_b_l_t))
+        spiketrains[:] = spiketrains_b_l_t
+        return spiketrains
+
+    @property
+    def coords(self):
+        """The arrays of batch index, flat neuron index, time step and value
+        of all spikes, in the order in which they were added."""
+
+        if len(self._chunks) != 1:
+            self._chunks = [tuple(np.concatenate(c) for c in zip(
+                (np.zeros(0, 'int32'), np.zeros(0, 'int64'),
+                 np.zeros(0, 'int32'), np.zeros(0, 'float32')),
+                *self._chunks))]
+        return self._chunks[0]
+
+    def add(self, batch_idxs, neuron_idxs, steps, values):
+        """Append spikes, given by their coordinates and values."""
+
+        self._chunks.append((np.asarray(batch_idxs, 'int32'),
+                             np.asarray(neuron_idxs, 'int64'),
+                             np.asarray(steps, 'int32'),
+                             np.asarray(values, 'float32')))
+
+    def __setitem__(self, key, value):
+        """Add the nonzero entries of ``value`` at the position ``key``.
+
+        Supports the keys used to record spikes into dense arrays:
+        ``[:]`` (replaces all spikes), ``[Ellipsis, t]``, and
+        ``[b, Ellipsis, t]``, where ``b`` and ``t`` index the batch and the
+        time steps, respectively.
+        """
+
+        batch_size, num_timesteps = self.shape[0], self.shape[-1]
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) == 1:
+            self._chunks = []
+            batch_idxs = np.arange(batch_size)
+            steps = np.arange(num_timesteps)
+        else:
+            batch_idxs = np.arange(batch_size)[key[0]] if len(key) == 3 \
+                else np.arange(batch_size)
+            steps = np.arange(num_timesteps)[key[-1]]
+        value = np.asarray(value)
+        if np.ndim(batch_idxs) == 0:
+            value = np.expand_dims(value, 0)
+        if np.ndim(steps) == 0:
+            value = np.expand_dims(value, -1)
+        batch_idxs, steps = np.atleast_1d(batch_idxs, steps)
+        value = np.reshape(np.broadcast_to(
+            value, (len(batch_idxs),) + self.shape[1:-1] + (len(steps),)),
+            (len(batch_idxs), self.num_neurons, len(steps)))
+        b, l, t = np.nonzero(value)
+        self.add(batch_idxs[b], l, steps[t], value[b, l, t])
+
+    def __getitem__(self, idx):
+        """Return the dense spike trains of sample ``idx`` of the batch."""
+
+        b, l, t, v = self.coords
+        is_sample = b == idx
+        spiketrains_l_t = np.zeros((self.num_neurons, self.shape[-1]),
+                                   'float32')
+        spiketrains_l_t[l[is_sample], t[is_sample]] = v[is_sample]
+        return np.reshape(spiketrains_l_t, self.shape[1:])
+
+    def todense(self):
+        """Return the equivalent dense array."""
+
+        b, l, t, v = self.coords
+        spiketrains_b_l_t = np.zeros((self.shape[0], self.num_neurons,
+                                      self.shape[-1]), 'float32')
+        spiketrains_b_l_t[b, l, t] = v
+        return np.reshape(spiketrains_b_l_t, self.shape)
+
+    def count_nonzero(self):
+        """Return the total number of spikes."""
+
+        return sum(len(chunk[3]) for chunk in self._chunks)
+
+    def get_spikecounts_b_t(self, weights_l=None):
+        """Count the spikes per sample and time step.
+
+        Parameters
+        ----------
+
+        weights_l: Optional[Union[int, ndarray]]
+            If given, each spike is counted with the weight of its neuron,
+            e.g. the fanout to obtain synaptic operations.
+
+        Returns
+        -------
+
+        spikecounts_b_t: ndarray
+            Shape: (`batch_size`, ``num_timesteps``)
+        """
+
+        b, l, t, v = self.coords
+        batch_size, num_timesteps = self.shape[0], self.shape[-1]
+        weights = None
+        if weights_l is not None:
+            weights = np.ravel(weights_l)[l] if np.ndim(weights_l) \
+                else np.full(len(l), weights_l, float)
+        spikecounts = np.bincount(b * num_timesteps + t, weights,
+                                  batch_size * num_timesteps)
+        return np.reshape(spikecounts, (batch_size, num_timesteps))
+
+
+def to_sparse_spiketrains(spiketrains_b_l_t):
+    """Return ``spiketrains_b_l_t`` as `SparseSpiketrains`."""
+
+    if isinstance(spiketrains_b_l_t, SparseSpiketrains):
+        return spiketrains_b_l_t
+    return SparseSpiketrains.from_dense(spiketrains_b_l_t)
+
+
+def count_spikes(spiketrains_b_l_t):
+    """Return the number of spikes in dense or `SparseSpiketrains`."""
+
+    if isinstance(spiketrains_b_l_t, SparseSpiketrains):
+        return spiketrains_b_l_t.count_nonzero()
+    return np.count_nonzero(spiketrains_b_l_t)
+
+
 def spikecounts_to_rates(spikecounts_n_b_l_t):
     """Convert spiketrains to spikerates.
 
@@ -1358,7 +2462,7 @@ def spiketrains_to_rates(spiketrains_n_b_l_t, duration, spike_code):
     Parameters
     ----------
 
-    spiketrains_n_b_l_t: list[tuple[np.array, str]]
+    spiketrains_n_b_l_t: list[tuple[Union[np.array, SparseSpiketrains], str]]
 
     duration: int
         Duration of simulation.
@@ -1396,15 +2500,112 @@ def spiketrains_to_rates(spiketrains_n_b_l_t, duration, spike_code):
     else:
         f = t2r_mean_rate
 
+    def t2r_sparse(spiketrains, g):
+        # Same as applying ``g`` along the last axis, but computed from the
+        # coordinates of the spikes, grouped by neuron.
+        b, l, t, v = spiketrains.coords
+        keys = b * spiketrains.num_neurons + l
+        order = np.lexsort((t, keys))
+        keys, v = keys[order], v[order]
+        num = spiketrains.shape[0] * spiketrains.num_neurons
+        rates = np.zeros(num)
+        if g is t2r_mean_rate:
+            rates[:] = np.bincount(keys, minlength=num) / duration * \
+                np.sign(np.bincount(keys, v, num))
+        else:
+            keys_unique, first, counts = np.unique(keys, True,
+                                                   return_counts=True)
+            if g is t2r_ttfs:
+                rates[keys_unique] = 1. / v[first]
+            else:
+                is_odd = counts % 2 == 1
+                rates[keys_unique[is_odd]] = \
+                    1. / v[(first + counts - 1)[is_odd]]
+        return np.reshape(rates, spiketrains.shape[:-1])
+
+    def t2r(g, spiketrains_b_l_t):
+        if isinstance(spiketrains_b_l_t, SparseSpiketrains):
+            return t2r_sparse(spiketrains_b_l_t, g)
+        return np.apply_along_axis(g, -1, spiketrains_b_l_t)
+
     # For output layer, we always have multiple spikes (even with ttfs), so use
     # ``t2r_mean_rate``.
-    return [(np.apply_along_axis(f, -1, spiketrains_b_l_t), label)
+    return [(t2r(f, spiketrains_b_l_t), label)
             for spiketrains_b_l_t, label in spiketrains_n_b_l_t[:-1]] + \
-           [(np.apply_along_axis(
-               t2r_mean_rate, -1, spiketrains_n_b_l_t[-1][0]),
+           [(t2r(t2r_mean_rate, spiketrains_n_b_l_t[-1][0]),
              spiketrains_n_b_l_t[-1][1])]
 
 
+def get_cumulative_spikecounts(spiketrains_b_l_t):
+    """Count the spikes of each neuron up to and including each time step.
+
+    Parameters
+    ----------
+
+    spiketrains_b_l_t: ndarray
+        A batch of spike trains, where nonzero entries mark a spike. Shape:
+        (`batch_size`, ``layer_shape``, ``num_timesteps``)
+
+    Returns
+    -------
+
+    spikecounts_b_l_t: ndarray
+        Integer array of the same shape as ``spiketrains_b_l_t``, containing
+        the number of spikes a neuron has fired until each time step.
+    """
+
+    return np.cumsum(np.not_equal(spiketrains_b_l_t, 0), -1, dtype='int32')
+
+
+def get_spikecount_margin(spikecounts_b_l):
+    """Get the difference between the two largest spike counts per sample.
+
+    Parameters
+    ----------
+
+    spikecounts_b_l: ndarray
+        Spike counts of the output layer. Shape: (`batch_size`,
+        ``num_classes``)
+
+    Returns
+    -------
+
+    margin_b: ndarray
+        Spike count of the winning class minus that of the runner-up.
+    """
+
+    top2_b_l = np.partition(spikecounts_b_l, -2, -1)[:, -2:]
+    return top2_b_l[:, 1] - top2_b_l[:, 0]
+
+
+def update_confident_steps(confident_steps_b, spikecounts_b_l, margin):
+    """Count for how many consecutive time steps the output of each sample
+    has been decided.
+
+    A sample counts as decided in the current step if the spike count margin
+    between its top two classes exceeds ``margin``.
+
+    Parameters
+    ----------
+
+    confident_steps_b: ndarray
+        Number of consecutive decided steps before the current one.
+    spikecounts_b_l: ndarray
+        Spike counts of the output layer up to the current step.
+    margin: int
+        Spike count margin.
+
+    Returns
+    -------
+
+    confident_steps_b: ndarray
+        The updated number of consecutive decided steps.
+    """
+
+    return np.where(get_spikecount_margin(spikecounts_b_l) > margin,
+                    confident_steps_b + 1, 0)
+
+
 def get_sample_activity_from_batch(activity_batch, idx=0):
     """Return layer activity for sample ``idx`` of an ``activity_batch``.
     """
@@ -0,0 +1,249 @@
+# coding=utf-8
+
+"""Test the functions used to normalize the network parameters."""
+
+import os
+
+import keras
+import numpy as np
+import pytest
+
+from snntoolbox.conversion.utils import LogHistogram, get_scale_fac, \
+    get_activations_batch, get_activations_layer, get_activations_layers, \
+    ActivationCache, get_scale_facs_store_path, apply_scale_facs, \
+    get_channel_axis, get_scale_map, get_scale_fac_per_channel, \
+    balance_thresholds, update_histograms_per_channel
+from snntoolbox.utils.utils import import_configparser
+
+# Threshold balancing simulates the network with the INI simulator, which
+# requires multi-backend Keras.
+multi_backend_keras = pytest.mark.skipif(
+    tuple(int(v) for v in keras.__version__.split('.')[:2]) >= (2, 4),
+    reason="The INI simulator requires multi-backend Keras.")
+
+
+class TestLogHistogram:
+    """Test the streaming percentile estimate."""
+
+    @pytest.mark.parametrize('percentile', [50, 99, 99.9, 100])
+    def test_percentile(self, percentile):
+        activations = np.random.lognormal(0, 2, 100000) * \
+            (np.random.random_sample(100000) < 0.6)
+        activations[:100] *= -1
+        histogram = LogHistogram(64)
+        for batch in np.array_split(activations, 7):
+            histogram.update(batch)
+        # The estimate is the center of the bin containing the value at the
+        # lower rank of the interpolated percentile.
+        nonzero_activations = np.sort(activations[np.nonzero(activations)])
+        rank = int(percentile / 100 * (len(nonzero_activations) - 1))
+        assert np.isclose(histogram.percentile(percentile),
+                          nonzero_activations[rank], rtol=2 ** (1 / 64) - 1)
+        if percentile == 100:
+            assert histogram.percentile(percentile) == \
+                get_scale_fac(nonzero_activations, percentile)
+        assert np.isclose(histogram.sparsity,
+                          np.mean(activations == 0))
+
+    def test_merge(self):
+        activations = np.random.random_sample((2, 1000))
+        histogram = LogHistogram()
+        histogram.update(activations[0])
+        other = LogHistogram()
+        other.update(activations[1])
+        histogram.merge(other)
+        target = LogHistogram()
+        target.update(activations)
+        assert histogram.counts == target.counts
+        assert histogram.percentile(99) == target.percentile(99)
+
+    @pytest.mark.parametrize('axis', [1, 3])
+    def test_per_channel(self, axis):
+        activations = np.random.randn(4, 5, 6, 3) * \
+            (np.random.random_sample((4, 5, 6, 3)) < 0.5)
+        activations[..., 0] = 0
+        histograms = [LogHistogram() for _ in range(activations.shape[axis])]
+        for batch in np.array_split(activations, 2):
+            update_histograms_per_channel(histograms, batch, axis)
+        for c, histogram in enumerate(histograms):
+            target = LogHistogram()
+            for batch in np.array_split(activations, 2):
+                target.update(np.take(batch, c, axis))
+            assert histogram.counts == target.counts
+            assert histogram.num_values == target.num_values
+            assert histogram.num_nonzero == target.num_nonzero
+            assert (histogram.min, histogram.max) == (target.min, target.max)
+            assert histogram.percentile(99) == target.percentile(99)
+
+    def test_empty(self):
+        histogram = LogHistogram()
+        histogram.update(np.zeros(10))
+        assert histogram.percentile(99.9) == 1
+        assert histogram.sparsity == 1
+
+
+def test_get_activations_layers():
+    model = keras.models.Sequential([
+        keras.layers.Dense(6, activation='relu', input_shape=(4,)),
+        keras.layers.Dense(3, activation='relu')])
+    x = np.random.random_sample((25, 4))
+    activations_n = get_activations_layers(model, model.layers, x, 10)
+    for layer, activations in zip(model.layers, activations_n):
+        target = get_activations_layer(model.input, layer.output, x, 10)
+        assert np.allclose(activations, target, atol=1e-6)
+    activations_batch = get_activations_batch(model, x[:5])
+    assert [label for _, label in activations_batch] == \
+        [layer.name for layer in model.layers]
+    assert np.allclose(activations_batch[1][0], model.predict(x[:5]),
+                       atol=1e-6)
+
+
+def test_activation_cache(tmpdir):
+    model = keras.models.Sequential([
+        keras.layers.Dense(6, activation='relu', input_shape=(4,)),
+        keras.layers.Dense(3, activation='relu')])
+    x = np.random.random_sample((25, 4))
+    targets = get_activations_layers(model, model.layers, x, 10)
+    cache = ActivationCache(str(tmpdir), len(x), 10)
+    cache.fill(model, model.layers[:1], x)
+    # Interrupt the second layer after its first batch.
+    cache.manifest['layers'][model.layers[1].name] = {'batches': [0]}
+    cache._save_manifest()
+    layer_name = model.layers[1].name
+    np.save(cache.get_filepath(layer_name), np.concatenate(
+        [targets[1][:10], np.zeros_like(targets[1][10:])]))
+
+    cache = ActivationCache(str(tmpdir), len(x), 10)
+    assert cache.is_complete(model.layers[0].name)
+    assert cache.get_missing_batches(layer_name) == [1]
+    cache.fill(model, model.layers[1:], x)
+    restored = ActivationCache(str(tmpdir))
+    for layer, target in zip(model.layers, targets):
+        assert restored.is_complete(layer.name)
+        assert np.allclose(restored.load(layer.name), target, atol=1e-6)
+    # A different data set size invalidates the cache.
+    assert not ActivationCache(str(tmpdir), 30, 10).is_complete(layer_name)
+
+
+def test_scale_facs_store_path(tmpdir):
+    import snntoolbox
+    configparser = import_configparser()
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(snntoolbox.__file__),
+                             'config_defaults'))
+    config.set('paths', 'path_wd', str(tmpdir))
+    model = keras.models.Sequential([
+        keras.layers.Dense(3, activation='relu', input_shape=(4,))])
+    x_norm = np.random.random_sample((10, 4))
+    path = get_scale_facs_store_path(model, config, x_norm=x_norm)
+    assert os.path.dirname(path) == os.path.join(str(tmpdir), 'scale_facs')
+    assert get_scale_facs_store_path(model, config, x_norm=x_norm.copy()) \
+        == path
+    # Any change of the data, weights or settings gives a new key.
+    assert get_scale_facs_store_path(model, config, x_norm=x_norm[1:]) != \
+        path
+    config.set('normalization', 'percentile', '99')
+    path_99 = get_scale_facs_store_path(model, config, x_norm=x_norm)
+    assert path_99 != path
+    model.set_weights([w + 1 for w in model.get_weights()])
+    path_w = get_scale_facs_store_path(model, config, x_norm=x_norm)
+    assert path_w != path_99
+    # The cell parameters only matter if the thresholds are balanced.
+    config.set('cell', 'v_thresh', '0.5')
+    assert get_scale_facs_store_path(model, config, x_norm=x_norm) == path_w
+    config.set('normalization', 'threshold_balancing', 'True')
+    path_balanced = get_scale_facs_store_path(model, config, x_norm=x_norm)
+    for section, option, value in [('cell', 'v_thresh', '1'),
+                                   ('cell', 'tau_refrac', '1'),
+                                   ('cell', 'reset', 'Reset to zero'),
+                                   ('simulation', 'dt', '0.5')]:
+        config.set(section, option, value)
+        path = get_scale_facs_store_path(model, config, x_norm=x_norm)
+        assert path != path_balanced
+        path_balanced = path
+
+
+@multi_backend_keras
+def test_balance_thresholds(tmpdir):
+    from collections import OrderedDict
+    import snntoolbox
+    configparser = import_configparser()
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(snntoolbox.__file__),
+                             'config_defaults'))
+    config.set('paths', 'path_wd', str(tmpdir))
+    config.set('paths', 'log_dir_of_current_run', str(tmpdir))
+    config.set('normalization', 'calibration_duration', '50')
+    input_layer = keras.layers.Input(batch_shape=(4, 8))
+    layer = keras.layers.Dense(12, activation='relu',
+                               name='1Dense_12')(input_layer)
+    layer = keras.layers.Dense(4, activation='relu', name='2Dense_4')(layer)
+    model = keras.models.Model(input_layer, layer)
+    x_calib = np.random.random_sample((4, 8))
+    weights = model.get_weights()
+    scale_facs = OrderedDict([(model.layers[0].name, 1)])
+    for layer, activations in zip(model.layers[1:], get_activations_layers(
+            model, model.layers[1:], x_calib, 4)):
+        scale_facs[layer.name] = get_scale_fac(activations[activations > 0],
+                                               99.9)
+    balanced = balance_thresholds(model, config, x_calib, scale_facs)
+    assert all(np.array_equal(w, w_old) for w, w_old in
+               zip(model.get_weights(), weights))
+    # The neurons fire below the maximum rate, so their thresholds are
+    # lowered.
+    for name in ['1Dense_12', '2Dense_4']:
+        assert 0 < balanced[name] <= scale_facs[name]
+    assert balanced['2Dense_4'] < scale_facs['2Dense_4']
+
+
+def test_apply_scale_facs_per_channel():
+    inp = keras.layers.Input((6, 6, 2))
+    conv = keras.layers.Conv2D(3, 3, activation='relu')(inp)
+    depthwise = keras.layers.DepthwiseConv2D(
+        3, depth_multiplier=2, activation='relu')(
+        keras.layers.ZeroPadding2D()(conv))
+    flat_0 = keras.layers.Flatten()(
+        keras.layers.AveragePooling2D()(depthwise))
+    flat_1 = keras.layers.Flatten()(conv)
+    dense = keras.layers.Dense(4, activation='relu')(
+        keras.layers.Concatenate()([flat_0, flat_1]))
+    model = keras.models.Model(inp, dense)
+    for layer in model.layers:
+        if layer.weights:
+            # Use positive biases so that the scaling is not masked by
+            # the ReLU.
+            layer.set_weights([layer.get_weights()[0],
+                               np.random.random_sample(
+                                   layer.get_weights()[1].shape)])
+    x = np.random.random_sample((5, 6, 6, 2))
+    target = model.predict(x)
+    scale_facs = {model.layers[0].name: 1}
+    for layer in model.layers:
+        if layer.weights:
+            scale_facs[layer.name] = list(np.random.random_sample(
+                layer.output_shape[-1]) + 0.5)
+    apply_scale_facs(model, scale_facs)
+    assert np.allclose(model.predict(x) * scale_facs[model.layers[-1].name],
+                       target, rtol=1e-4, atol=1e-5)
+
+
+def test_scale_map_channels_first():
+    inp = keras.layers.Input((2, 4, 4))
+    conv = keras.layers.Conv2D(3, 3, data_format='channels_first')(inp)
+    flat = keras.layers.Flatten(data_format='channels_first')(conv)
+    model = keras.models.Model(inp, flat)
+    scale_facs = {model.layers[0].name: 1, model.layers[1].name: [1, 2, 3]}
+    assert get_channel_axis(model.layers[1]) == 0
+    # Flatten moves the channels last.
+    assert np.array_equal(get_scale_map(model.layers[2], model, scale_facs),
+                          np.tile([1, 2, 3], 4))
+
+
+def test_scale_fac_per_channel():
+    activations = np.random.random_sample((10, 4, 4, 3)) - 0.2
+    scale_facs = get_scale_fac_per_channel(activations, 99, -1)
+    for c, scale_fac in enumerate(scale_facs):
+        channel = activations[..., c]
+        assert scale_fac == get_scale_fac(channel[np.nonzero(channel)], 99)
+    assert np.allclose(get_scale_fac_per_channel(
+        np.moveaxis(activations, -1, 1), 99, 0), scale_facs)
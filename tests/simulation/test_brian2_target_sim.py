@@ -0,0 +1,105 @@
+# coding=utf-8
+
+"""Test building and simulating spiking networks with Brian2."""
+
+import os
+import shutil
+
+import keras
+import numpy as np
+import pytest
+
+from snntoolbox.bin.utils import update_setup, import_target_sim
+from snntoolbox.utils.utils import import_configparser
+
+pytest.importorskip('brian2')
+
+
+def get_snn(path_wd, duration, standalone=False):
+    path_wd = str(path_wd)
+    configparser = import_configparser()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'paths': {'path_wd': path_wd, 'dataset_path': path_wd,
+                  'filename_ann': 'ann'},
+        'tools': {'evaluate_ann': False, 'normalize': False},
+        'simulation': {'simulator': 'brian2', 'duration': duration,
+                       'batch_size': 1, 'num_to_test': 1,
+                       'brian2_standalone': standalone}})
+    with open(os.path.join(path_wd, 'ann.h5'), 'w'):
+        pass
+    for name in ['x_test', 'y_test']:
+        np.savez(os.path.join(path_wd, name), np.zeros(1))
+    config_filepath = os.path.join(path_wd, 'config')
+    with open(config_filepath, 'w') as configfile:
+        config.write(configfile)
+    config = update_setup(config_filepath)
+    return import_target_sim(config).SNN(config)
+
+
+class TestMaxPooling:
+    """Test gating the synapses of a max pooling layer."""
+
+    @pytest.mark.parametrize('x_l', [[0.5, 0.3, 0.2, 0.1],
+                                     [0.5, 0.5, 0.2, 0.1],
+                                     [0.5, 0.5, 0.5, 0.5]])
+    def test_rate(self, tmpdir, x_l):
+        duration = 100
+        layer = keras.layers.MaxPooling2D(name='0MaxPooling2D_1x1x1')
+        layer(keras.layers.Input(batch_shape=(1, 2, 2, 1)))
+        snn = get_snn(tmpdir, duration)
+        # Assemble the network layer by layer, as in `AbstractSNN.build`.
+        snn.add_input_layer((1, 2, 2, 1))
+        snn.add_layer(layer)
+        snn.build_pooling(layer)
+        snn.num_classes = 1
+        snn.compile()
+        snn.init_cells()
+        output_b_l_t = snn.simulate(x_b_l=np.reshape(x_l, (1, 2, 2, 1)))
+        # The pooling neuron passes on the spikes of the most active input
+        # neuron, also if several neurons are equally active.
+        assert abs(output_b_l_t[0, 0, -1] - max(x_l) * duration) <= 1
+
+
+@pytest.mark.skipif(shutil.which('g++') is None and
+                    shutil.which('c++') is None,
+                    reason="Standalone mode requires a C++ compiler.")
+class TestStandalone:
+    """Test running a network as compiled C++ project."""
+
+    def test_matches_runtime(self, tmpdir):
+        duration = 50
+        x_b_l = np.array([[0.1, 0.4, 0.8, 0.2]])
+        inputs = keras.layers.Input(batch_shape=(1, 4))
+        outputs = keras.layers.Dense(3, name='1Dense_3')(inputs)
+        model = keras.models.Model(inputs, outputs)
+        model.set_weights([np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1],
+                                     [1, 1, 0]]), np.zeros(3)])
+
+        def build(standalone):
+            snn = get_snn(tmpdir, duration, standalone)
+            snn.parsed_model = model
+            snn.add_input_layer((1, 4))
+            snn.add_layer(model.layers[1])
+            snn.build_dense(model.layers[1])
+            snn.num_classes = 3
+            snn.compile()
+            snn.init_cells()
+            return snn
+
+        output_b_l_t = {}
+        for standalone in [False, True]:
+            snn = build(standalone)
+            output_b_l_t[standalone] = snn.simulate(x_b_l=x_b_l)
+            snn.end_sim()
+        assert np.array_equal(output_b_l_t[True][..., -1],
+                              output_b_l_t[False][..., -1])
+        assert np.any(output_b_l_t[True] > 0)
+
+        # A second network of the same model reuses the compiled project,
+        # and the runtime device is active again afterwards.
+        standalone_dir = snn.standalone_dir
+        snn = build(True)
+        assert snn.get_standalone_dir() == standalone_dir
+        snn.end_sim()
+        assert snn.sim.get_device().__class__.__name__ == 'RuntimeDevice'
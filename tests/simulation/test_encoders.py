@@ -0,0 +1,83 @@
+# coding=utf-8
+
+"""Test input encoders and the encoding cache."""
+
+import numpy as np
+import pytest
+
+from snntoolbox.simulation.encoders import encoders, EncodingCache
+
+
+@pytest.mark.parametrize('name', ['rate', 'poisson', 'latency', 'burst'])
+def test_chunks_match_full_encoding(name):
+    encoder = encoders[name](50)
+    x_b_l = np.random.random_sample((2, 4, 4, 1))
+    input_t_b_l = encoder.encode(x_b_l, 50, [3, 8])
+    assert input_t_b_l.shape == (50,) + x_b_l.shape
+    chunks = [encoder.encode(x_b_l, 10, [3, 8], t) for t in range(0, 50, 10)]
+    assert np.array_equal(np.concatenate(chunks), input_t_b_l)
+
+
+def test_latency():
+    encoder = encoders['latency'](11)
+    x_b_l = np.array([[1, 0.5, 0]])
+    input_t_b_l = encoder.encode(x_b_l, 11)
+    assert np.array_equal(np.flatnonzero(input_t_b_l[:, 0, 0]), [0])
+    assert np.array_equal(np.flatnonzero(input_t_b_l[:, 0, 1]), [5])
+    assert not np.any(input_t_b_l[:, 0, 2])
+
+
+def test_burst():
+    encoder = encoders['burst'](50, max_num_spikes=4, min_isi=2, max_isi=10)
+    input_t_b_l = encoder.encode(np.array([[1, 0.5, 0]]), 50)
+    assert np.array_equal(np.flatnonzero(input_t_b_l[:, 0, 0]), [0, 2, 4, 6])
+    assert np.array_equal(np.flatnonzero(input_t_b_l[:, 0, 1]), [0, 6])
+    assert not np.any(input_t_b_l[:, 0, 2])
+
+
+def test_non_positive_max():
+    for name in ['latency', 'burst']:
+        encoder = encoders[name](10)
+        for x_b_l in [np.zeros((1, 3)), -np.ones((1, 3))]:
+            input_t_b_l = encoder.encode(x_b_l, 10)
+            assert np.all(np.isfinite(input_t_b_l))
+            assert not np.any(input_t_b_l)
+
+
+@pytest.mark.parametrize('on_disk', [False, True])
+def test_cache(tmpdir, on_disk):
+    encoder = encoders['poisson'](30, seed=1)
+    cache = EncodingCache(encoder, str(tmpdir) if on_disk else None)
+    x_b_l = np.random.random_sample((3, 8))
+    target = encoder.encode(x_b_l, 30, [0, 1, 2])
+    assert np.array_equal(cache.encode(x_b_l, 30, [0, 1, 2]), target)
+    # Cached samples are not encoded again, and can be requested from any
+    # time step.
+    encode = encoder.encode
+    encoder.encode = None
+    assert np.array_equal(cache.encode(x_b_l, 10, [0, 1, 2], [0, 5, 20]),
+                          np.stack([target[0:10, 0], target[5:15, 1],
+                                    target[20:30, 2]], 1))
+    if on_disk:
+        restored = EncodingCache(encoder, str(tmpdir))
+        assert np.array_equal(restored.encode(x_b_l, 30, [0, 1, 2]), target)
+    encoder.encode = encode
+    # Changing a sample or the batch maximum encodes the samples again.
+    x_max = np.max(x_b_l)
+    x_b_l[0] = x_b_l[0] / 2 + x_max / 2
+    assert np.array_equal(cache.encode(x_b_l, 30, [0, 1, 2]),
+                          encoder.encode(x_b_l, 30, [0, 1, 2]))
+    assert np.array_equal(cache.encode(x_b_l[1:], 30, [1, 2], x_max=x_max),
+                          target[:, 1:])
+    assert np.array_equal(cache.encode(x_b_l[1:], 30, [1, 2]),
+                          encoder.encode(x_b_l[1:], 30, [1, 2]))
+
+
+def test_cache_eviction():
+    encoder = encoders['latency'](10)
+    x_b_l = np.random.random_sample((4, 5))
+    num_bytes = 10 * 5 * 4
+    cache = EncodingCache(encoder, max_bytes=2 * num_bytes)
+    cache.encode(x_b_l, 10, [0, 1, 2, 3], x_max=1)
+    assert len(cache._cache) == 2
+    assert cache._num_bytes == 2 * num_bytes
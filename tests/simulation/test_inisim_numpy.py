@@ -0,0 +1,191 @@
+# coding=utf-8
+
+"""Test event-driven layers of the NumPy INI backend."""
+
+import numpy as np
+import pytest
+
+from snntoolbox.simulation.backends.inisim import temporal_mean_rate_numpy \
+    as sim
+
+
+def conv2d_dense(x, kernel, strides, padding, depthwise=False):
+    """Reference convolution that evaluates every kernel position."""
+
+    batch_size, rows, cols, channels = x.shape
+    ky, kx = kernel.shape[:2]
+    if padding == 'same':
+        out_rows = -(-rows // strides[0])
+        out_cols = -(-cols // strides[1])
+        top = sim.get_same_padding(rows, out_rows, ky, strides[0])
+        left = sim.get_same_padding(cols, out_cols, kx, strides[1])
+        x = np.pad(x, ((0, 0), (top, ky), (left, kx), (0, 0)), 'constant')
+    else:
+        out_rows = (rows - ky) // strides[0] + 1
+        out_cols = (cols - kx) // strides[1] + 1
+    if depthwise:
+        kernel = np.reshape(kernel, (ky, kx, channels, -1))
+    out = []
+    for i in range(out_rows):
+        row = []
+        for j in range(out_cols):
+            patch = x[:, i * strides[0]:i * strides[0] + ky,
+                      j * strides[1]:j * strides[1] + kx]
+            if depthwise:
+                row.append(np.reshape(np.einsum('byxc,yxcm->bcm', patch,
+                                                kernel), (batch_size, -1)))
+            else:
+                row.append(np.einsum('byxc,yxcf->bf', patch, kernel))
+        out.append(row)
+    return np.transpose(out, (2, 0, 1, 3))
+
+
+def get_spikes(shape, rate=0.1):
+    return (np.random.random_sample(shape) < rate).astype('float32')
+
+
+class TestScatterConv2D:
+    """Test that the sparse convolution equals the dense convolution."""
+
+    @pytest.mark.parametrize('strides', [(1, 1), (2, 2), (2, 1)])
+    @pytest.mark.parametrize('padding', ['valid', 'same'])
+    @pytest.mark.parametrize('depthwise', [False, True])
+    def test_matches_dense(self, strides, padding, depthwise):
+        x = get_spikes((2, 9, 8, 3))
+        kernel = np.random.randn(3, 3, 3, 2).astype('float32')
+        target = conv2d_dense(x, kernel, strides, padding, depthwise)
+        offsets = (0, 0) if padding == 'valid' else tuple(
+            sim.get_same_padding(x.shape[i + 1], target.shape[i + 1], 3,
+                                 strides[i]) for i in range(2))
+        out = sim.scatter_conv2d(x, kernel, strides, offsets,
+                                 target.shape[1:], depthwise)
+        assert np.allclose(out, target, atol=1e-5)
+
+    def test_no_spikes(self):
+        out = sim.scatter_conv2d(np.zeros((2, 5, 5, 3), 'float32'),
+                                 np.ones((3, 3, 3, 4), 'float32'), (1, 1),
+                                 (0, 0), (3, 3, 4))
+        assert not np.any(out)
+
+
+class TestSpikeLayers:
+    """Test neuron dynamics of the NumPy INI backend."""
+
+    def test_dense_scatter(self):
+        x = get_spikes((4, 50))
+        kernel = np.random.randn(50, 10).astype('float32')
+        assert np.allclose(sim.scatter_dense(x, kernel), np.dot(x, kernel),
+                           atol=1e-5)
+
+    @pytest.mark.parametrize('reset', ['Reset by subtraction',
+                                       'Reset to zero', 'Reset by modulo'])
+    def test_reset_mechanism(self, reset):
+        layer = sim.SpikeDense(kernel=np.eye(2), name='dense',
+                               inbound=['input'], output_shape=(2,),
+                               v_thresh=1, reset=reset, record_spiketrain=True)
+        layer.init_state(1)
+        spikes = layer(np.array([[2.5, 0.5]], 'float32'), 1)
+        assert np.array_equal(spikes, [[1, 0]])
+        assert np.array_equal(layer.spiketrain, [[1, 0]])
+        expected = {'Reset by subtraction': 1.5, 'Reset to zero': 0,
+                    'Reset by modulo': 0.5}[reset]
+        assert np.allclose(layer.mem, [[expected, 0.5]])
+
+    def test_network_rates(self):
+        """A two-layer network with constant input fires at rates
+        proportional to the ReLU activations."""
+
+        num_timesteps = 1000
+        x = np.random.random_sample((3, 6)).astype('float32')
+        w1 = np.random.random_sample((6, 8)).astype('float32') / 6
+        w2 = np.random.random_sample((8, 4)).astype('float32') / 8
+        layers = [sim.SpikeDense(kernel=w1, name='d1', inbound=['input'],
+                                 output_shape=(8,)),
+                  sim.SpikeDense(kernel=w2, name='d2', inbound=['d1'],
+                                 output_shape=(4,))]
+        snn = sim.SpikingNetwork(layers, 'input', 3)
+        snn.set_constant_input(True)
+        counts = np.zeros((3, 4))
+        for t in range(num_timesteps):
+            counts += snn.step(x, t + 1) > 0
+        target = np.dot(np.dot(x, w1), w2)
+        assert np.allclose(counts / num_timesteps, target, atol=0.01)
+
+
+class TestSpikingNetwork:
+    """Test storing and running a network without Keras."""
+
+    @staticmethod
+    def get_network():
+        kwargs = {'input_shape': (6, 6, 2), 'data_format': 'channels_last',
+                  'strides': (1, 1)}
+        layers = [
+            sim.SpikeConv2D(kernel=np.random.randn(3, 3, 2, 4) / 4,
+                            bias=np.random.randn(4) / 10, padding='same',
+                            name='conv', inbound=['input'],
+                            output_shape=(6, 6, 4), **kwargs),
+            sim.SpikeAveragePooling2D(pool_size=(2, 2), name='pool',
+                                      inbound=['conv'], padding='valid',
+                                      output_shape=(3, 3, 4),
+                                      **dict(kwargs, input_shape=(6, 6, 4),
+                                             strides=(2, 2))),
+            sim.SpikeFlatten(name='flatten', inbound=['pool'],
+                             output_shape=(36,)),
+            sim.SpikeDense(kernel=np.random.randn(36, 3) / 6,
+                           name='dense', inbound=['flatten'],
+                           output_shape=(3,), reset='Reset to zero')]
+        return sim.SpikingNetwork(layers, 'input', 2)
+
+    def test_save_load(self, tmpdir):
+        snn = self.get_network()
+        x = np.random.random_sample((2, 6, 6, 2))
+        target = snn.run(x, 50)
+        filepath = str(tmpdir.join('snn.npz'))
+        snn.save(filepath)
+        restored = sim.load_network(filepath)
+        assert [layer.get_config() for layer in restored.layers] == \
+            [layer.get_config() for layer in snn.layers]
+        assert np.array_equal(restored.run(x, 50), target)
+        assert restored.batch_size == 2
+
+    def test_select(self):
+        snn = self.get_network()
+        x = np.random.random_sample((2, 6, 6, 2))
+        snn.set_constant_input(True)
+        for t in range(20):
+            snn.step(x, t + 1)
+        mem = [layer.mem[1] for layer in snn.spiking_layers]
+        snn.select(np.array([False, True]))
+        assert snn.batch_size == 1
+        assert all(np.array_equal(layer.mem[0], m) for layer, m in
+                   zip(snn.spiking_layers, mem))
+        assert snn.step(x[1:], 21).shape == (1, 3)
+
+    def test_restore_batch(self):
+        snn = self.get_network()
+        snn.set_batch_size(3)
+        x = np.random.random_sample((3, 6, 6, 2))
+        for t in range(10):
+            snn.step(x, t + 1)
+        mem_0 = [np.copy(layer.mem[0]) for layer in snn.spiking_layers]
+        snn.select(np.array([1, 2]))
+        for t in range(10, 15):
+            snn.step(x[1:], t + 1)
+        snn.select(np.array([True, False]))
+        mem_1 = [np.copy(layer.mem[0]) for layer in snn.spiking_layers]
+        snn.restore_batch()
+        assert snn.batch_size == 3
+        for layer, m0, m1 in zip(snn.spiking_layers, mem_0, mem_1):
+            assert np.array_equal(layer.mem[0], m0)
+            assert np.array_equal(layer.mem[1], m1)
+        assert snn.step(x, 16).shape == (3, 3)
+
+    def test_no_keras_import(self):
+        import subprocess
+        import sys
+        code = "import sys; " \
+               "import snntoolbox.simulation.backends.inisim." \
+               "temporal_mean_rate_numpy; " \
+               "assert 'keras' not in sys.modules; " \
+               "assert 'tensorflow' not in sys.modules"
+        subprocess.check_call([sys.executable, '-c', code])
@@ -0,0 +1,141 @@
+# coding=utf-8
+
+"""Test the INI simulator with temporal mean rate code and Tensorflow
+backend."""
+
+import os
+
+import keras
+import numpy as np
+import pytest
+
+from snntoolbox.bin.utils import update_setup, import_target_sim
+from snntoolbox.utils.utils import import_configparser
+
+# The spiking layers register their state updates with the API of
+# multi-backend Keras, which was removed in Keras 2.4.
+multi_backend_keras = pytest.mark.skipif(
+    tuple(int(v) for v in keras.__version__.split('.')[:2]) >= (2, 4),
+    reason="The INI simulator requires multi-backend Keras.")
+
+
+def get_config(path_wd, **updates):
+    path_wd = str(path_wd)
+    configparser = import_configparser()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'paths': {'path_wd': path_wd, 'dataset_path': path_wd,
+                  'filename_ann': 'ann'},
+        'tools': {'evaluate_ann': False, 'normalize': False},
+        'simulation': {'simulator': 'INI', 'duration': 30, 'batch_size': 2,
+                       'num_to_test': 2, 'keras_backend': 'tensorflow'}})
+    config.read_dict(updates)
+    with open(os.path.join(path_wd, 'ann.h5'), 'w'):
+        pass
+    for name in ['x_test', 'y_test']:
+        np.savez(os.path.join(path_wd, name), np.zeros(1))
+    config_filepath = os.path.join(path_wd, 'config')
+    with open(config_filepath, 'w') as configfile:
+        config.write(configfile)
+    return update_setup(config_filepath)
+
+
+def get_parsed_model(batch_size=2):
+    input_layer = keras.layers.Input(batch_shape=(batch_size, 8))
+    layer = keras.layers.Dense(12, activation='relu',
+                               name='1Dense_12')(input_layer)
+    layer = keras.layers.Dense(4, activation='relu', name='2Dense_4')(layer)
+    return keras.models.Model(input_layer, layer)
+
+
+def get_snn(config, parsed_model):
+    snn = import_target_sim(config).SNN(config)
+    snn.build(parsed_model)
+    snn.init_log_vars()
+    return snn
+
+
+@multi_backend_keras
+class TestFusedSteps:
+    """Test simulating chunks of time steps in one compiled call."""
+
+    def test_matches_per_step(self, tmpdir):
+        parsed_model = get_parsed_model()
+        x_b_l = np.random.random_sample((2, 8))
+        kwargs = {'x_b_l': x_b_l, 'truth_b': np.array([0, 1])}
+        log_vars = {'output': {'log_vars': {'spiketrains_n_b_l_t',
+                                            'mem_n_b_l_t'}}}
+
+        snn = get_snn(get_config(tmpdir.mkdir('step'), **log_vars),
+                      parsed_model)
+        target = snn.simulate(**kwargs)
+        spiketrains_n_b_l_t = [s[0].copy() for s in snn.spiketrains_n_b_l_t]
+
+        fused_config = get_config(tmpdir.mkdir('fused'),
+                                  simulation={'fused_steps': 7}, **log_vars)
+        fused_snn = get_snn(fused_config, parsed_model)
+        assert np.array_equal(fused_snn.simulate(**kwargs), target)
+        for spiketrains_b_l_t, target_b_l_t in zip(
+                fused_snn.spiketrains_n_b_l_t, spiketrains_n_b_l_t):
+            assert np.array_equal(spiketrains_b_l_t[0], target_b_l_t)
+
+        # The layers apply their updates eagerly only inside the fused
+        # function, so the same network can be simulated step by step.
+        assert not any(getattr(layer, 'eager_updates', False)
+                       for layer in fused_snn.snn.layers)
+        fused_snn.reset(0)
+        fused_snn.reset_log_vars()
+        fused_snn._num_fused_steps = 0
+        assert np.array_equal(fused_snn.simulate(**kwargs), target)
+
+
+class TestRecordOnDevice:
+    """Test recording state variables into buffers on the device."""
+
+    @pytest.mark.parametrize('record_every', [1, 3])
+    def test_record(self, tmpdir, record_every):
+        import tensorflow as tf
+        from snntoolbox.simulation.backends.inisim import \
+            temporal_mean_rate_tensorflow as inisim
+
+        config = get_config(tmpdir, output={'record_every': record_every})
+        layer = inisim.SpikeLayer(config=config)
+        layer.eager_updates = True
+        layer.time = tf.Variable(0.)
+        num_timesteps = 10
+        num_slots = -(-num_timesteps // record_every)
+        buffer = tf.Variable(np.zeros((num_slots + 1, 2, 3), 'float32'))
+        values_t_b_l = np.random.random_sample((num_timesteps, 2, 3))
+        for t, value_b_l in enumerate(values_t_b_l):
+            layer.time.assign((t + 1) * layer.dt)
+            layer.record(buffer, tf.constant(value_b_l, tf.float32))
+        assert np.allclose(buffer.numpy()[:num_slots],
+                           values_t_b_l[::record_every])
+
+    @multi_backend_keras
+    @pytest.mark.parametrize('record_every', [1, 3])
+    def test_matches_get_value(self, tmpdir, record_every):
+        parsed_model = get_parsed_model()
+        kwargs = {'x_b_l': np.random.random_sample((2, 8)),
+                  'truth_b': np.array([0, 1])}
+        output = {'log_vars': {'spiketrains_n_b_l_t', 'mem_n_b_l_t'}}
+
+        snn = get_snn(get_config(tmpdir.mkdir('host'), output=output),
+                      parsed_model)
+        target = snn.simulate(**kwargs)
+
+        device_output = dict(output, record_on_device=True,
+                             record_every=record_every,
+                             record_layers={'2Dense_4'})
+        device_snn = get_snn(get_config(tmpdir.mkdir('device'),
+                                        output=device_output), parsed_model)
+        assert np.array_equal(device_snn.simulate(**kwargs), target)
+        for variables, target_variables in [
+                (device_snn.spiketrains_n_b_l_t, snn.spiketrains_n_b_l_t),
+                (device_snn.mem_n_b_l_t, snn.mem_n_b_l_t)]:
+            (dense_1, _), (dense_2, _) = variables
+            _, (target_2, _) = target_variables
+            # Only the selected layer and time steps are recorded.
+            assert not np.any(dense_1)
+            assert np.allclose(dense_2[..., ::record_every],
+                               target_2[..., ::record_every])
@@ -0,0 +1,26 @@
+# coding=utf-8
+
+"""Test functions shared by the Tensorflow backends of the INI simulator."""
+
+import numpy as np
+import tensorflow as tf
+
+from snntoolbox.simulation.backends.inisim.utils import reset_state
+
+
+class TestResetState:
+    """Test resetting state variables on the device."""
+
+    def test_reset_all(self):
+        variable = tf.Variable(np.ones((3, 2, 2), 'float32'))
+        reset_state(variable, -1)
+        assert np.array_equal(variable.numpy(), -np.ones((3, 2, 2)))
+
+    def test_reset_masked(self):
+        value = np.random.random_sample((3, 2, 2)).astype('float32')
+        variable = tf.Variable(value)
+        mask_b = np.array([True, False, True])
+        reset_state(variable, mask_b=mask_b)
+        target = value.copy()
+        target[mask_b] = 0
+        assert np.array_equal(variable.numpy(), target)
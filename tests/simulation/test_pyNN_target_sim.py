@@ -0,0 +1,75 @@
+# coding=utf-8
+
+"""Test building, saving and loading spiking networks with pyNN.
+
+The tests run on the Brian2 backend of pyNN, which does not need a compiled
+simulator.
+"""
+
+import os
+
+import keras
+import numpy as np
+import pytest
+
+from snntoolbox.bin.utils import update_setup
+from snntoolbox.utils.utils import import_configparser
+
+pytest.importorskip('pyNN.brian2')
+
+
+def get_snn(path_wd):
+    from snntoolbox.simulation.target_simulators import pyNN_target_sim
+
+    path_wd = str(path_wd)
+    configparser = import_configparser()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'paths': {'path_wd': path_wd, 'dataset_path': path_wd,
+                  'filename_ann': 'ann'},
+        'tools': {'evaluate_ann': False, 'normalize': False},
+        'simulation': {'simulator': 'nest', 'duration': 50, 'batch_size': 1,
+                       'num_to_test': 1}})
+    with open(os.path.join(path_wd, 'ann.h5'), 'w'):
+        pass
+    for name in ['x_test', 'y_test']:
+        np.savez(os.path.join(path_wd, name), np.zeros(1))
+    config_filepath = os.path.join(path_wd, 'config')
+    with open(config_filepath, 'w') as configfile:
+        config.write(configfile)
+    config = update_setup(config_filepath)
+    config.set('restrictions', 'simulators_pyNN', str({'brian2'}))
+    config.set('simulation', 'simulator', 'brian2')
+    return pyNN_target_sim.SNN(config)
+
+
+def get_connections(projection):
+    return sorted(map(tuple, projection.get(['weight', 'delay'],
+                                            format='list')))
+
+
+class TestMaxPooling:
+    """Test routing max pooling layers through gate neurons."""
+
+    def test_save_load(self, tmpdir):
+        layer = keras.layers.MaxPooling2D(name='1MaxPooling2D_2x2x2')
+        layer(keras.layers.Input(batch_shape=(1, 4, 4, 2)))
+        snn = get_snn(tmpdir)
+        snn.add_input_layer((1, 4, 4, 2))
+        snn.add_layer(layer)
+        snn.build_pooling(layer)
+        assert len(snn.maxpool_gates) == 1
+        assert len(snn.maxpool_projections) == 3
+        snn.save(str(tmpdir), 'snn')
+
+        restored = get_snn(tmpdir)
+        restored.load(str(tmpdir), 'snn')
+        assert [population.label for population in restored.layers] == \
+            [population.label for population in snn.layers]
+        # The gates are rebuilt from the saved pooling connections.
+        assert len(restored.connections) == 0
+        assert [gates.size for gates in restored.maxpool_gates] == \
+            [gates.size for gates in snn.maxpool_gates]
+        for projection, target in zip(restored.maxpool_projections,
+                                      snn.maxpool_projections):
+            assert get_connections(projection) == get_connections(target)
@@ -0,0 +1,423 @@
+# coding=utf-8
+
+"""Test common functions for spiking simulators."""
+
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from snntoolbox.simulation.utils import AbstractSNN, \
+    get_cumulative_spikecounts, \
+    get_spikecount_margin, update_confident_steps, get_poisson_frames, \
+    build_convolution, build_dense, get_flatten_permutation, build_pooling, \
+    build_maxpool_gates, iter_dense_connections, replicate_connections, \
+    connection_dtype, \
+    ConnectionWriter, save_connections, load_connections, \
+    save_connectivity_manifest, load_connectivity_manifest, \
+    SparseSpiketrains, spiketrains_to_rates, get_layer_synaptic_operations
+
+
+class TestCumulativeSpikecounts:
+    """Test counting output spikes over time."""
+
+    def test_matches_count_nonzero(self):
+        spiketrains_b_l_t = np.random.randint(0, 2, (3, 5, 20)) * \
+            np.arange(1, 21)
+        spikecounts_b_l_t = get_cumulative_spikecounts(spiketrains_b_l_t)
+        target = np.zeros_like(spikecounts_b_l_t)
+        for t in range(spiketrains_b_l_t.shape[-1]):
+            target[:, :, t] = np.count_nonzero(
+                spiketrains_b_l_t[:, :, :t + 1], -1)
+        assert spikecounts_b_l_t.dtype == np.int32
+        assert np.array_equal(spikecounts_b_l_t, target)
+
+    def test_benchmark_imagenet_output_layer(self):
+        num_classes = 1000
+        num_timesteps = 2000
+        spiketrains_b_l_t = np.random.random_sample(
+            (1, num_classes, num_timesteps)) < 0.05
+        t_start = time.time()
+        spikecounts_b_l_t = get_cumulative_spikecounts(spiketrains_b_l_t)
+        assert time.time() - t_start < 5
+        assert np.array_equal(spikecounts_b_l_t[..., -1],
+                              np.count_nonzero(spiketrains_b_l_t, -1))
+
+
+class TestEarlyExit:
+    """Test tracking whether the output of a sample has been decided."""
+
+    def test_spikecount_margin(self):
+        spikecounts_b_l = np.array([[3, 7, 1], [4, 4, 0], [0, 0, 2]])
+        assert np.array_equal(get_spikecount_margin(spikecounts_b_l),
+                              [4, 0, 2])
+
+    def test_confident_steps(self):
+        spikecounts_b_l = np.array([[3, 7, 1], [4, 4, 0], [0, 0, 2]])
+        confident_steps_b = update_confident_steps(np.array([5, 5, 0]),
+                                                   spikecounts_b_l, 2)
+        assert np.array_equal(confident_steps_b, [6, 0, 0])
+
+
+class TestContinuousBatching:
+    """Test refilling the slots of a batch with new samples."""
+
+    @staticmethod
+    def get_stub(margin, num_to_test=5, batch_size=2, num_timesteps=4):
+        import configparser
+        config = configparser.ConfigParser()
+        config.read_dict({
+            'input': {'dataset_format': 'npz'},
+            'normalization': {'online_normalization': False},
+            'simulation': {'num_to_test': num_to_test,
+                           'batch_size': batch_size,
+                           'early_exit_margin': margin,
+                           'early_exit_patience': 1}})
+        stub = SimpleNamespace(
+            config=config, batch_size=batch_size, _batch_size=batch_size,
+            parsed_model=SimpleNamespace(input_shape=(None, 3)),
+            num_classes=3, top_k=2, _spiking_input=False, input_encoder=None,
+            _dt=0.1, _num_timesteps=num_timesteps, _plot_keys=set(),
+            _log_keys=set(), _num_poisson_events_per_sample=-1, times=[],
+            resets=[], inputs=[])
+
+        def simulate_step(input_b_l, t):
+            # The output neuron of the class encoded in the input spikes.
+            stub.times.append(t)
+            stub.inputs.append(np.copy(input_b_l))
+            return input_b_l
+
+        def reset_slots(mask_b):
+            stub.resets.append(np.copy(mask_b))
+
+        stub.simulate_step = simulate_step
+        stub.reset_slots = reset_slots
+        return stub
+
+    @pytest.mark.parametrize('margin, num_steps', [(0, 12), (1, 6)])
+    def test_run(self, tmpdir, margin, num_steps):
+        stub = self.get_stub(margin)
+        x_test = np.eye(3)[[0, 1, 2, 0, 1]]
+        y_test = np.eye(3)[[0, 1, 2, 0, 2]]
+        acc = AbstractSNN.run_continuous(stub, x_test, y_test, None,
+                                         str(tmpdir))
+        assert acc == 0.8
+        # Two slots are busy until the last sample, which runs alone.
+        assert len(stub.times) == num_steps
+        assert np.allclose(stub.times, np.arange(1, num_steps + 1) * 0.1)
+        assert [list(mask_b) for mask_b in stub.resets] == \
+            [[True, True]] * 3 + [[True, False]]
+        with open(str(tmpdir.join('accuracy.txt'))) as f:
+            lines = f.read().splitlines()
+        assert [line.split()[0] for line in lines] == ['2', '4', '5']
+        assert all(len(line.split()) == 3 for line in lines)
+
+    def test_poisson_limit(self, tmpdir):
+        stub = self.get_stub(0)
+        stub._spiking_input = True
+        stub._num_poisson_events_per_sample = 2
+        # Spikes in the neuron of the class at every time step.
+        stub.input_encoder = SimpleNamespace(
+            name='poisson', encode=lambda x_b_l, num_steps, *args: np.repeat(
+                x_b_l[None], num_steps, 0))
+        x_test = np.eye(3)[[0, 1, 2, 0, 1]]
+        acc = AbstractSNN.run_continuous(stub, x_test, x_test, None,
+                                         str(tmpdir))
+        assert acc == 1
+        # Each sample spends its input spikes in the first two of its four
+        # time steps, also after its slot has been refilled.
+        spikecounts_t_b = np.sum(stub.inputs, 2)
+        assert spikecounts_t_b[:, 0].tolist() == [1, 1, 0, 0] * 3
+        assert spikecounts_t_b[:, 1].tolist() == [1, 1, 0, 0] * 2 + [0] * 4
+
+
+class TestPoissonInput:
+    """Test vectorized generation of Poisson input spikes."""
+
+    def test_regenerate_frames(self):
+        x_b_l = np.random.random_sample((3, 5, 5, 2))
+        sample_idxs_b = np.array([4, 5, 6])
+        input_t_b_l = get_poisson_frames(x_b_l, 20, 2, 42, sample_idxs_b)
+        for t in [0, 7, 19]:
+            assert np.array_equal(input_t_b_l[t], get_poisson_frames(
+                x_b_l, 1, 2, 42, sample_idxs_b, t)[0])
+        # Each sample has its own random stream. It is independent of the
+        # rest of the batch when the maximum input value is fixed.
+        x_max = np.max(x_b_l)
+        assert np.array_equal(input_t_b_l[:, 1], get_poisson_frames(
+            x_b_l[1:2], 20, 2, 42, sample_idxs_b[1:2], x_max=x_max)[:, 0])
+
+    def test_rates(self):
+        x_b_l = np.array([[0, 0.25, 0.5, 1]])
+        input_t_b_l = get_poisson_frames(x_b_l, 10000, 2, 0, [0])
+        assert np.allclose(np.mean(input_t_b_l, 0), x_b_l / 2, atol=0.02)
+
+
+def build_convolution_loop(weights, ny, nx, strides, padding):
+    """Reference that loops over each connection of a convolution layer."""
+
+    ky, kx = weights.shape[:2]
+    sy, sx = strides
+    py = (ky - 1) // 2
+    px = (kx - 1) // 2
+    if padding == 'valid':
+        mx = (nx - kx + 1) // sx
+        my = (ny - ky + 1) // sy
+        x0 = px
+        y0 = py
+    else:
+        mx = nx // sx
+        my = ny // sy
+        x0 = 0
+        y0 = 0
+    connections = []
+    for fout in range(weights.shape[3]):
+        for y in range(y0, ny - y0, sy):
+            for x in range(x0, nx - x0, sx):
+                target = int((x - x0) / sx + (y - y0) / sy * mx +
+                             fout * mx * my)
+                for fin in range(weights.shape[2]):
+                    for k in range(-py, py + 1):
+                        if not 0 <= y + k < ny:
+                            continue
+                        for j in range(-px, px + 1):
+                            if not 0 <= x + j < nx:
+                                continue
+                            source = j + x + (y + k) * nx + fin * nx * ny
+                            connections.append((source, target, weights[
+                                py - k, px - j, fin, fout], 1))
+    return connections
+
+
+class TestBuildConvolution:
+    """Test building the connections of a convolution layer."""
+
+    @pytest.mark.parametrize('strides', [(1, 1), (2, 2)])
+    @pytest.mark.parametrize('padding', ['valid', 'same'])
+    def test_matches_loop(self, strides, padding):
+        weights = np.random.randn(3, 3, 2, 4).astype('float32')
+        biases = np.random.randn(4).astype('float32')
+        ny, nx = 8, 6
+        out_shape = (ny // strides[0], nx // strides[1], 4)
+        layer = SimpleNamespace(
+            get_weights=lambda: [weights, biases], kernel_size=(3, 3),
+            input_shape=(None, ny, nx, 2), output_shape=(None,) + out_shape,
+            strides=strides, padding=padding)
+        connections, i_offset = build_convolution(layer, 1)
+        target = build_convolution_loop(weights, ny, nx, strides, padding)
+        assert np.array_equal(connections['source'], [c[0] for c in target])
+        assert np.array_equal(connections['target'], [c[1] for c in target])
+        assert np.allclose(connections['weight'], [c[2] for c in target])
+        assert np.all(connections['delay'] == 1)
+        assert np.array_equal(i_offset, np.repeat(biases, np.prod(
+            out_shape) // 4))
+
+
+class TestBuildDense:
+    """Test building the connections of a dense layer."""
+
+    @pytest.mark.parametrize('data_format', ['channels_last',
+                                             'channels_first'])
+    def test_matches_loop(self, data_format):
+        shape = (3, 4, 2)
+        weights = np.random.randn(24, 5).astype('float32')
+        if data_format == 'channels_last':
+            y_in, x_in, f_in = shape
+        else:
+            f_in, y_in, x_in = shape
+        target = []
+        for i in range(weights.shape[0]):
+            new_i = (i % f_in) * x_in * y_in + x_in * (i // (f_in * x_in)) + \
+                (i // f_in) % x_in
+            for j in range(weights.shape[1]):
+                target.append((new_i, j, weights[i, j], 1))
+        connections = build_dense(
+            weights, 1, get_flatten_permutation(shape, data_format))
+        assert np.array_equal(connections.tolist(), target)
+
+    def test_permutation(self):
+        # A Flatten layer on channels_last data maps the feature map
+        # (y, x, f) to the neuron f * rows * cols + y * cols + x.
+        x_l = np.random.random_sample((3, 4, 2))
+        permutation = get_flatten_permutation(x_l.shape, 'channels_last')
+        x_l_permuted = np.empty(x_l.size)
+        x_l_permuted[permutation] = np.ravel(x_l)
+        assert np.array_equal(x_l_permuted,
+                              np.ravel(np.moveaxis(x_l, -1, 0)))
+
+    def test_chunks(self):
+        weights = np.random.random_sample((10, 3))
+        permutation = np.random.permutation(10)
+        chunks = list(iter_dense_connections(weights, 1, permutation, 7))
+        assert len(chunks) == 5
+        assert np.array_equal(np.concatenate(chunks),
+                              build_dense(weights, 1, permutation))
+
+    def test_replicate(self):
+        connections = build_dense(np.random.random_sample((4, 3)), 1)
+        replicated = replicate_connections(connections, 4, 3, 2)
+        assert np.array_equal(replicated[:12], connections)
+        assert np.array_equal(replicated['source'][12:],
+                              connections['source'] + 4)
+        assert np.array_equal(replicated['target'][12:],
+                              connections['target'] + 3)
+        assert np.array_equal(replicated['weight'][12:],
+                              connections['weight'])
+
+
+def get_pooling_layer(layer_type, input_shape, pool_size, padding='valid'):
+    return type(layer_type, (SimpleNamespace,), {})(
+        input_shape=(None,) + input_shape, pool_size=pool_size,
+        strides=pool_size, padding=padding)
+
+
+class TestBuildPooling:
+    """Test building the connections of a pooling layer."""
+
+    def test_matches_loop(self):
+        nx, ny, nz, dx, dy = 6, 4, 3, 2, 2
+        layer = get_pooling_layer('AveragePooling2D', (ny, nx, nz), (dy, dx))
+        target = []
+        for fout in range(nz):
+            for y in range(0, ny - dy + 1, dy):
+                for x in range(0, nx - dx + 1, dx):
+                    t = x // dx + y // dy * (nx // dx) + fout * nx * ny // 4
+                    for k in range(dy):
+                        for j in range(dx):
+                            target.append((x + j + (y + k) * nx +
+                                           fout * nx * ny, t, 0.25, 1))
+        assert np.array_equal(build_pooling(layer, 1).tolist(), target)
+
+    @pytest.mark.parametrize('layer_type', ['AveragePooling2D',
+                                            'MaxPooling2D'])
+    def test_same_padding(self, layer_type):
+        layer = get_pooling_layer(layer_type, (5, 5, 2), (2, 2), 'same')
+        connections = build_pooling(layer, 1)
+        assert set(connections['source']) == set(range(50))
+        assert set(connections['target']) == set(range(18))
+        if layer_type == 'MaxPooling2D':
+            assert np.all(connections['weight'] == 1)
+        else:
+            # The weights of the neurons in each pool sum to one.
+            assert np.allclose(np.bincount(connections['target'],
+                                           connections['weight']), 1)
+
+    def test_maxpool_gates(self):
+        layer = get_pooling_layer('MaxPooling2D', (5, 5, 2), (2, 2), 'same')
+        connections = build_pooling(layer, 1)
+        input_connections, lateral_connections, output_connections = \
+            build_maxpool_gates(connections, 3, -3)
+        gates = np.arange(len(connections))
+        assert np.array_equal(input_connections['source'],
+                              connections['source'])
+        assert np.array_equal(input_connections['target'], gates)
+        assert np.array_equal(output_connections['source'], gates)
+        assert np.array_equal(output_connections['target'],
+                              connections['target'])
+        assert np.all(input_connections['weight'] == 3)
+        assert np.all(lateral_connections['weight'] == -3)
+        target = {(i, j) for i in gates for j in gates if i != j and
+                  connections['target'][i] == connections['target'][j]}
+        assert set(zip(lateral_connections['source'].tolist(),
+                       lateral_connections['target'].tolist())) == target
+        assert len(lateral_connections) == len(target)
+
+
+class TestConnectionFiles:
+    """Test the binary columnar format of the connectivity."""
+
+    def test_chunked_round_trip(self, tmpdir):
+        layer = get_pooling_layer('AveragePooling2D', (8, 8, 3), (2, 2))
+        connections = build_pooling(layer, 1)
+        writer = ConnectionWriter(str(tmpdir), 'pool')
+        for chunk in np.array_split(connections, 5):
+            writer.write(chunk)
+        assert writer.close() == len(connections)
+        restored = load_connections(str(tmpdir), 'pool')
+        for name in connection_dtype.names:
+            assert isinstance(restored[name], np.memmap)
+            assert restored[name].dtype == connection_dtype[name]
+            assert np.array_equal(restored[name], connections[name])
+
+    def test_manifest(self, tmpdir):
+        assert load_connectivity_manifest(str(tmpdir)) is None
+        connections = np.zeros(0, connection_dtype)
+        projections = [{'label': 'dense', 'pre': 'input',
+                        'num_connections': save_connections(
+                            str(tmpdir), 'dense', connections)}]
+        save_connectivity_manifest(str(tmpdir), projections)
+        assert load_connectivity_manifest(str(tmpdir)) == projections
+        assert len(load_connections(str(tmpdir), 'dense')['weight']) == 0
+
+
+class TestReshapeSpiketrains:
+    """Test scattering recorded spike times into an array."""
+
+    snn = SimpleNamespace(_dt=0.5, data_format='channels_first')
+
+    def test_matches_loop(self):
+        shape = (2, 3, 8)
+        spiketrains = [np.sort(np.random.choice(8, np.random.randint(5),
+                                                False)) * 0.5
+                       for _ in range(6)]
+        target = np.zeros((6, 8))
+        for k, spiketrain in enumerate(spiketrains):
+            for t in spiketrain:
+                target[k, int(t / 0.5)] = t
+        target = np.reshape(target, shape)
+        spiketrains_b_l_t = AbstractSNN.reshape_flattened_spiketrains(
+            self.snn, spiketrains, shape)
+        assert np.array_equal(spiketrains_b_l_t, target)
+
+        # Same spikes given as flat arrays of neuron indices and times.
+        neuron_idxs = np.repeat(np.arange(6), [len(s) for s in spiketrains])
+        spiketimes = np.concatenate(spiketrains)
+        order = np.argsort(spiketimes, kind='stable')
+        spiketrains_b_l_t = AbstractSNN.reshape_flattened_spiketrains(
+            self.snn, spiketimes[order], shape, neuron_idxs=neuron_idxs[order])
+        assert np.array_equal(spiketrains_b_l_t, target)
+
+
+class TestSparseSpiketrains:
+    """Test the sparse spike train format against dense arrays."""
+
+    def get_spiketrains(self):
+        spiketrains_b_l_t = np.random.random_sample((3, 2, 4, 6)) < 0.3
+        return spiketrains_b_l_t * np.arange(1, 7, dtype='float32')
+
+    def test_record(self):
+        target = self.get_spiketrains()
+        spiketrains = SparseSpiketrains(target.shape)
+        spiketrains[Ellipsis, 0] = target[..., 0]
+        spiketrains[[0, 2], Ellipsis, 1] = target[[0, 2], ..., 1]
+        spiketrains[1, Ellipsis, 1] = target[1, ..., 1]
+        spiketrains[Ellipsis, 2::2] = target[..., 2::2]
+        spiketrains[Ellipsis, 3::2] = target[..., 3::2]
+        assert spiketrains.count_nonzero() == np.count_nonzero(target)
+        assert np.array_equal(spiketrains.todense(), target)
+        assert np.array_equal(spiketrains[1], target[1])
+
+    def test_statistics(self):
+        target = self.get_spiketrains()
+        spiketrains = SparseSpiketrains.from_dense(target)
+        assert np.array_equal(spiketrains.get_spikecounts_b_t(),
+                              np.count_nonzero(target, (1, 2)))
+        fanout = np.random.randint(5, size=target.shape[1:-1])
+        assert np.array_equal(
+            spiketrains.get_spikecounts_b_t(fanout),
+            np.stack([get_layer_synaptic_operations(target[..., t], fanout)
+                      for t in range(target.shape[-1])], -1))
+
+    @pytest.mark.parametrize('spike_code', ['temporal_mean_rate', 'ttfs',
+                                            'ttfs_corrective'])
+    def test_rates(self, spike_code):
+        target = self.get_spiketrains()
+        spiketrains_n_b_l_t = [(target, 'a'), (target, 'b')]
+        rates_n_b_l = spiketrains_to_rates(
+            [(SparseSpiketrains.from_dense(s), n)
+             for s, n in spiketrains_n_b_l_t], 6, spike_code)
+        for (rates_b_l, _), (target_b_l, _) in zip(
+                rates_n_b_l, spiketrains_to_rates(spiketrains_n_b_l_t, 6,
+                                                  spike_code)):
+            assert np.allclose(rates_b_l, target_b_l)